@@ -0,0 +1,23 @@
+import type { Page } from "./types";
+
+/**
+ * Every item of a paginated list endpoint, following `next` to the last page
+ */
+export const fetchAll = async <T>(url: URL): Promise<T[]> => {
+  // As few pages as the server allows
+  url.searchParams.set("page_size", "1000");
+
+  const items: T[] = [];
+  let next: string | null = url.toString();
+  while (next) {
+    const resp = await fetch(next);
+    if (!resp.ok) {
+      throw Error(`Server responded with error code ${resp.status}`);
+    }
+    const page = (await resp.json()) as Page<T>;
+    items.push(...page.results);
+    next = page.next;
+  }
+
+  return items;
+};
@@ -6,6 +6,7 @@ import {
   type FunctionComponent,
 } from "react";
 import DatePicker from "react-datepicker";
+import { fetchAll } from "../api";
 import { API_BASE } from "../constants";
 import type { Appointment, Department, Employee } from "../types";
 import Button from "./Button";
@@ -33,18 +34,21 @@ const AppointmentDialog: FunctionComponent<
           return;
         }
 
+        // Organizer and participants come embedded, no lookups of their ids
         const resp = await fetch(
-          new URL(`/appointments/${appointmentId}/`, API_BASE)
+          new URL(
+            `/appointments/${appointmentId}/?expand=employee,participation`,
+            API_BASE
+          )
         );
 
         if (!resp.ok) {
           throw Error(`The server responded with error ${resp.status}`);
         }
 
-        const resp2 = await fetch(new URL("/departments/", API_BASE));
-        if (!resp2.ok) {
-          throw Error(`The server respoinded with error ${resp2.status}`);
-        }
+        const deps = await fetchAll<Department>(
+          new URL("/departments/", API_BASE)
+        );
 
         const data = await resp.json();
         setAppointment({
@@ -53,7 +57,6 @@ const AppointmentDialog: FunctionComponent<
           end: new Date(data.end),
         });
 
-        const deps = await resp2.json();
         setDetpartments(deps);
 
         setIsLoading(false);
@@ -72,19 +75,12 @@ const AppointmentDialog: FunctionComponent<
           throw Error("No department selected");
         }
 
-        const resp = await fetch(
+        // Paginated, larger departments take more than one page
+        const employees = await fetchAll<Employee>(
           new URL(`/departments/${selectedDepartment.id}/employees/`, API_BASE)
         );
 
-        if (!resp.ok) {
-          throw Error(`Server responded with error ${resp.status}`);
-        }
-
-        const data = await resp.json();
-
-        console.log(data);
-
-        setDepartmentEmployees(data);
+        setDepartmentEmployees(employees);
       } catch (error) {
         console.error(error);
       }
@@ -7,8 +7,8 @@ import {
 } from "react";
 import DatePicker from "react-datepicker";
 import "react-datepicker/dist/react-datepicker.css";
-import { API_BASE } from "../constants";
-import type { Appointment } from "../types";
+import { API_BASE, LIVE_UPDATES } from "../constants";
+import type { Appointment, AppointmentGroup, Page } from "../types";
 import AppointmentDialog from "./AppointmentDialog";
 import Button from "./Button";
 
@@ -16,68 +16,84 @@ import Button from "./Button";
  * This component contains graphics for the actual sidebar with the date picker and appointment boxes
  */
 const Calendar: FunctionComponent = () => {
-  const [appointments, setAppointments] = useState<Appointment[]>([]);
   const [overlapGroups, setOverlapGroups] = useState<Appointment[][]>([]);
   const [isLoading, setIsLoading] = useState(true);
   const [selectedDate, setSelectedDate] = useState<Date>(new Date(Date.now()));
   const dialogRef = useRef<HTMLDialogElement>(null);
   const [appointmentId, setAppointmentId] = useState<number>(0);
+  // Bumped by the server's change events to refetch the visible day
+  const [revision, setRevision] = useState(0);
+
+  // Only the visible day is requested, already grouped by the server, so the
+  //   payload and the work done here don't grow with the history
+  const dayKey = selectedDate.toDateString();
+
+  // Start on the day of the next appointment, looking up to a year ahead
+  useEffect(() => {
+    const fetchNext = async () => {
+      try {
+        const now = new Date(Date.now());
+        const until = new Date(now);
+        until.setFullYear(now.getFullYear() + 1);
+
+        const url = new URL("/appointments/", API_BASE);
+        url.searchParams.set("from", now.toISOString());
+        url.searchParams.set("to", until.toISOString());
+        url.searchParams.set("fields", "id,start");
+        url.searchParams.set("page_size", "50");
+        const resp = await fetch(url);
+
+        if (!resp.ok) {
+          throw Error(`Server responded with error code ${resp.status}`);
+        }
+        const page = (await resp.json()) as Page<{ id: number; start: string }>;
+        // The window also has the ones already going on, those are skipped
+        const next = page.results
+          .map(({ start }) => new Date(start))
+          .find((start) => start.getTime() >= now.getTime());
+
+        if (next) {
+          setSelectedDate(next);
+        }
+      } catch (error) {
+        console.error(error);
+      }
+    };
+
+    fetchNext();
+  }, []);
 
   useEffect(() => {
     const fetchAppointments = async () => {
       try {
+        // The local day, as instants, the server's time zone may differ
+        const from = new Date(dayKey);
+        const to = new Date(from);
+        to.setDate(from.getDate() + 1);
+
         // Would rather use tanstack query + axios, with queries/mutations generated with orval
         //   For simplicity's sake, here I'm using plain fetch
         //   Also, the API url base could be set externally e.g. using .env
-        const resp = await fetch(new URL("/appointments/", API_BASE));
+        const url = new URL("/appointments/layout/", API_BASE);
+        url.searchParams.set("from", from.toISOString());
+        url.searchParams.set("to", to.toISOString());
+        const resp = await fetch(url);
 
         if (!resp.ok) {
           throw Error(`Server responded with error code ${resp.status}`);
         }
-        const appointmentsRaw = await resp.json();
-        console.log(appointmentsRaw);
-
-        const appointments = (appointmentsRaw as Appointment[])
-          .map((a) => ({
-            ...a,
-            start: new Date(a.start),
-            end: new Date(a.end),
-          }))
-          .sort((first, second) => {
-            return first.start.getTime() - second.start.getTime();
-          });
-
-        setAppointments(appointments);
-
-        const overlaps: Appointment[][] = [];
-
-        const doesOverlap = (a: Appointment, b: Appointment) => {
-          return (
-            a.start.getTime() < b.end.getTime() &&
-            a.end.getTime() > b.start.getTime()
-          );
-        };
-
-        appointments.forEach((a) => {
-          if (!overlaps.length) {
-            overlaps.push([a]);
-            return;
-          }
-
-          const last = overlaps.pop();
-          if (last?.find((l) => doesOverlap(l, a))) {
-            last.push(a);
-            overlaps.push(last);
-            return;
-          }
-
-          if (last) {
-            overlaps.push(last);
-          }
-          overlaps.push([a]);
-        });
-
-        setOverlapGroups(overlaps);
+        const groupsRaw = (await resp.json()) as AppointmentGroup[];
+        console.log(groupsRaw);
+
+        setOverlapGroups(
+          groupsRaw.map(({ appointments }) =>
+            appointments.map((a) => ({
+              ...a,
+              start: new Date(a.start),
+              end: new Date(a.end),
+            }))
+          )
+        );
 
         setIsLoading(false);
       } catch (error) {
@@ -87,14 +103,31 @@ const Calendar: FunctionComponent = () => {
     };
 
     fetchAppointments();
-  }, []);
+  }, [dayKey, revision]);
 
   useEffect(() => {
-    setSelectedDate(
-      appointments.find(({ start }) => start.getTime() >= Date.now())?.start ??
-        new Date(Date.now())
+    if (!LIVE_UPDATES) {
+      return;
+    }
+
+    const from = new Date(dayKey);
+    const to = new Date(from);
+    to.setDate(from.getDate() + 1);
+
+    const url = new URL("/appointments/events/", API_BASE);
+    url.searchParams.set("from", from.toISOString());
+    url.searchParams.set("to", to.toISOString());
+
+    const events = new EventSource(url);
+    const refresh = () => setRevision((r) => r + 1);
+    ["created", "updated", "deleted", "resync"].forEach((kind) =>
+      events.addEventListener(kind, refresh)
     );
-  }, [appointments]);
+    // The server drops clients falling behind, reloading covers what was missed
+    events.addEventListener("overflow", refresh);
+
+    return () => events.close();
+  }, [dayKey]);
 
   const getAppointmentBoxTop = (a: Appointment) =>
     (a.start.getHours() - 5) * 64 + (a.start.getMinutes() / 60) * 64 - 26;
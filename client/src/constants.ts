@@ -1 +1,5 @@
 export const API_BASE = "http://localhost:8000";
+
+// Live updates over Server-Sent Events, they need the API served by an ASGI
+//   server (see the README), so they're off unless VITE_LIVE_UPDATES=true
+export const LIVE_UPDATES = import.meta.env.VITE_LIVE_UPDATES === "true";
@@ -21,9 +21,22 @@ export type Appointment = {
   participation: Employee[] | undefined;
 };
 
+export type AppointmentGroup = {
+  start: string;
+  end: string;
+  columns: number;
+  appointments: (Appointment & { column: number })[];
+};
+
 export type Department = {
   id: number;
   name: string;
   description: string;
   manager: number;
 };
+
+export type Page<T> = {
+  next: string | null;
+  previous: string | null;
+  results: T[];
+};
@@ -0,0 +1,118 @@
+from functools import wraps
+
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.exceptions import APIException, MethodNotAllowed
+from rest_framework.request import Request
+
+from api.conditional import set_validators, validators
+from api.filters import occurring, parse_window
+from api.handlers import custom_exception_handler
+from api.models import Appointment, Department
+from api.pagination import KeysetPagination
+from api.renderers import FastJSONRenderer
+from api.recurrence import occurrence_streams, split_series
+from api.reference_cache import reference_cache
+from api.replicas import reads_after
+from api.serializers import AppointmentSerializer, EmployeeSerializer
+from api.versions import get_versions
+from api.views import AppointmentViewSet, appointment_queryset
+
+# Async versions of the hottest reads, mounted under `/async/`: the appointment
+# list and detail and a department's employees.
+#
+# The queries go through the async ORM (`aget()`, `aiterator()`), so under
+# the ASGI entry point (`server.asgi`) a worker keeps serving other requests
+# while one waits on the database, where a sync worker sits blocked. The
+# responses are the same JSON as the DRF views', rendered by the same
+# serializers from the same querysets, with the same ETag/Last-Modified
+# handling, a current copy gets its 304 without a query. Writes and the
+# browsable API stay with the sync views.
+#
+# `manage.py benchmark_reads` compares the two paths.
+
+
+def render(data, status=200):
+    return HttpResponse(FastJSONRenderer().render(data), status=status,
+                        content_type='application/json')
+
+
+def async_api_view(tables):
+    '''Run an async read view of `tables` with a DRF `Request`, answering
+    conditional GETs from their version markers and turning API exceptions
+    into the same error responses the DRF views send'''
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                if request.method not in ('GET', 'HEAD'):
+                    raise MethodNotAllowed(request.method)
+                request = Request(request)
+                versions = get_versions(tables)
+                etag, last_modified = validators(request, versions, 'json')
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified)
+                if response is None:
+                    with reads_after(versions):
+                        response = await view(request, *args, **kwargs)
+                return set_validators(response, etag, last_modified)
+            except (APIException, Http404) as exc:
+                response = custom_exception_handler(exc, {})
+                return render(response.data, response.status_code)
+
+        return wrapper
+
+    return decorator
+
+
+async def paginated(queryset, serializer_class, request, view=None, streams=()):
+    paginator = KeysetPagination()
+    if streams:
+        page = await paginator.apaginate_merged(queryset, streams, request, view)
+    else:
+        page = await paginator.apaginate_queryset(queryset, request, view)
+    if page is None:
+        ordering = getattr(view, 'ordering', None) or paginator.ordering
+        page = [row async for row in queryset.order_by(*ordering).aiterator(chunk_size=2000)]
+        return serializer_class(page, many=True).data
+
+    data = serializer_class(page, many=True).data
+    return paginator.get_paginated_response(data).data
+
+
+@async_api_view(AppointmentViewSet.conditional_tables)
+async def appointment_list(request):
+    start, end = parse_window(request.query_params)
+    queryset = occurring(appointment_queryset(), start, end)
+    streams = ()
+    if start is not None and end is not None:
+        # Recurring appointments listed occurrence by occurrence, as by the sync view
+        queryset, series = split_series(queryset)
+        streams = occurrence_streams([item async for item in series], start, end)
+    return render(await paginated(queryset, AppointmentSerializer, request, AppointmentViewSet, streams))
+
+
+@async_api_view(AppointmentViewSet.conditional_tables)
+async def appointment_detail(request, pk):
+    try:
+        appointment = await appointment_queryset().aget(pk=pk)
+    except Appointment.DoesNotExist:
+        raise Http404('No Appointment matches the given query.')
+
+    return render(AppointmentSerializer(appointment).data)
+
+
+@async_api_view(('department', 'employee'))
+async def department_employees(request, pk):
+    async def compute():
+        try:
+            department = await Department.objects.aget(pk=pk)
+        except Department.DoesNotExist:
+            raise Http404('No Department matches the given query.')
+        return await paginated(department.employees.all(), EmployeeSerializer, request)
+
+    # Reference data, cached like the sync view's
+    return render(await reference_cache.aget_or_compute(
+        ('department', 'employee'),
+        ('department', 'employees', request.build_absolute_uri()), compute))
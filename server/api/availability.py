@@ -0,0 +1,85 @@
+import heapq
+from collections import defaultdict
+
+from django.db.models import Q
+
+from api.filters import during
+from api.models import Appointment
+from api.recurrence import expansions, series_overlapping
+
+
+def merge(intervals):
+    '''Merge `(start, end)` intervals sorted by start into disjoint ones, in a
+    single pass'''
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    return [tuple(interval) for interval in merged]
+
+
+def gaps(busy, start, end, min_length):
+    '''The parts of `[start, end)` not covered by the merged `busy` intervals,
+    that are at least `min_length` long'''
+    free = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_start - cursor >= min_length:
+            free.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if end - cursor >= min_length:
+        free.append((cursor, end))
+
+    return free
+
+
+def busy_intervals(employee_ids, start, end):
+    '''Merged busy intervals of each employee within `[start, end)`, and the
+    merged union of all of them.
+
+    One query, the union of the two ways of being busy, organizing
+    (`employee`, on the `(employee, start)` index) and participating (on the
+    participation table's `(employee_id, appointment_id)` index), as
+    `filters.involving()` does, an `OR` of the two would scan everything. The
+    rows come ordered by start, so every per-employee list is sorted as it's
+    built and merging is linear. Recurring appointments (api.recurrence) come with
+    them, their occurrences in the window are merged in, each series being
+    expanded once.'''
+    employee_ids = set(employee_ids)
+    columns = ('start', 'end', 'recurrence', 'recurrence_exceptions')
+    organizing = (Appointment.objects
+                  .filter(employee_id__in=employee_ids)
+                  .filter(Q(recurrence='') & during(start, end) | series_overlapping(start, end))
+                  .values_list('id', *columns, 'employee_id'))
+    Participation = Appointment.participation.through
+    participating = (Participation.objects
+                     .filter(employee_id__in=employee_ids)
+                     .filter(Q(appointment__recurrence='') & during(start, end, prefix='appointment__')
+                             | series_overlapping(start, end, prefix='appointment__'))
+                     .values_list('appointment_id', *(f'appointment__{c}' for c in columns), 'employee_id'))
+    rows = organizing.union(participating, all=True).order_by('start')
+
+    per_employee = defaultdict(list)
+    everyone = []
+    # Sorted interval lists of the series, and whose they are
+    series = {}
+    series_of = defaultdict(list)
+    for pk, row_start, row_end, recurrence, exceptions, employee in rows.iterator():
+        if recurrence:
+            if pk not in series:
+                series[pk] = [(max(s, start), min(e, end)) for s, e in expansions.get(
+                    row_start, row_end, recurrence, exceptions, start, end)]
+            series_of[employee].append(series[pk])
+            continue
+
+        interval = (max(row_start, start), min(row_end, end))
+        everyone.append(interval)
+        per_employee[employee].append(interval)
+
+    return ({employee: merge(heapq.merge(per_employee[employee], *series_of[employee]))
+             for employee in employee_ids},
+            merge(heapq.merge(everyone, *series.values())))
@@ -0,0 +1,43 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+class BatchRetrieveMixin:
+    '''Lets `list` fetch a set of objects by id, `?ids=3,1,2`, in one query.
+
+    The objects come in the order asked for, ids that don't exist (or are
+    filtered out) are listed in `missing`:
+
+        {"results": [{"id": 3, ...}, {"id": 1, ...}], "missing": [2]}
+
+    Other list parameters (filters, `fields`, `expand`) still apply, the
+    pagination doesn't.'''
+    batch_max_ids = 1000
+
+    def list(self, request, *args, **kwargs):
+        if 'ids' not in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        ids = self.parse_ids(request.query_params['ids'], queryset.model)
+
+        found = {obj.pk: obj for obj in queryset.filter(pk__in=ids)}
+        objects = [found[pk] for pk in ids if pk in found]
+
+        return Response({
+            'results': self.get_serializer(objects, many=True).data,
+            'missing': [pk for pk in ids if pk not in found],
+        })
+
+    def parse_ids(self, value, model):
+        try:
+            # Duplicates dropped, the order kept
+            ids = list(dict.fromkeys(
+                model._meta.pk.to_python(pk.strip()) for pk in value.split(',') if pk.strip()))
+        except DjangoValidationError:
+            raise ValidationError({'ids': 'A comma separated list of ids is required'})
+
+        if len(ids) > self.batch_max_ids:
+            raise ValidationError({'ids': f'At most {self.batch_max_ids} ids are accepted'})
+        return ids
@@ -0,0 +1,4 @@
+# Load testing: `data` fills the database with a synthetic company, `runner`
+# times every endpoint against it and writes the results as JSON, which
+# `compare()` checks against a previous run. Driven by the `generate_data` and
+# `benchmark` management commands.
@@ -0,0 +1,111 @@
+import random
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from api import occupancy
+from api.models import (Appointment, AppointmentTombstone, Department, DepartmentOccupancy, Employee,
+                        EmployeeOccupancy, Position)
+from api.signals import invalidate
+
+FIRST_NAMES = [
+    'Anna', 'Ben', 'Chloe', 'David', 'Emma', 'Felix', 'Grace', 'Henry', 'Isla', 'Jack',
+    'Katie', 'Leo', 'Mia', 'Noah', 'Olivia', 'Paul', 'Quinn', 'Ruby', 'Sam', 'Tara',
+    'Umar', 'Vera', 'Will', 'Xena', 'Yusuf', 'Zoe',
+]
+LAST_NAMES = [
+    'Adams', 'Baker', 'Clarke', 'Davies', 'Evans', 'Fischer', 'Garcia', 'Hughes', 'Ivanov',
+    'Jones', 'Kowalski', 'Lopez', 'Martin', 'Nowak', 'Owens', 'Patel', 'Quinn', 'Rossi',
+    'Smith', 'Taylor', 'Ueda', 'Varga', 'Walker', 'Xu', 'Young', 'Zimmermann',
+]
+POSITIONS = ['Engineer', 'Designer', 'Analyst', 'Manager', 'Director', 'Assistant']
+TOPICS = ['Standup', 'Planning', 'Review', 'One-on-one', 'Interview', 'Workshop',
+          'Retrospective', 'Demo', 'Sync', 'Training']
+
+
+def clear():
+    '''Empties the tables, skipping the per-row signals and cascades'''
+    with transaction.atomic():
+        for model in (Appointment.participation.through, AppointmentTombstone, Appointment,
+                      EmployeeOccupancy, DepartmentOccupancy):
+            model.objects.all()._raw_delete(model.objects.db)
+        Department.objects.update(manager=None)
+        for model in (Employee, Department, Position):
+            model.objects.all()._raw_delete(model.objects.db)
+    for name in ('appointment', 'employee', 'department', 'position'):
+        invalidate(name)
+
+
+def generate(departments=10, employees=500, days=30, appointments_per_day=200,
+             participants=3, seed=0, start=None, batch_size=5000):
+    '''Fills the database with a company of `employees` in `departments`, and
+    `appointments_per_day` appointments for `days` days from `start` (by
+    default centered on today), in working hours, with on average
+    `participants` participants, mostly from the organizer's department.
+    The same `seed` makes the same data. Returns the counts created.'''
+    rng = random.Random(seed)
+    if start is None:
+        start = timezone.localdate() - timedelta(days=days // 2)
+
+    with transaction.atomic():
+        positions = Position.objects.bulk_create([Position(name=name) for name in POSITIONS])
+        department_list = Department.objects.bulk_create([
+            Department(name=f'Department {i}', description=f'Synthetic department {i}')
+            for i in range(1, departments + 1)])
+
+        staff = []
+        for i in range(employees):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            staff.append(Employee(
+                name=f'{first} {last}', email=f'{first}.{last}.{i}@example.com'.lower(),
+                position=rng.choice(positions), department=rng.choice(department_list)))
+        staff = Employee.objects.bulk_create(staff, batch_size=batch_size)
+
+        by_department = {}
+        for employee in staff:
+            by_department.setdefault(employee.department_id, []).append(employee.pk)
+        for department in department_list:
+            members = by_department.get(department.pk)
+            if members:
+                department.manager_id = rng.choice(members)
+        Department.objects.bulk_update(department_list, ['manager'], batch_size=batch_size)
+
+        appointments = links = 0
+        Participation = Appointment.participation.through
+        for day in range(days):
+            date = start + timedelta(days=day)
+            batch, fan_out = [], []
+            for _ in range(appointments_per_day):
+                organizer = rng.choice(staff)
+                begins = timezone.make_aware(datetime.combine(date, time(8))) + timedelta(
+                    minutes=15 * rng.randrange(10 * 4))
+                batch.append(Appointment(
+                    start=begins, end=begins + timedelta(minutes=15 * rng.randint(1, 8)),
+                    title=rng.choice(TOPICS), description=f'{rng.choice(TOPICS)} with the team',
+                    employee=organizer))
+
+                colleagues = by_department[organizer.department_id]
+                count = min(rng.randint(0, 2 * participants), len(staff))
+                chosen = {rng.choice(colleagues) if rng.random() < 0.8 else rng.choice(staff).pk
+                          for _ in range(count)}
+                fan_out.append(chosen)
+
+            batch = Appointment.objects.bulk_create(batch, batch_size=batch_size)
+            rows = [Participation(appointment_id=appointment.pk, employee_id=pk)
+                    for appointment, chosen in zip(batch, fan_out) for pk in chosen]
+            Participation.objects.bulk_create(rows, batch_size=batch_size)
+            appointments += len(batch)
+            links += len(rows)
+
+    # bulk_create doesn't send the signals
+    for name in ('appointment', 'employee', 'department', 'position'):
+        invalidate(name)
+    occupancy.rebuild()
+
+    return {
+        'departments': len(department_list),
+        'employees': len(staff),
+        'appointments': appointments,
+        'participants': links,
+    }
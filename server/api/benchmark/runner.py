@@ -0,0 +1,406 @@
+import http.client
+import itertools
+import json
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import ExitStack
+from datetime import timedelta
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.db.models import Count
+from django.test import Client
+from django.urls import resolve
+from django.utils import timezone
+
+from api.instrumentation import RequestStats
+from api.models import Appointment, Department, Employee, Position
+
+# Times the endpoints of server/urls.py, through one of three targets:
+#
+#   'client'  Django's test client, in process, no HTTP
+#   'wsgi'    a threaded stdlib WSGI server started in process, over HTTP
+#   a URL     a server started separately, e.g. `uvicorn server.asgi:application
+#             --workers 4` or `gunicorn server.wsgi -w 4 --threads 4`
+#
+# Requests per endpoint are spread over `concurrency` threads, each sending
+# its next request as soon as the last one is answered. Query counts are
+# exact for the first two. A separate server only reports them when it runs
+# with API_INSTRUMENTATION, they're then read off its `/metrics/` (means per
+# view, so only right when nothing else hits the same views meanwhile).
+#
+# Left out: the event stream (never ends), the admin, and the metrics view.
+
+Endpoint = namedtuple('Endpoint', 'name path method body', defaults=('GET', None))
+
+
+def read_endpoints():
+    '''Every read endpoint, on ids and dates the data has'''
+    employee = (Employee.objects.filter(appointed_to__isnull=False).order_by('pk').first()
+                or Employee.objects.order_by('pk').first())
+    department = Department.objects.annotate(size=Count('employees')).order_by('-size', 'pk').first()
+    position = Position.objects.order_by('pk').first()
+    appointment = Appointment.objects.order_by('pk').first()
+    if None in (employee, department, position, appointment):
+        raise ValueError('Needs at least an employee, a department, a position and an appointment')
+
+    # The busiest stretch is in the middle of the generated days
+    count = Appointment.objects.count()
+    middle = Appointment.objects.order_by('start').values_list('start', flat=True)[count // 2]
+    day = timezone.localdate(middle)
+    week = day + timedelta(days=7)
+    ids = ','.join(str(pk) for pk in Employee.objects.order_by('pk').values_list('pk', flat=True)[:50])
+    window = f'from={day}&to={day}'
+
+    return [
+        Endpoint('employee-list', '/employees/?page_size=100'),
+        Endpoint('employee-list-expanded', '/employees/?page_size=100&expand=department,position'),
+        Endpoint('employee-batch', f'/employees/?ids={ids}'),
+        Endpoint('employee-detail', f'/employees/{employee.pk}/'),
+        Endpoint('employee-search', f'/employees/search/?q={employee.name[:3]}'),
+        Endpoint('employee-appointments', f'/employees/{employee.pk}/appointments/?from={day}&to={week}'),
+        Endpoint('employee-export', '/employees/export/'),
+        Endpoint('department-list', '/departments/'),
+        Endpoint('department-detail', f'/departments/{department.pk}/'),
+        Endpoint('department-employees', f'/departments/{department.pk}/employees/?page_size=100'),
+        Endpoint('position-list', '/positions/'),
+        Endpoint('position-detail', f'/positions/{position.pk}/'),
+        Endpoint('appointment-list', f'/appointments/?{window}&page_size=100'),
+        Endpoint('appointment-list-expanded',
+                 f'/appointments/?{window}&page_size=100&expand=employee,participation'),
+        Endpoint('appointment-detail', f'/appointments/{appointment.pk}/'),
+        Endpoint('appointment-changes', '/appointments/changes/'),
+        Endpoint('appointment-layout', f'/appointments/layout/?date={day}'),
+        Endpoint('appointment-export', f'/appointments/export/?{window}'),
+        Endpoint('availability', f'/availability/?department={department.pk}&{window}&duration=30'),
+        Endpoint('reference-cache', '/reference-cache/'),
+        Endpoint('health', '/health/'),
+        Endpoint('async-appointment-list', f'/async/appointments/?{window}&page_size=100'),
+        Endpoint('async-appointment-detail', f'/async/appointments/{appointment.pk}/'),
+        Endpoint('async-department-employees',
+                 f'/async/departments/{department.pk}/employees/?page_size=100'),
+    ]
+
+
+def write_endpoints(requests):
+    '''Creating, updating and deleting `requests` appointments, a year out so
+    they don't show up in the reads. Each endpoint is a function of the
+    request number, the later ones work on what the first one created.'''
+    employees = list(Employee.objects.order_by('pk').values_list('pk', flat=True)[:requests + 5])
+    if not employees:
+        raise ValueError('Needs at least an employee')
+    start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=365)
+    created = {}
+
+    def create(i):
+        begins = start + timedelta(hours=i)
+        return Endpoint('appointment-create', '/appointments/', 'POST', {
+            'start': begins.isoformat(), 'end': (begins + timedelta(minutes=30)).isoformat(),
+            'title': 'Benchmark', 'description': 'Benchmark',
+            'employee': employees[i % len(employees)],
+            'participation': employees[i % len(employees):][:3],
+        })
+
+    def update(i):
+        return Endpoint('appointment-update', f'/appointments/{created.get(i, 0)}/', 'PATCH',
+                        {'title': f'Benchmark {i}'})
+
+    def destroy(i):
+        return Endpoint('appointment-destroy', f'/appointments/{created.get(i, 0)}/', 'DELETE')
+
+    def remember(i, status, content):
+        if status == 201:
+            created[i] = json.loads(content)['id']
+
+    return [(create, remember), (update, None), (destroy, None)]
+
+
+class ClientTarget:
+    name = 'client'
+
+    def __init__(self):
+        self.clients = threading.local()
+
+    def request(self, endpoint):
+        if not hasattr(self.clients, 'client'):
+            self.clients.client = Client()
+        stats = RequestStats()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.clients.client.generic(
+                endpoint.method, endpoint.path,
+                json.dumps(endpoint.body) if endpoint.body is not None else '',
+                content_type='application/json')
+            content = (b''.join(response.streaming_content) if response.streaming
+                       else response.content)
+        return response.status_code, content, stats.queries
+
+    def snapshot(self):
+        return None
+
+    def mean_queries(self, endpoint, before):
+        return None
+
+    def close(self):
+        pass
+
+
+class HTTPTarget:
+    '''Any HTTP server, queries come from an `X-Benchmark-Queries` header, or
+    the server's `/metrics/`'''
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.name = url
+        secure = parts.scheme == 'https'
+        self.connection_class = http.client.HTTPSConnection if secure else http.client.HTTPConnection
+        self.host, self.port = parts.hostname, parts.port or (443 if secure else 80)
+        self.prefix = parts.path.rstrip('/')
+
+    def request(self, endpoint):
+        connection = self.connection_class(self.host, self.port, timeout=60)
+        try:
+            body = json.dumps(endpoint.body) if endpoint.body is not None else None
+            connection.request(endpoint.method, self.prefix + endpoint.path, body,
+                               {'Content-Type': 'application/json'} if body else {})
+            response = connection.getresponse()
+            content = response.read()
+        finally:
+            connection.close()
+        queries = response.getheader('X-Benchmark-Queries')
+        return response.status, content, int(queries) if queries is not None else None
+
+    def snapshot(self):
+        try:
+            status, content, _ = self.request(Endpoint('metrics', '/metrics/'))
+        except OSError:
+            return None
+        if status != 200:
+            return None
+        sums = {}
+        for kind, labels, value in re.findall(
+                r'^api_queries_(sum|count)\{([^}]*)\} (\S+)$', content.decode(), re.M):
+            sums[kind, labels] = float(value)
+        return sums
+
+    def mean_queries(self, endpoint, before):
+        after = self.snapshot()
+        if before is None or after is None:
+            return None
+        view = resolve(urlsplit(endpoint.path).path).view_name
+        labels = f'view="{view}",method="{endpoint.method}"'
+        count = after.get(('count', labels), 0) - before.get(('count', labels), 0)
+        total = after.get(('sum', labels), 0) - before.get(('sum', labels), 0)
+        return total / count if count else None
+
+    def close(self):
+        pass
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def counting_queries(application):
+    '''`application` answering with the number of queries it ran in an
+    `X-Benchmark-Queries` header. The body is buffered to count the queries
+    of streamed responses too.'''
+
+    def counted(environ, start_response):
+        started = {}
+
+        def capture(status, headers, exc_info=None):
+            started.update(status=status, headers=headers)
+
+        stats = RequestStats()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            result = application(environ, capture)
+            try:
+                body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        start_response(started['status'],
+                       started['headers'] + [('X-Benchmark-Queries', str(stats.queries))])
+        return [body]
+
+    return counted
+
+
+class WSGITarget(HTTPTarget):
+    '''A threaded `wsgiref` server on a free port, serving in this process'''
+
+    def __init__(self):
+        self.server = make_server('127.0.0.1', 0, counting_queries(WSGIHandler()),
+                                  ThreadingWSGIServer, QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        super().__init__(f'http://127.0.0.1:{self.server.server_port}')
+        self.name = 'wsgi'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def target_for(name):
+    if name == 'client':
+        return ClientTarget()
+    if name == 'wsgi':
+        return WSGITarget()
+    if name.startswith(('http://', 'https://')):
+        return HTTPTarget(name)
+    raise ValueError(f'Unknown target `{name}`, `client`, `wsgi` or a URL')
+
+
+def drive(work, requests, concurrency):
+    '''Calls `work(i)` for `i` in `range(requests)` on `concurrency` threads,
+    or right here for 1 (which keeps to the caller's database connection)'''
+    if concurrency <= 1:
+        for i in range(requests):
+            work(i)
+        return
+
+    numbers = itertools.count()
+    lock = threading.Lock()
+    failures = []
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    i = next(numbers)
+                if i >= requests:
+                    return
+                work(i)
+        except Exception as e:
+            failures.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        raise failures[0]
+
+
+def percentile(values, p):
+    '''Nearest rank percentile of sorted `values`'''
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def measure(target, make_endpoint, requests, concurrency, warmup=0, after=None):
+    '''Runs the endpoint `make_endpoint(i)` returns `requests` times and sums
+    it up. `after(i, status, content)` sees every response.'''
+    for i in range(warmup):
+        target.request(make_endpoint(i))
+
+    endpoint = make_endpoint(0)
+    latencies, queries, statuses = [None] * requests, [None] * requests, [None] * requests
+    before = target.snapshot()
+
+    def work(i):
+        request = make_endpoint(i)
+        started = time.perf_counter()
+        status, content, count = target.request(request)
+        latencies[i] = time.perf_counter() - started
+        queries[i], statuses[i] = count, status
+        if after is not None:
+            after(i, status, content)
+
+    started = time.perf_counter()
+    drive(work, requests, concurrency)
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency in latencies)
+    counted = [count for count in queries if count is not None]
+    if counted:
+        query_stats = {'mean': round(sum(counted) / len(counted), 2), 'max': max(counted)}
+    else:
+        mean = target.mean_queries(endpoint, before)
+        query_stats = {'mean': round(mean, 2) if mean is not None else None, 'max': None}
+
+    return endpoint.name, {
+        'method': endpoint.method,
+        'path': endpoint.path,
+        'requests': requests,
+        'errors': sum(status >= 400 for status in statuses),
+        'throughput': round(requests / elapsed, 1),
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'queries': query_stats,
+    }
+
+
+def run(target, requests=200, concurrency=4, warmup=10, only=None, writes=False, progress=None):
+    '''`{name: results}` of every endpoint, or those whose name matches the
+    regex `only`'''
+    pattern = re.compile(only) if only else None
+    results = {}
+
+    for endpoint in read_endpoints():
+        if pattern is None or pattern.search(endpoint.name):
+            name, result = measure(target, lambda i, e=endpoint: e, requests, concurrency, warmup)
+            results[name] = result
+            if progress:
+                progress(name, result)
+
+    if writes:
+        for make_endpoint, after in write_endpoints(requests):
+            if pattern is None or pattern.search(make_endpoint(0).name):
+                name, result = measure(target, make_endpoint, requests, concurrency, after=after)
+                results[name] = result
+                if progress:
+                    progress(name, result)
+
+    return results
+
+
+def compare(previous, current, tolerance=0.25, min_delta_ms=1.0):
+    '''Regressions of `current` over `previous` (two benchmark JSON outputs):
+    p95 latency up or throughput down by more than `tolerance`, more queries,
+    new errors. Latency differences under `min_delta_ms` are noise.'''
+    regressions = []
+    for name, now in current['endpoints'].items():
+        before = previous['endpoints'].get(name)
+        if before is None:
+            continue
+
+        p95, old_p95 = now['latency_ms']['p95'], before['latency_ms']['p95']
+        if p95 > old_p95 * (1 + tolerance) and p95 - old_p95 > min_delta_ms:
+            regressions.append(f'{name}: p95 {old_p95:.1f} -> {p95:.1f} ms')
+        if now['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(
+                f'{name}: throughput {before["throughput"]:.1f} -> {now["throughput"]:.1f} req/s')
+
+        queries, old_queries = now['queries']['max'], before['queries']['max']
+        if queries is not None and old_queries is not None and queries > old_queries:
+            regressions.append(f'{name}: queries {old_queries} -> {queries}')
+        if now['errors'] and not before['errors']:
+            regressions.append(f'{name}: {now["errors"]} errors')
+
+    return regressions
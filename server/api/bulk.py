@@ -0,0 +1,236 @@
+from collections import defaultdict
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from api.serializers import PreloadedPrimaryKeyRelatedField
+from api.signals import invalidate
+
+
+class BulkValidationError(ValidationError):
+    '''Per-item errors of a bulk request, `[{'index': ..., 'errors': ...}]`.
+
+    Set as-is, `ValidationError` would turn the indices into strings.'''
+
+    def __init__(self, errors):
+        super().__init__()
+        self.detail = {'errors': errors}
+
+
+class BulkMixin:
+    '''Adds a `bulk/` route to a `ModelViewSet` taking arrays of items:
+
+    - `POST` creates every item of the array,
+    - `PATCH` partially updates items, each of which has to carry its `id`,
+    - `DELETE` deletes the array of ids.
+
+    Related PKs of the whole batch are resolved with one `IN` query per
+    related model, rows and M2M links are written with `bulk_create`, and it
+    all happens in one transaction: if any item is invalid nothing is written
+    and the errors are returned by item index.
+
+    `bulk_create`/`bulk_update` don't send model signals, so viewsets list the
+    version markers to bump in `bulk_invalidates`.'''
+    bulk_max_items = 50000
+    bulk_batch_size = 1000
+    bulk_invalidates = ()
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items']})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({'non_field_errors': [
+                f'At most {self.bulk_max_items} items are accepted at once']})
+
+        with transaction.atomic():
+            if request.method == 'POST':
+                response = self.bulk_create(items)
+            elif request.method == 'PATCH':
+                response = self.bulk_update(items)
+            else:
+                response = self.bulk_destroy(items)
+
+            for name in self.bulk_invalidates:
+                invalidate(name)
+
+        self.bulk_done(response)
+        return response
+
+    def bulk_done(self, response):
+        '''Called after a successful bulk write'''
+        pass
+
+    def bulk_prepare(self, instance):
+        '''Called on every instance before it's written, for what `save()`
+        would have done. Returns the names of the fields it set.'''
+        return ()
+
+    def bulk_create(self, items):
+        validated = self.validate_items([(None, item) for item in items])
+        model = self.get_serializer_class().Meta.model
+
+        instances = []
+        relations = []
+        for serializer in validated:
+            data = dict(serializer.validated_data)
+            m2m = {f.name: data.pop(f.name)
+                   for f in model._meta.many_to_many if f.name in data}
+            instance = model(**data)
+            self.bulk_prepare(instance)
+            instances.append(instance)
+            relations.append(m2m)
+
+        model.objects.bulk_create(instances, batch_size=self.bulk_batch_size)
+        self.write_relations(model, instances, relations, replace=False)
+
+        return Response({'created': [i.pk for i in instances]},
+                        status=status.HTTP_201_CREATED)
+
+    def bulk_update(self, items):
+        model = self.get_serializer_class().Meta.model
+        pk_field = model._meta.pk
+
+        errors = []
+        ids = []
+        for index, item in enumerate(items):
+            try:
+                ids.append(pk_field.to_python(item['id']))
+            except (KeyError, TypeError, DjangoValidationError):
+                errors.append({'index': index, 'errors': {'id': ['A valid id is required']}})
+                ids.append(None)
+
+        existing = self.get_queryset().in_bulk([pk for pk in ids if pk is not None])
+        for index, pk in enumerate(ids):
+            if pk is not None and pk not in existing:
+                errors.append({'index': index, 'errors': {'id': [f'Invalid pk "{pk}" - object does not exist.']}})
+        if errors:
+            raise BulkValidationError(sorted(errors, key=lambda e: e['index']))
+
+        validated = self.validate_items(
+            [(existing[pk], item) for pk, item in zip(ids, items)], partial=True)
+
+        instances = []
+        relations = []
+        fields = set()
+        for serializer in validated:
+            instance = serializer.instance
+            data = dict(serializer.validated_data)
+            m2m = {f.name: data.pop(f.name)
+                   for f in model._meta.many_to_many if f.name in data}
+            for name, value in data.items():
+                setattr(instance, name, value)
+            fields.update(data)
+            fields.update(self.bulk_prepare(instance))
+            instances.append(instance)
+            relations.append(m2m)
+
+        # `bulk_update` skips `pre_save`, so `auto_now` fields are set here, they
+        # also record M2M-only changes
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                for instance in instances:
+                    field.pre_save(instance, add=False)
+                fields.add(field.name)
+
+        if fields:
+            model.objects.bulk_update(instances, list(fields), batch_size=self.bulk_batch_size)
+        self.write_relations(model, instances, relations, replace=True)
+
+        return Response({'updated': [i.pk for i in instances]})
+
+    def bulk_destroy(self, items):
+        model = self.get_serializer_class().Meta.model
+        pk_field = model._meta.pk
+        try:
+            ids = [pk_field.to_python(pk) for pk in items]
+        except (TypeError, DjangoValidationError):
+            raise ValidationError({'non_field_errors': ['Expected a list of ids']})
+
+        queryset = self.get_queryset().filter(pk__in=ids)
+        found = set(queryset.values_list('pk', flat=True))
+        queryset.delete()
+
+        return Response({
+            'deleted': [pk for pk in ids if pk in found],
+            'missing': [pk for pk in ids if pk not in found],
+        })
+
+    def validate_items(self, pairs, partial=False):
+        '''Run the serializer over every `(instance, data)` pair with the related
+        objects preloaded, and raise with the per-item errors if any fails'''
+        context = self.get_serializer_context()
+        context['preloaded'] = self.preload([data for _, data in pairs])
+
+        result = []
+        errors = []
+        for index, (instance, data) in enumerate(pairs):
+            serializer = self.get_serializer_class()(
+                instance, data=data, partial=partial, context=context)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+            result.append(serializer)
+
+        if errors:
+            raise BulkValidationError(errors)
+
+        return result
+
+    def preload(self, items):
+        '''Load every related object the items refer to, one query per model'''
+        querysets = {}
+        ids = defaultdict(set)
+
+        fields = self.get_serializer_class()().fields
+        for name, field in fields.items():
+            many = isinstance(field, serializers.ManyRelatedField)
+            relation = field.child_relation if many else field
+            if not isinstance(relation, PreloadedPrimaryKeyRelatedField) or relation.read_only:
+                continue
+
+            model = relation.get_queryset().model
+            querysets.setdefault(model, relation.get_queryset())
+            for item in items:
+                if not isinstance(item, dict) or item.get(name) is None:
+                    continue
+                values = item[name] if many else [item[name]]
+                if not isinstance(values, list):
+                    continue
+                for value in values:
+                    try:
+                        ids[model].add(model._meta.pk.to_python(value))
+                    except (TypeError, DjangoValidationError):
+                        # Left to the field to report
+                        pass
+
+        return {model: queryset.only('pk').in_bulk(ids[model])
+                for model, queryset in querysets.items()}
+
+    def write_relations(self, model, instances, relations, replace):
+        '''Write the M2M links straight into the through tables'''
+        for field in model._meta.many_to_many:
+            through = field.remote_field.through
+            source = field.m2m_field_name()
+            target = field.m2m_reverse_field_name()
+
+            changed = [(instance, relation[field.name])
+                       for instance, relation in zip(instances, relations)
+                       if field.name in relation]
+            if not changed:
+                continue
+
+            if replace:
+                through.objects.filter(
+                    **{f'{source}__in': [instance.pk for instance, _ in changed]}).delete()
+
+            links = []
+            for instance, targets in changed:
+                # The same participant twice would break the unique constraint
+                for pk in dict.fromkeys(t.pk for t in targets):
+                    links.append(through(**{f'{source}_id': instance.pk, f'{target}_id': pk}))
+            through.objects.bulk_create(links, batch_size=self.bulk_batch_size)
@@ -0,0 +1,117 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from api.models import AppointmentTombstone
+from api.pagination import CursorEncoder, seek
+
+# Incremental sync of appointments.
+#
+# The token holds two feed positions, `(updated_at, id)` of the last changed
+# appointment and `(deleted_at, id)` of the last tombstone sent, and each call
+# returns what comes after them in the respective index order. Timestamps are
+# taken at save time, before the commit, so rows only make it into the feed
+# once they're older than `APPOINTMENT_CHANGES_SETTLE_SECONDS`: a transaction
+# committing within that time can't slip behind a position already handed out.
+#
+# Tombstones are kept for `APPOINTMENT_TOMBSTONE_RETENTION_DAYS`, `manage.py
+# prune_tombstones` deletes older ones. The token also holds the time up to
+# which the client has seen every tombstone, one older than the retention may
+# have missed pruned deletions, so the feed starts over with `resync` set and
+# the client replaces what it has.
+
+CHANGED_ORDERING = ('updated_at', 'id')
+DELETED_ORDERING = ('deleted_at', 'id')
+
+
+def retention():
+    return timedelta(days=getattr(settings, 'APPOINTMENT_TOMBSTONE_RETENTION_DAYS', 30))
+
+
+def prune_tombstones():
+    '''Delete the tombstones past the retention, returns how many'''
+    deleted, _ = AppointmentTombstone.objects.filter(
+        deleted_at__lt=timezone.now() - retention()).delete()
+    return deleted
+
+
+def encode_token(changed, deleted, seen):
+    payload = json.dumps({'c': changed, 'd': deleted, 't': seen}, cls=CursorEncoder)
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_token(token):
+    def timestamp(value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError
+        return parsed
+
+    def position(value, ordering):
+        if value is None:
+            return None
+        value, pk = value
+        return {ordering[0]: timestamp(value), 'id': int(pk)}
+
+    try:
+        payload = json.loads(urlsafe_b64decode(token.encode()))
+        return (position(payload['c'], CHANGED_ORDERING),
+                position(payload['d'], DELETED_ORDERING),
+                # Tokens from before the retention have no time, they start over
+                timestamp(payload['t']) if payload.get('t') is not None else None)
+    except (TypeError, ValueError, KeyError):
+        raise ValidationError({'since': 'Invalid token'})
+
+
+def changes_since(appointments, token, limit):
+    '''Return `(changed, deleted_ids, next_token, has_more, resync)`.
+
+    `appointments` is the queryset to read the changed rows from. Without a
+    token, the feed starts from the beginning for appointments, which is the
+    initial load, and from now for tombstones, nothing was deleted yet from
+    the client's point of view. A token older than the tombstones kept starts
+    over the same way, with `resync` set.'''
+    now = timezone.now()
+    settled = now - timedelta(
+        seconds=getattr(settings, 'APPOINTMENT_CHANGES_SETTLE_SECONDS', 2))
+
+    tombstones = AppointmentTombstone.objects.filter(deleted_at__lte=settled)
+    resync = False
+    if token:
+        changed_from, deleted_from, seen = decode_token(token)
+        resync = seen is None or seen < now - retention()
+    if not token or resync:
+        changed_from = None
+        latest = tombstones.order_by(*(f'-{f}' for f in DELETED_ORDERING)).first()
+        deleted_from = ({f: getattr(latest, f) for f in DELETED_ORDERING}
+                        if latest else None)
+
+    changed = appointments.filter(updated_at__lte=settled)
+    if changed_from is not None:
+        changed = changed.filter(seek(CHANGED_ORDERING, changed_from))
+    changed = list(changed.order_by(*CHANGED_ORDERING)[:limit + 1])
+
+    if deleted_from is not None:
+        tombstones = tombstones.filter(seek(DELETED_ORDERING, deleted_from))
+    deleted = list(tombstones.order_by(*DELETED_ORDERING)[:limit + 1])
+
+    more_deleted = len(deleted) > limit
+    has_more = len(changed) > limit or more_deleted
+    changed, deleted = changed[:limit], deleted[:limit]
+
+    def last(rows, ordering, default):
+        if not rows:
+            return None if default is None else [default[f] for f in ordering]
+        return [getattr(rows[-1], f) for f in ordering]
+
+    # Every tombstone up to `settled` was sent, unless there are more to page through
+    seen = deleted[-1].deleted_at if more_deleted else settled
+    next_token = encode_token(last(changed, CHANGED_ORDERING, changed_from),
+                              last(deleted, DELETED_ORDERING, deleted_from), seen)
+
+    return changed, [t.appointment_id for t in deleted], next_token, has_more, resync
@@ -0,0 +1,63 @@
+from hashlib import sha1
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from api.expand import tables_read
+from api.replicas import reads_after
+from api.versions import get_versions
+
+
+class ConditionalMixin:
+    '''Answers conditional GETs of `list` and `retrieve` from the version
+    markers of `conditional_tables` alone.
+
+    The ETag is a hash of those versions, of the tables of `expand`ed
+    relations, and of the request (path, query string, negotiated format),
+    Last-Modified is the latest version. When the client's copy is current
+    the 304 goes out without a query or running the serializer. Otherwise
+    the response is read within `reads_after()`, from a replica only if it
+    has the writes its ETag says. Other actions can use `conditional()` with
+    their own tables, views outside DRF `validators()` and `set_validators()`.'''
+    conditional_tables = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(
+            super().list, self.conditional_tables, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(
+            super().retrieve, self.conditional_tables, request, *args, **kwargs)
+
+    def conditional(self, handler, tables, request, *args, **kwargs):
+        versions = get_versions(tables_read(self, tables))
+        etag, last_modified = validators(request, versions, request.accepted_renderer.format)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            with reads_after(versions):
+                response = handler(request, *args, **kwargs)
+
+        return set_validators(response, etag, last_modified)
+
+
+def validators(request, versions, format):
+    '''The ETag and Last-Modified (a timestamp, `None` without tables) of a
+    GET reading the tables of `versions` (`get_versions()`), rendered as
+    `format`'''
+    etag = quote_etag(sha1(repr((
+        request.get_full_path(),
+        format,
+        sorted(versions.items()),
+    )).encode()).hexdigest())
+    last_modified = max(versions.values()) // 10 ** 9 if versions else None
+    return etag, last_modified
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+    return response
@@ -0,0 +1,118 @@
+from collections import defaultdict
+from itertools import chain, takewhile
+
+from django.db import connection
+from django.db.models import F, Func
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from api.filters import during
+from api.models import Appointment
+from api.occupancy import HORIZON
+from api.recurrence import expansions, occurrences, series_overlapping
+
+
+class AppointmentConflict(APIException):
+    '''Some participants are already booked for the requested time.
+
+    `conflicts` maps employee ids to the ids of the appointments they're in,
+    it's set on `detail` directly, so the ids aren't turned into strings.'''
+    status_code = status.HTTP_409_CONFLICT
+    default_code = 'conflict'
+
+    def __init__(self, conflicts):
+        super().__init__()
+        self.detail = {
+            'detail': 'Some participants already have an appointment at this time',
+            'conflicts': [{'employee': employee, 'appointments': appointments}
+                          for employee, appointments in conflicts.items()],
+        }
+
+
+def overlapping_during(queryset, start, end, prefix=''):
+    '''Filter `queryset` to the appointments (reached through `prefix`)
+    overlapping `[start, end)`.
+
+    On PostgreSQL this is a `tstzrange(start, end) && tstzrange(...)` test,
+    which is answered by the GiST index of migration 0006. Elsewhere it's the
+    plain "starts before the other ends" pair of `filters.during()`, a range
+    scan on the `(start, end)` index.'''
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.fields import DateTimeRangeField
+
+        span = Func(F(f'{prefix}start'), F(f'{prefix}end'), function='tstzrange',
+                    output_field=DateTimeRangeField())
+        return queryset.alias(during=span).filter(during__overlap=(start, end))
+
+    return queryset.filter(during(start, end, prefix))
+
+
+def find_conflicts(start, end, employee_ids, exclude=None, recurrence='', exceptions=()):
+    '''Return `{employee_id: [appointment_id, ...]}` for the given employees'
+    appointments overlapping `[start, end)`, being either the organizer or a
+    participant. Four queries however many employees are checked.
+
+    Recurring appointments (api.recurrence) are compared by their
+    occurrences, those of the series booked and, with `recurrence`, those of
+    the one being written. Endless series are checked up to `HORIZON` ahead,
+    as far as api.occupancy counts them.'''
+    employee_ids = set(employee_ids)
+    if not employee_ids:
+        return {}
+
+    if recurrence:
+        times = list(takewhile(lambda occurrence: occurrence[0] < start + HORIZON,
+                               occurrences(start, end, recurrence, exceptions)))
+        if not times:
+            return {}
+        start, end = times[0][0], max(e for _, e in times)
+    else:
+        times = [(start, end)]
+
+    organized = Appointment.objects.filter(employee_id__in=employee_ids)
+    Participation = Appointment.participation.through
+    participating = Participation.objects.filter(employee_id__in=employee_ids)
+    if exclude is not None:
+        organized = organized.exclude(pk=exclude)
+        participating = participating.exclude(appointment_id=exclude)
+    series = Appointment.objects.filter(series_overlapping(start, end))
+
+    # (id, start, end, recurrence, exceptions, employee)
+    rows = chain(
+        overlapping_during(organized.filter(recurrence=''), start, end)
+        .values_list('id', 'start', 'end', 'recurrence', 'recurrence_exceptions', 'employee_id'),
+        overlapping_during(participating.filter(appointment__recurrence=''), start, end,
+                           prefix='appointment__')
+        .values_list('appointment_id', 'appointment__start', 'appointment__end',
+                     'appointment__recurrence', 'appointment__recurrence_exceptions', 'employee_id'),
+        organized.filter(pk__in=series)
+        .values_list('id', 'start', 'end', 'recurrence', 'recurrence_exceptions', 'employee_id'),
+        participating.filter(appointment__in=series)
+        .values_list('appointment_id', 'appointment__start', 'appointment__end',
+                     'appointment__recurrence', 'appointment__recurrence_exceptions', 'employee_id'),
+    )
+
+    conflicts = defaultdict(set)
+    for appointment, row_start, row_end, row_recurrence, row_exceptions, employee in rows:
+        booked = (expansions.get(row_start, row_end, row_recurrence, row_exceptions or (), start, end)
+                  if row_recurrence else [(row_start, row_end)])
+        if overlap(times, booked):
+            conflicts[employee].add(appointment)
+
+    return {employee: sorted(appointments)
+            for employee, appointments in sorted(conflicts.items())}
+
+
+def overlap(intervals, others):
+    '''Whether any of the sorted `(start, end)` `intervals` overlaps any of
+    the sorted `others`, in one pass over both'''
+    intervals, others = iter(intervals), iter(others)
+    a, b = next(intervals, None), next(others, None)
+    while a is not None and b is not None:
+        if a[0] < b[1] and b[0] < a[1]:
+            return True
+        if a[1] <= b[1]:
+            a = next(intervals, None)
+        else:
+            b = next(others, None)
+    return False
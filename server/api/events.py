@@ -0,0 +1,165 @@
+import asyncio
+import itertools
+import json
+import threading
+from collections import namedtuple
+from functools import partial
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+from api.filters import parse_window
+
+# Push feed of appointment changes over Server-Sent Events.
+#
+# Views publish events to the in-process `broadcaster`, which fans them out to
+# the subscribers' queues. Those are bounded: a subscriber that can't keep up
+# is sent an `overflow` event and disconnected, instead of piling up events,
+# and is expected to catch up through `/appointments/changes/` and reconnect.
+#
+# Streaming needs the ASGI entry point (`server.asgi`) under an ASGI server,
+# `uvicorn server.asgi:application` (see the README). Under WSGI the stream
+# would hold a worker forever, so it's refused there. Only the writes handled
+# by the same process are seen. Running several processes would need a shared
+# channel (e.g. Redis pub/sub) feeding `publish()`.
+
+Event = namedtuple('Event', ['kind', 'id', 'start', 'end', 'employees', 'data'])
+
+
+class Subscriber:
+    def __init__(self, loop, max_queue, start=None, end=None, employee=None):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.start = start
+        self.end = end
+        self.employee = employee
+        self.overflowed = False
+
+    def wants(self, event):
+        if event.start is None:
+            # Feed-wide events, e.g. a bulk write
+            return True
+        if self.employee is not None and self.employee not in event.employees:
+            return False
+        if self.start is not None and event.end <= self.start:
+            return False
+        if self.end is not None and event.start >= self.end:
+            return False
+        return True
+
+    def deliver(self, event):
+        # Runs on the subscriber's event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            # Make room for the wake-up, the queued events are dropped anyway
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class Broadcaster:
+    def __init__(self, max_queue=100, max_subscribers=10000):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def subscribe(self, **filters):
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(asyncio.get_running_loop(), self.max_queue, **filters)
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, kind, data, start=None, end=None, employees=()):
+        '''Send an event to every interested subscriber. Safe to call from any
+        thread, sync views included.'''
+        with self.lock:
+            event = Event(kind, next(self.ids), start, end, frozenset(employees), data)
+            subscribers = [s for s in self.subscribers if s.wants(event)]
+
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+            except RuntimeError:
+                # The loop is closed, the subscriber is going away
+                self.unsubscribe(subscriber)
+
+
+broadcaster = Broadcaster()
+
+
+def publish_appointment(kind, appointment, data):
+    '''Publish an appointment event once the transaction commits. What
+    subscribers filter on is read right away, it may be gone by then.'''
+    employees = {e.pk for e in appointment.participation.all()}
+    if appointment.employee_id is not None:
+        employees.add(appointment.employee_id)
+
+    transaction.on_commit(partial(
+        broadcaster.publish, kind, data, appointment.start, appointment.end, employees))
+
+
+def format_event(kind, data, event_id=None):
+    lines = [f'event: {kind}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+KEEPALIVE_SECONDS = 15
+
+
+async def appointment_events(request):
+    '''SSE stream of appointment `created`/`updated`/`deleted` events, limited
+    to a `from`/`to` window and/or an `employee` (organizer or participant)'''
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': 'Events are only served by the ASGI application',
+                             'status_code': 501}, status=501)
+
+    try:
+        start, end = parse_window(request.GET)
+        employee = int(request.GET['employee']) if request.GET.get('employee') else None
+    except (ValidationError, ValueError):
+        return JsonResponse({'detail': 'Invalid `from`, `to` or `employee`', 'status_code': 400},
+                            status=400)
+
+    subscriber = broadcaster.subscribe(start=start, end=end, employee=employee)
+    if subscriber is None:
+        return JsonResponse({'detail': 'Too many subscribers', 'status_code': 503}, status=503)
+
+    async def stream():
+        try:
+            yield f'retry: {KEEPALIVE_SECONDS * 1000}\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+
+                if event is None:
+                    yield format_event('overflow', {'detail': 'Too slow, resync and reconnect'})
+                    return
+                yield format_event(event.kind, event.data, event.id)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,189 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from api.instrumentation import SerializeTimingMixin
+
+# Sparse fieldsets and embedded relations, picked by the client.
+#
+#   ?fields=id,title,employee.name   only these fields, `employee.name` being
+#                                    the `name` of the embedded employee
+#   ?expand=employee,employee.department,participation
+#                                    related objects inline instead of ids
+#
+# `ExpandableSerializerMixin` trims and embeds the fields, rendering related
+# objects with the serializers of `expanded_serializers`. `ExpandMixin` hands
+# the parameters of `list`/`retrieve` requests to the serializer and shapes
+# the queryset to match: `only()` the columns rendered, `select_related()`
+# for embedded foreign keys, `prefetch_related()` for many-to-many fields,
+# so any combination costs a fixed number of queries. The tables embedded
+# objects come from (`expanded_tables()`) go into the ETags and cache keys
+# along with the view's own.
+
+# {model: serializer class} rendering embedded objects, filled in by
+# api/serializers.py
+expanded_serializers = {}
+
+
+def parse_paths(value, param):
+    '''Turn `a,b.c,b.d` into the tree `{'a': {}, 'b': {'c': {}, 'd': {}}}`'''
+    tree = {}
+    for path in (value or '').split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for name in path.split('.'):
+            if not name:
+                raise ValidationError({param: f'Invalid path `{path}`'})
+            node = node.setdefault(name, {})
+
+    return tree
+
+
+def related_model(model, name):
+    field = model._meta.get_field(name)
+    if not field.is_relation or field.related_model is None:
+        return None, False
+    return field.related_model, field.many_to_many or field.one_to_many
+
+
+def expanded_models(model, expand):
+    '''The models the `expand` tree embeds, paths that don't resolve are left
+    to the serializer to reject'''
+    for name, subtree in (expand or {}).items():
+        try:
+            related, _ = related_model(model, name)
+        except FieldDoesNotExist:
+            continue
+        if related is not None:
+            yield related
+            yield from expanded_models(related, subtree)
+
+
+def tables_read(view, tables):
+    '''`tables` and those of the relations the request embeds (`expand`)'''
+    expanded = getattr(view, 'expanded_tables', None)
+    return tuple(dict.fromkeys((*tables, *expanded()))) if expanded else tuple(tables)
+
+
+class ExpandableListSerializer(SerializeTimingMixin, serializers.ListSerializer):
+    pass
+
+
+class ExpandableSerializerMixin(SerializeTimingMixin):
+    '''Takes `fields` and `expand` trees (see `parse_paths()`), or reads them
+    from the `fields`/`expand` entries of the context. Its `Meta` should name
+    `ExpandableListSerializer` as `list_serializer_class`, so lists are timed
+    too.'''
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields_tree = fields
+        self.expand_tree = expand
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.fields_tree if self.fields_tree is not None else self.context.get('fields')
+        expand = self.expand_tree if self.expand_tree is not None else self.context.get('expand')
+        selected, expand = selected or {}, expand or {}
+
+        model = self.Meta.model
+        for name, subtree in expand.items():
+            related, many = (related_model(model, name) if name in fields else (None, False))
+            if related not in expanded_serializers:
+                raise ValidationError({'expand': f'`{name}` can\'t be expanded'})
+            # Passed even when empty, or they'd read the top level's from the context
+            fields[name] = expanded_serializers[related](
+                many=many, read_only=True, fields=selected.get(name, {}), expand=subtree)
+
+        if selected:
+            unknown = set(selected) - set(fields)
+            if unknown:
+                raise ValidationError({'fields': f'Unknown fields: {", ".join(sorted(unknown))}'})
+            fields = {name: field for name, field in fields.items() if name in selected}
+
+        return fields
+
+
+def plan(model, fields, expand, prefix=''):
+    '''The `(only, select_related, prefetch_related)` arguments loading what a
+    serializer renders with these `fields` and `expand` trees'''
+    fields, expand = fields or {}, expand or {}
+    only, select, prefetch = [prefix + model._meta.pk.name], [], []
+
+    for field in model._meta.concrete_fields:
+        if fields and field.name not in fields or field.primary_key:
+            continue
+        only.append(prefix + field.name)
+        if field.is_relation and field.name in expand:
+            select.append(prefix + field.name)
+            sub_only, sub_select, sub_prefetch = plan(
+                field.related_model, fields.get(field.name), expand[field.name],
+                f'{prefix}{field.name}__')
+            only += sub_only
+            select += sub_select
+            prefetch += sub_prefetch
+
+    for field in model._meta.many_to_many:
+        if fields and field.name not in fields:
+            continue
+        related = field.related_model
+        if field.name in expand:
+            queryset = optimize(related.objects.order_by('pk'),
+                                fields.get(field.name), expand[field.name])
+        else:
+            # Rendered as ids
+            queryset = related.objects.only('pk').order_by('pk')
+        prefetch.append(Prefetch(prefix + field.name, queryset=queryset))
+
+    return only, select, prefetch
+
+
+def optimize(queryset, fields, expand, extra=()):
+    '''`queryset` loading exactly what's rendered with these trees, in one
+    query plus one per many-to-many field. `extra` columns are loaded too,
+    e.g. the pagination key.'''
+    only, select, prefetch = plan(queryset.model, fields, expand)
+
+    queryset = queryset.prefetch_related(None)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if fields:
+        queryset = queryset.only(*only, *extra)
+    return queryset
+
+
+class ExpandMixin:
+    '''Accepts `fields` and `expand` on `list` and `retrieve`'''
+    expand_actions = ('list', 'retrieve')
+    # Fields loaded even when `fields` leaves them out, besides the ordering
+    expand_always_load = ()
+
+    def get_expand_params(self):
+        if getattr(self, 'action', None) not in self.expand_actions:
+            return None, None
+        params = self.request.query_params
+        return parse_paths(params.get('fields'), 'fields'), parse_paths(params.get('expand'), 'expand')
+
+    def expanded_tables(self):
+        '''Version markers of the models `expand` embeds'''
+        _, expand = self.get_expand_params()
+        return tuple(sorted({related._meta.model_name
+                             for related in expanded_models(self.queryset.model, expand)}))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields, expand = self.get_expand_params()
+        if fields or expand:
+            queryset = optimize(queryset, fields, expand,
+                                (*(getattr(self, 'ordering', None) or ()), *self.expand_always_load))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'], context['expand'] = self.get_expand_params()
+        return context
@@ -0,0 +1,67 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+
+
+class Echo:
+    '''File-like object handing back what `csv.writer` writes, so rows can be
+    yielded one by one instead of buffered'''
+
+    def write(self, value):
+        return value
+
+
+class ExportMixin:
+    '''Adds an `export/` route to a `ModelViewSet` streaming its whole queryset
+    as NDJSON (default) or CSV, picked with `?type=`.
+
+    Rows are read with `iterator(chunk_size=...)`, so memory stays flat with
+    any table size; prefetches run per chunk. Each row is rendered by the
+    viewset's own serializer, so the shape is the same as the list's.'''
+    export_chunk_size = 2000
+    export_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    @action(detail=False)
+    def export(self, request):
+        export_type = request.query_params.get('type', 'ndjson')
+        if export_type not in self.export_types:
+            raise ValidationError({'type': f'Must be one of {", ".join(self.export_types)}'})
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by(
+            *(getattr(self, 'ordering', None) or ('pk',)))
+        # The rows are read once the view has returned, settle the database
+        # (e.g. a read replica) while the request's routing still applies
+        queryset = queryset.using(queryset.db)
+        rows = (self.get_serializer(instance).data for instance in self.export_instances(queryset))
+
+        stream = self.stream_csv(rows) if export_type == 'csv' else self.stream_ndjson(rows)
+        response = StreamingHttpResponse(stream, content_type=self.export_types[export_type])
+        response['Content-Disposition'] = f'attachment; filename="{self.basename}.{export_type}"'
+
+        return response
+
+    def export_instances(self, queryset):
+        return queryset.iterator(chunk_size=self.export_chunk_size)
+
+    def stream_ndjson(self, rows):
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+    def stream_csv(self, rows):
+        writer = csv.writer(Echo())
+        fields = list(self.get_serializer().fields)
+        # The header goes out before the query even runs
+        yield writer.writerow(fields)
+
+        for row in rows:
+            yield writer.writerow([
+                ' '.join(map(str, value)) if isinstance(value, list) else value
+                for value in (row.get(f) for f in fields)
+            ])
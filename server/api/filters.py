@@ -0,0 +1,120 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from api.models import MAX_DURATION
+from api.recurrence import series_overlapping
+
+
+def parse_datetime_param(query_params, name, end_of_day=False):
+    '''Parse an ISO date or datetime query parameter into an aware datetime.
+
+    A bare date is read as midnight, or as the following midnight when
+    `end_of_day` is set, so `?from=2025-06-09&to=2025-06-09` covers the whole day.
+    Returns `None` when the parameter is missing.'''
+    raw = query_params.get(name)
+    if raw is None or raw == '':
+        return None
+
+    try:
+        day = parse_date(raw)
+        value = parse_datetime(raw) if day is None else None
+    except ValueError:
+        day = value = None
+
+    if day is not None:
+        value = datetime.combine(day, time.min)
+        if end_of_day:
+            value += timedelta(days=1)
+    elif value is None:
+        raise ValidationError({name: f'Invalid date or datetime: {raw}'})
+
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+
+    return value
+
+
+def parse_window(query_params, start_param='from', end_param='to'):
+    '''Read a `[from, to)` window out of the query parameters.
+
+    Either side may be omitted, in which case the window is open on that side.'''
+    start = parse_datetime_param(query_params, start_param)
+    end = parse_datetime_param(query_params, end_param, end_of_day=True)
+
+    if start is not None and end is not None and start >= end:
+        raise ValidationError({end_param: f'`{end_param}` must be later than `{start_param}`'})
+
+    return start, end
+
+
+def parse_day(query_params, name='date'):
+    '''Read a required ISO date parameter and return the `[start, end)` of that
+    day in the current time zone'''
+    raw = query_params.get(name)
+    try:
+        day = parse_date(raw) if raw else None
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: 'A date in YYYY-MM-DD format is required'})
+
+    start = timezone.make_aware(datetime.combine(day, time.min))
+
+    return day, start, start + timedelta(days=1)
+
+
+def during(start, end, prefix=''):
+    '''A `Q` of the appointments (reached through `prefix`) overlapping
+    `[start, end)`, either side may be `None`.
+
+    Two intervals overlap when each one starts before the other ends, the same
+    rule the calendar uses on the client. With only that, the `(start, end)`
+    index is scanned from the first appointment ever up to `end`, appointments
+    last at most `MAX_DURATION` so the scan can start that long before `start`.'''
+    condition = Q()
+    if end is not None:
+        condition &= Q(**{f'{prefix}start__lt': end})
+    if start is not None:
+        condition &= Q(**{f'{prefix}end__gt': start})
+        try:
+            condition &= Q(**{f'{prefix}start__gt': start - MAX_DURATION})
+        except OverflowError:
+            pass  # Nothing starts before year 1 anyway
+
+    return condition
+
+
+def overlapping(queryset, start, end):
+    '''Restrict an appointment queryset to rows overlapping `[start, end)`'''
+    return queryset.filter(during(start, end))
+
+
+def occurring(queryset, start, end):
+    '''`overlapping()` for lists that expand recurring appointments
+    (api.recurrence): series are kept when any of their occurrences may
+    overlap `[start, end)`, not just the first one'''
+    if start is None and end is None:
+        return queryset
+
+    return queryset.filter(Q(recurrence='') & during(start, end) | series_overlapping(start, end))
+
+
+def involving(queryset, employee_id, start=None, end=None):
+    '''Restrict an appointment queryset to those `employee_id` organizes or
+    takes part in, occurring within `[start, end)`.
+
+    The two ways are looked up separately and unioned by id, each on its own
+    index, `(employee, start)` for organizers and `(employee_id,
+    appointment_id)` of the participation table for participants. An `OR` of
+    the two would leave the database no better plan than a full scan.'''
+    Appointment = queryset.model
+    organizing = occurring(
+        Appointment.objects.filter(employee_id=employee_id), start, end).values('id')
+    participating = occurring(
+        Appointment.objects.filter(participation=employee_id), start, end).values('id')
+
+    return queryset.filter(id__in=organizing.union(participating))
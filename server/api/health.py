@@ -0,0 +1,47 @@
+from django.db import DatabaseError, connections
+
+# Liveness of the databases this worker uses, and how busy its connection
+# pools are (see the pool settings in server/settings.py).
+
+
+def pool_stats(pool):
+    '''Sizes and counters of a psycopg pool. `in_use` counts the connections
+    lent out, `utilization` is that against `max_size`.'''
+    stats = pool.get_stats()
+    size = stats.get('pool_size', 0)
+    in_use = size - stats.get('pool_available', 0)
+
+    return {
+        'min_size': pool.min_size,
+        'max_size': pool.max_size,
+        'size': size,
+        'in_use': in_use,
+        'utilization': in_use / pool.max_size if pool.max_size else None,
+        'waiting': stats.get('requests_waiting', 0),
+        'timeouts': stats.get('requests_errors', 0),
+    }
+
+
+def database_health(alias):
+    connection = connections[alias]
+    health = {'vendor': connection.vendor, 'ok': True}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError as e:
+        health.update(ok=False, error=str(e))
+
+    pool = getattr(connection, 'pool', None)
+    health['pool'] = pool_stats(pool) if pool is not None else None
+    if pool is None:
+        health['conn_max_age'] = connection.settings_dict.get('CONN_MAX_AGE')
+
+    return health
+
+
+def health():
+    databases = {alias: database_health(alias) for alias in connections}
+    return {
+        'status': 'ok' if all(db['ok'] for db in databases.values()) else 'unavailable',
+        'databases': databases,
+    }
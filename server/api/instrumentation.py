@@ -0,0 +1,320 @@
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+# Where the time of a request goes, per view (the URL name, which for the
+# viewsets is the model and the action, e.g. `employee-list`): total time, SQL
+# queries and their time, serializing, rendering and response size.
+# Serializing is the serializers turning model instances (or rows) into
+# dicts, timed by their `.data` (`SerializeTimingMixin`) without the queries
+# they run on the way, those stay SQL time. Rendering is the renderer then
+# turning the dicts into JSON (or HTML).
+#
+# `InstrumentationMiddleware` measures, `metrics` keeps the last 'SAMPLES' values
+# of each view for the quantiles, and `/metrics/` serves them as Prometheus
+# summaries. Statements run 'DUPLICATE_QUERIES' times or more within a request,
+# typically a query per row of a list (N+1), are logged and counted.
+#
+# A 'PROFILE_SAMPLE_RATE' share of the requests run under cProfile, the
+# profiles of those taking longer than 'PROFILE_THRESHOLD' seconds are saved to
+# 'PROFILE_DIR', for `python -m pstats` or snakeviz.
+#
+# Off unless `API_INSTRUMENTATION['ENABLED']`, the middleware then takes itself
+# out of the chain. The numbers are per process, each worker serves its own.
+# Queries are tallied by an execute wrapper every connection gets, reporting
+# to the `RequestStats` of the request in the context, so the sync views and
+# async ORM calls that ASGI runs in other threads count too.
+# Queries of streamed responses (the exports) run after the middleware is done
+# and aren't counted.
+
+logger = logging.getLogger(__name__)
+
+
+def instrumentation_settings():
+    return {
+        'ENABLED': False,
+        'SAMPLES': 1024,
+        'QUANTILES': (0.5, 0.9, 0.95, 0.99),
+        'DUPLICATE_QUERIES': 5,
+        'PROFILE_SAMPLE_RATE': 0,
+        'PROFILE_THRESHOLD': 0.5,
+        'PROFILE_DIR': None,
+        **getattr(settings, 'API_INSTRUMENTATION', {}),
+    }
+
+
+# name: (help, unit suffix)
+SUMMARIES = {
+    'request_duration': ('Time to answer the request', 'seconds'),
+    'sql_duration': ('Time spent in SQL queries', 'seconds'),
+    'serialize_duration': ('Time spent in the serializers, less their SQL queries', 'seconds'),
+    'render_duration': ('Time spent rendering the serialized data into the response body', 'seconds'),
+    'queries': ('SQL queries run', None),
+    'response_size': ('Size of the response body', 'bytes'),
+}
+
+
+class RequestStats:
+    '''Execute wrapper (see `connection.execute_wrapper()`) tallying the
+    queries of one request'''
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.serialize_time = 0.0
+        self.render_started = self.render_finished = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def render_time(self):
+        if self.render_finished is None:
+            return 0.0
+        return self.render_finished - self.render_started
+
+
+request_stats = ContextVar('request_stats', default=None)
+
+
+@contextmanager
+def serializing():
+    '''Count the block towards the serializing time of the request, if it's
+    instrumented, less the SQL time it adds'''
+    stats = request_stats.get()
+    if stats is None:
+        yield
+        return
+
+    start, sql_time = time.perf_counter(), stats.sql_time
+    try:
+        yield
+    finally:
+        stats.serialize_time += time.perf_counter() - start - (stats.sql_time - sql_time)
+
+
+class SerializeTimingMixin:
+    '''For serializers (and their list serializers), `.data` is timed by
+    `serializing()`. Nested serializers go through `to_representation()`
+    only, so nothing is counted twice.'''
+
+    @property
+    def data(self):
+        with serializing():
+            return super().data
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    stats = request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def instrument(connection, **kwargs):
+    '''Put `execute_wrapper` on a connection, whichever thread it's in'''
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # (view, method) -> {summary name: [sum, count, recent values]}
+            self.series = {}
+            self.duplicates = Counter()
+            self.profiles = Counter()
+
+    def record(self, labels, values, samples):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {
+                    name: [0.0, 0, deque(maxlen=samples)] for name in SUMMARIES}
+            for name, value in values.items():
+                summary = series[name]
+                summary[0] += value
+                summary[1] += 1
+                summary[2].append(value)
+
+    def render(self, quantiles):
+        '''The Prometheus text format'''
+        with self.lock:
+            series = {labels: {name: (total, count, sorted(recent))
+                               for name, (total, count, recent) in values.items()}
+                      for labels, values in self.series.items()}
+            counters = {'duplicate_query_requests': dict(self.duplicates),
+                        'profiles': dict(self.profiles)}
+
+        lines = []
+        for name, (help, unit) in SUMMARIES.items():
+            metric = f'api_{name}_{unit}' if unit else f'api_{name}'
+            lines += [f'# HELP {metric} {help}', f'# TYPE {metric} summary']
+            for labels, values in sorted(series.items()):
+                total, count, recent = values[name]
+                for q in quantiles:
+                    value = recent[min(int(q * len(recent)), len(recent) - 1)] if recent else 'NaN'
+                    lines.append(f'{metric}{{{format_labels(labels, quantile=q)}}} {value}')
+                lines.append(f'{metric}_sum{{{format_labels(labels)}}} {total}')
+                lines.append(f'{metric}_count{{{format_labels(labels)}}} {count}')
+
+        for name, help in (('duplicate_query_requests', 'Requests running a statement repeatedly (N+1)'),
+                           ('profiles', 'Slow requests profiled')):
+            lines += [f'# HELP api_{name}_total {help}', f'# TYPE api_{name}_total counter']
+            for labels, count in sorted(counters[name].items()):
+                lines.append(f'api_{name}_total{{{format_labels(labels)}}} {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels, **extra):
+    view, method = labels
+    pairs = [('view', view), ('method', method), *extra.items()]
+    return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                     .replace('\n', '\\n')) for key, value in pairs)
+
+
+metrics = Metrics()
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = instrumentation_settings()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.samples = config['SAMPLES']
+        self.duplicate_queries = config['DUPLICATE_QUERIES']
+        self.profile_rate = config['PROFILE_SAMPLE_RATE']
+        self.profile_threshold = config['PROFILE_THRESHOLD']
+        self.profile_dir = config['PROFILE_DIR']
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        connection_created.connect(instrument)
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats = request._instrumentation = RequestStats()
+        token = request_stats.set(stats)
+        profiler = self.start_profiler()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            request_stats.reset(token)
+
+        self.record(request, response, stats, duration, profiler)
+        return response
+
+    async def __acall__(self, request):
+        # Not profiled, the coroutine shares its thread with whatever else
+        # the event loop runs
+        stats = request._instrumentation = RequestStats()
+        token = request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_stats.reset(token)
+
+        self.record(request, response, stats, time.perf_counter() - start, None)
+        return response
+
+    def process_view(self, request, view, args, kwargs):
+        # Under ASGI this runs in the thread the sync views and the async
+        # ORM do, its connections may have been opened before
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+
+    def process_template_response(self, request, response):
+        # Called right before the response renders, DRF's included
+        stats = request._instrumentation
+        stats.render_started = time.perf_counter()
+
+        def rendered(response):
+            stats.render_finished = time.perf_counter()
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def start_profiler(self):
+        if not self.profile_rate or random.random() >= self.profile_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is running on this thread
+            return None
+        return profiler
+
+    def record(self, request, response, stats, duration, profiler):
+        match = request.resolver_match
+        labels = ((match.view_name or match.route) if match else 'unmatched', request.method)
+
+        size = 0 if response.streaming else len(response.content)
+        metrics.record(labels, {
+            'request_duration': duration,
+            'sql_duration': stats.sql_time,
+            'serialize_duration': stats.serialize_time,
+            'render_duration': stats.render_time(),
+            'queries': stats.queries,
+            'response_size': size,
+        }, self.samples)
+
+        repeated = [(count, sql) for sql, count in stats.statements.items()
+                    if count >= self.duplicate_queries]
+        if repeated:
+            with metrics.lock:
+                metrics.duplicates[labels] += 1
+            for count, sql in sorted(repeated, reverse=True):
+                logger.warning('%s %s ran the same query %d times: %s',
+                               request.method, request.path, count, sql[:500])
+
+        if profiler is not None and duration >= self.profile_threshold and self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            name = f'{time.time():.3f}-{os.getpid()}-{labels[0]}.prof'.replace('/', '_')
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
+            with metrics.lock:
+                metrics.profiles[labels] += 1
+
+
+def metrics_view(request):
+    config = instrumentation_settings()
+    if not config['ENABLED']:
+        raise Http404
+    return HttpResponse(metrics.render(config['QUANTILES']),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
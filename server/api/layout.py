@@ -0,0 +1,45 @@
+import heapq
+
+
+def overlap_groups(appointments):
+    '''Group appointments into clusters of transitively overlapping ones and
+    assign each a column inside its cluster.
+
+    Expects the appointments ordered by `start` (the database does that for us),
+    so a single sweep is enough: a cluster is closed as soon as an appointment
+    starts after everything in it has ended. Columns are reused greedily, the
+    lowest free one is taken first, which gives the minimal column count.
+
+    Returns a list of `(columns, [(appointment, column), ...])` tuples.'''
+    groups = []
+    members = []
+    group_end = None
+    # (end, column) of the appointments still running, and the columns freed up
+    running = []
+    free = []
+    columns = 0
+
+    for appointment in appointments:
+        if group_end is not None and appointment.start >= group_end:
+            groups.append((columns, members))
+            members, running, free, columns = [], [], [], 0
+            group_end = None
+
+        while running and running[0][0] <= appointment.start:
+            heapq.heappush(free, heapq.heappop(running)[1])
+
+        if free:
+            column = heapq.heappop(free)
+        else:
+            column = columns
+            columns += 1
+
+        heapq.heappush(running, (appointment.end, column))
+        members.append((appointment, column))
+        if group_end is None or appointment.end > group_end:
+            group_end = appointment.end
+
+    if members:
+        groups.append((columns, members))
+
+    return groups
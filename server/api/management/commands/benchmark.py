@@ -0,0 +1,115 @@
+import json
+import os
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from api.benchmark import runner
+from api.models import Appointment, Department, Employee, Position
+
+
+class Command(BaseCommand):
+    help = '''Time every endpoint against the data in the database (see
+    `generate_data`): throughput, p50/p95/p99 latency and queries per request.
+
+    `--target` is `client` (Django's test client), `wsgi` (a threaded WSGI
+    server in this process) or the URL of a server running separately, ASGI
+    or WSGI. The results go to `--output` as JSON, `--compare` checks them
+    against an earlier run and fails on regressions.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', default='client')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=1, help='Requests in flight')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests first')
+        parser.add_argument('--only', help='Regex on the endpoint names to run')
+        parser.add_argument('--writes', action='store_true',
+                            help='Also create, update and delete appointments')
+        parser.add_argument('--output', help='JSON file for the results, `-` for stdout')
+        parser.add_argument('--compare', help='JSON results of an earlier run')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Share p95 latency or throughput may worsen by')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                previous = json.load(f)
+
+        try:
+            target = runner.target_for(options['target'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        # The test client sends `Host: testserver`, the WSGI server gets 127.0.0.1
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver', '127.0.0.1']
+        started = datetime.now(timezone.utc)
+        try:
+            with override_settings(ALLOWED_HOSTS=hosts):
+                endpoints = runner.run(
+                    target, requests=options['requests'], concurrency=options['concurrency'],
+                    warmup=options['warmup'], only=options['only'], writes=options['writes'],
+                    progress=self.report)
+        except ValueError as e:
+            raise CommandError(f'{e}, see `generate_data`')
+        finally:
+            target.close()
+
+        results = {'meta': self.meta(target, started, options), 'endpoints': endpoints}
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(results, indent=2))
+        elif options['output']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['output'])), exist_ok=True)
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+        if previous is not None:
+            for key in ('target', 'concurrency', 'data'):
+                if previous['meta'].get(key) != results['meta'][key]:
+                    self.stderr.write(f'Compared to a run with another {key}: {previous["meta"].get(key)}')
+            regressions = runner.compare(previous, results, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions')
+            self.stdout.write('No regressions')
+
+    def report(self, name, result):
+        latency, queries = result['latency_ms'], result['queries']['mean']
+        self.stdout.write(
+            f'{name:<28} {result["throughput"]:8.1f} req/s  p50 {latency["p50"]:7.2f}  '
+            f'p95 {latency["p95"]:7.2f}  p99 {latency["p99"]:7.2f} ms  '
+            f'{"-" if queries is None else queries} queries'
+            + (f'  {result["errors"]} errors' if result['errors'] else ''))
+
+    def meta(self, target, started, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        return {
+            'started_at': started.isoformat(),
+            'commit': commit,
+            'target': target.name,
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'warmup': options['warmup'],
+            'database': {'vendor': connection.vendor, 'name': str(connection.settings_dict['NAME'])},
+            'data': {
+                'departments': Department.objects.count(),
+                'employees': Employee.objects.count(),
+                'positions': Position.objects.count(),
+                'appointments': Appointment.objects.count(),
+            },
+            'python': platform.python_version(),
+            'django': django.get_version(),
+        }
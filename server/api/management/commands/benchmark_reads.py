@@ -0,0 +1,82 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.test import AsyncClient, Client, override_settings
+
+from api.models import Appointment, Department
+
+
+class Command(BaseCommand):
+    help = '''Compare requests/sec of the sync DRF reads with their async
+    versions under `/async/`, against the configured database.
+
+    Both run in-process through Django's own WSGI and ASGI handlers, with no
+    server in front. The sync path gets `--sync-threads` requests in flight,
+    1 being a sync worker, the async path `--concurrency` of them on a single
+    event loop, like one ASGI worker.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Requests per endpoint and path')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--sync-threads', type=int, default=1)
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        appointment = Appointment.objects.order_by('id').first()
+        department = Department.objects.order_by('id').first()
+        if appointment is None or department is None:
+            raise CommandError('Needs at least one appointment and one department')
+
+        endpoints = [
+            ('appointment list', f'/appointments/?page_size={options["page_size"]}'),
+            ('appointment detail', f'/appointments/{appointment.pk}/'),
+            ('department employees',
+             f'/departments/{department.pk}/employees/?page_size={options["page_size"]}'),
+        ]
+
+        # The test clients send `Host: testserver`
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, url in endpoints:
+                self.run(name, url, options)
+
+    def run(self, name, url, options):
+        sync_rate = self.run_sync(url, options['requests'], options['sync_threads'])
+        async_rate = asyncio.run(
+            self.run_async(f'/async{url}', options['requests'], options['concurrency']))
+        self.stdout.write(
+            f'{name:<22} sync {sync_rate:8.1f} req/s   async {async_rate:8.1f} req/s   '
+            f'x{async_rate / sync_rate:.2f}')
+
+    def run_sync(self, url, requests, threads):
+        clients = local()
+
+        def get(_):
+            if not hasattr(clients, 'client'):
+                clients.client = Client()
+            response = clients.client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} answered {response.status_code}')
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(get, range(requests)))
+        return requests / (time.perf_counter() - started)
+
+    async def run_async(self, url, requests, concurrency):
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def get():
+            async with slots:
+                response = await client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} answered {response.status_code}')
+
+        started = time.perf_counter()
+        await asyncio.gather(*(get() for _ in range(requests)))
+        return requests / (time.perf_counter() - started)
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import data
+from api.models import Appointment, Employee
+
+
+class Command(BaseCommand):
+    help = '''Fill the database with a synthetic company for benchmarks: departments,
+    employees, and appointments every day in working hours with a few
+    participants each, mostly colleagues. The same `--seed` makes the same
+    data. Refuses to add to existing data unless `--clear` empties the tables
+    first.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departments', type=int, default=10)
+        parser.add_argument('--employees', type=int, default=500)
+        parser.add_argument('--days', type=int, default=30,
+                            help='Days of appointments, centered on today')
+        parser.add_argument('--appointments-per-day', type=int, default=200)
+        parser.add_argument('--participants', type=int, default=3,
+                            help='Average participants per appointment')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete all appointments, employees, departments and positions first')
+
+    def handle(self, *args, **options):
+        if options['departments'] < 1 or options['employees'] < 1:
+            raise CommandError('Needs at least one department and one employee')
+
+        if options['clear']:
+            data.clear()
+        elif Employee.objects.exists() or Appointment.objects.exists():
+            raise CommandError('The database has data already, pass --clear to replace it')
+
+        started = time.perf_counter()
+        counts = data.generate(
+            departments=options['departments'], employees=options['employees'],
+            days=options['days'], appointments_per_day=options['appointments_per_day'],
+            participants=options['participants'], seed=options['seed'])
+
+        self.stdout.write(
+            ', '.join(f'{count} {name}' for name, count in counts.items())
+            + f' in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,186 @@
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api import occupancy
+from api.models import MAX_DURATION, Appointment, Employee
+from api.signals import invalidate
+
+
+class Command(BaseCommand):
+    help = '''Import appointments from an NDJSON or CSV file (or stdin).
+
+    Every record has `start`, `end`, `title`, `description`, `employee` and
+    `participation`. Employees are given by email or id, `participation` is a
+    list in NDJSON and space separated in CSV, the same way `export/` writes it.
+    Records are checked as they're read, an invalid one (bad values, `end` not
+    after `start`, too long a title) aborts the import with its line number.
+    The input is read in batches, on PostgreSQL each batch is loaded with COPY,
+    elsewhere with `bulk_create`. The whole import is one transaction.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Path of the file to import, `-` for stdin')
+        parser.add_argument('--type', choices=['ndjson', 'csv'],
+                            help='Input type, guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        path = options['file']
+        kind = options['type'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        batch_size = options['batch_size']
+
+        # Built once, every row is resolved against these without a query
+        self.emails = dict(Employee.objects.values_list('email', 'id'))
+        self.ids = set(self.emails.values())
+
+        load = self.load_copy if connection.vendor == 'postgresql' else self.load_bulk
+
+        started = time.perf_counter()
+        appointments = participants = 0
+        first = last = None
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            records = self.read(stream, kind)
+            with transaction.atomic():
+                while batch := list(islice(records, batch_size)):
+                    participants += load(batch)
+                    appointments += len(batch)
+                    first = min(first or batch[0][0], *(record[0] for record in batch))
+                    last = max(last or batch[0][1], *(record[1] for record in batch))
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{appointments} appointments loaded')
+                if appointments:
+                    # The rows went in without the signals
+                    tz = timezone.get_default_timezone()
+                    occupancy.rebuild(timezone.localtime(first, tz).date(),
+                                      timezone.localtime(last, tz).date())
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        invalidate('appointment')
+
+        elapsed = time.perf_counter() - started
+        rate = appointments / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {appointments} appointments with {participants} participants '
+            f'in {elapsed:.2f}s ({rate:.0f} rows/sec)'))
+
+    def read(self, stream, kind):
+        '''Yield `(start, end, title, description, employee_id, participant_ids)`
+        tuples, parsed and validated, one per input record'''
+        if kind == 'csv':
+            reader = csv.DictReader(stream)
+            records = ((reader.line_num, row) for row in reader)
+        else:
+            records = ((number, line) for number, line in enumerate(stream, start=1)
+                       if line.strip())
+
+        for number, record in records:
+            try:
+                if kind == 'csv':
+                    participation = (record.get('participation') or '').split()
+                else:
+                    record = json.loads(record)
+                    participation = record.get('participation') or []
+
+                parsed = (
+                    self.timestamp(record['start']),
+                    self.timestamp(record['end']),
+                    record['title'],
+                    record.get('description') or '',
+                    self.employee(record.get('employee')),
+                    list(dict.fromkeys(self.employee(p) for p in participation)),
+                )
+                self.validate(*parsed[:4])
+            except (KeyError, TypeError, ValueError) as e:
+                raise CommandError(f'Invalid record on line {number}: {e!r}')
+            yield parsed
+
+    def validate(self, start, end, title, description):
+        '''What the model and serializer would refuse, COPY and `bulk_create`
+        don't check it (and the database may not either)'''
+        if start >= end:
+            raise ValueError('The end has to be later than the start')
+        if end - start > MAX_DURATION:
+            raise ValueError(f'An appointment can last at most {MAX_DURATION.days} days')
+        for name, value in (('title', title), ('description', description)):
+            if not isinstance(value, str):
+                raise TypeError(f'`{name}` has to be a string')
+            max_length = Appointment._meta.get_field(name).max_length
+            if len(value) > max_length:
+                raise ValueError(f'`{name}` is longer than {max_length} characters')
+
+    def timestamp(self, value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f'Invalid datetime {value}')
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def employee(self, value):
+        if value is None or value == '':
+            return None
+        if isinstance(value, str) and '@' in value:
+            if value not in self.emails:
+                raise ValueError(f'Unknown employee {value}')
+            return self.emails[value]
+        if int(value) not in self.ids:
+            raise ValueError(f'Unknown employee {value}')
+        return int(value)
+
+    def load_bulk(self, batch):
+        appointments = Appointment.objects.bulk_create([
+            Appointment(start=start, end=end, title=title,
+                        description=description, employee_id=employee)
+            for start, end, title, description, employee, _ in batch
+        ])
+
+        Participation = Appointment.participation.through
+        links = [Participation(appointment_id=appointment.pk, employee_id=pk)
+                 for appointment, record in zip(appointments, batch)
+                 for pk in record[5]]
+        Participation.objects.bulk_create(links, batch_size=1000)
+
+        return len(links)
+
+    def load_copy(self, batch):
+        '''Load a batch with psycopg's COPY support. The ids are drawn from the
+        table's sequence up front, so the participation rows can be copied in
+        right after without reading anything back.'''
+        quote = connection.ops.quote_name
+        table = Appointment._meta.db_table
+        Participation = Appointment.participation.through
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                [table, 'id', len(batch)])
+            ids = [row[0] for row in cursor.fetchall()]
+
+            now = timezone.now()
+            columns = ['id', 'start', 'end', 'title', 'description', 'employee_id',
+                       'created_at', 'updated_at', 'recurrence', 'recurrence_exceptions']
+            with cursor.cursor.copy(
+                    f'COPY {quote(table)} ({", ".join(map(quote, columns))}) FROM STDIN') as copy:
+                for pk, record in zip(ids, batch):
+                    copy.write_row((pk, *record[:5], now, now, '', '[]'))
+
+            links = 0
+            with cursor.cursor.copy(
+                    f'COPY {quote(Participation._meta.db_table)} '
+                    f'({quote("appointment_id")}, {quote("employee_id")}) FROM STDIN') as copy:
+                for pk, record in zip(ids, batch):
+                    for employee in record[5]:
+                        copy.write_row((pk, employee))
+                        links += 1
+
+        return links
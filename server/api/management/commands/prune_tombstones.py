@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.changes import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = '''Delete the tombstones of appointments deleted longer ago than
+    `APPOINTMENT_TOMBSTONE_RETENTION_DAYS`. Meant to run periodically (daily
+    from cron, say), clients syncing with older tokens start over.'''
+
+    def handle(self, *args, **options):
+        pruned = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f'Pruned {pruned} tombstones'))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from api import occupancy
+
+
+class Command(BaseCommand):
+    help = '''Recompute the daily occupancy of employees and departments from the
+    appointments, every day or the days from `--from` to `--to`. The signals
+    keep it up otherwise, this is for writes that went around them (raw SQL,
+    `bulk_create` in scripts) or for filling it the first time. With
+    `--horizon`, only the last month of the year ahead that is counted. Run
+    that daily (from cron, say), or endless recurring appointments stop being
+    counted a year after they were written.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='first', help='First day, YYYY-MM-DD')
+        parser.add_argument('--to', dest='last', help='Last day, YYYY-MM-DD')
+        parser.add_argument('--horizon', action='store_true',
+                            help='Only the days that came into the year ahead')
+
+    def handle(self, *args, **options):
+        first, last = (self.day(options[name], name) for name in ('first', 'last'))
+        if first is not None and last is not None and first > last:
+            raise CommandError('`--to` has to be on or after `--from`')
+
+        if options['horizon'] and (first is not None or last is not None):
+            raise CommandError("`--horizon` can't be combined with `--from` or `--to`")
+
+        started = time.perf_counter()
+        written = occupancy.extend() if options['horizon'] else occupancy.rebuild(first, last)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {written} occupancy rows in {time.perf_counter() - started:.1f}s'))
+
+    def day(self, value, name):
+        if value is None:
+            return None
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f'Invalid date for --{"from" if name == "first" else "to"}: {value}')
+        return day
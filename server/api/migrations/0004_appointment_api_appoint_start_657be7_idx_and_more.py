@@ -0,0 +1,21 @@
+# Generated by Django 5.2.2 on 2026-10-18 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_employee_department'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['start', 'end'], name='api_appoint_start_657be7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['employee', 'start'], name='api_appoint_employe_0b1212_idx'),
+        ),
+    ]
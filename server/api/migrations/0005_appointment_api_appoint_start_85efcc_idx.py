@@ -0,0 +1,17 @@
+# Generated by Django 5.2.2 on 2026-10-18 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_appointment_api_appoint_start_657be7_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['start', 'id'], name='api_appoint_start_85efcc_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+# The conflict check looks for overlapping `tstzrange(start, end)`s. GiST
+# indexes are PostgreSQL only, so this is a no-op on other backends, which fall
+# back to the `(start, end)` btree index. An exclusion constraint would be the
+# other option, but double bookings go through the participation table, which
+# doesn't have the times, and checking is optional anyway.
+INDEX = 'api_appointment_during_gist'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {INDEX} ON api_appointment '
+            'USING gist (tstzrange("start", "end"))')
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_appointment_api_appoint_start_85efcc_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
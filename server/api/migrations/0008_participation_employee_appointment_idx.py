@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+# The participation table's unique constraint covers `(appointment_id,
+# employee_id)`, which answers "who takes part in this appointment". The other
+# direction, "what does this employee take part in", gets its own index, so an
+# employee's timeline is an index-only scan of their rows. The table is
+# generated by the ManyToManyField, hence the raw SQL, which is the same on
+# every backend.
+INDEX = 'api_appointment_participation_employee_appointment_idx'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_appointmenttombstone_appointment_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f'CREATE INDEX IF NOT EXISTS {INDEX} '
+            'ON api_appointment_participation (employee_id, appointment_id)',
+            f'DROP INDEX IF EXISTS {INDEX}',
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.2 on 2026-10-18 07:30
+
+from django.db import migrations, models
+
+
+# Employee search (api/search.py) on PostgreSQL: trigram GIN indexes serve both
+# its `UPPER(...) LIKE 'Q%'` prefix matches and its word similarity (`%>`)
+# matches. Creating the extension takes a superuser, or a database owner
+# since PostgreSQL 13 (pg_trgm is trusted). A no-op on other backends, which
+# search an in-process index instead.
+TRIGRAM_INDEXES = {
+    'api_employee_name_trgm': 'name',
+    'api_employee_email_trgm': 'email',
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for index, column in TRIGRAM_INDEXES.items():
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS {index} ON api_employee '
+                f'USING gin (UPPER("{column}") gin_trgm_ops)')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for index in TRIGRAM_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {index}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_participation_employee_appointment_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['name'], name='api_employe_name_463c63_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='employee',
+            index=models.Index(fields=['email'], name='api_employe_email_5d0ffb_idx'),
+        ),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
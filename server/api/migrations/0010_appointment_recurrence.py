@@ -0,0 +1,29 @@
+# Generated by Django 5.2.2 on 2026-10-18 07:44
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_employee_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='recurrence',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='recurrence_exceptions',
+            field=models.JSONField(blank=True, default=list, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='recurrence_until',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.2 on 2026-10-18 07:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_appointment_recurrence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('booked_minutes', models.PositiveIntegerField()),
+                ('appointments', models.PositiveIntegerField()),
+                ('first_start', models.DateTimeField()),
+                ('last_end', models.DateTimeField()),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='api.department')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('department', 'day'), name='api_department_occupancy_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EmployeeOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('booked_minutes', models.PositiveIntegerField()),
+                ('appointments', models.PositiveIntegerField()),
+                ('first_start', models.DateTimeField()),
+                ('last_end', models.DateTimeField()),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='api.employee')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('employee', 'day'), name='api_employee_occupancy_day')],
+            },
+        ),
+    ]
@@ -1,5 +1,10 @@
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
+from api.recurrence import last_end
+
 # Varchar limits and "on delete" settings are guesswork, I'd ask for clarification on a real world project.
 # And so are constraints (or lack thereof)
 
@@ -31,10 +36,24 @@ class Employee(models.Model):
     department = models.ForeignKey(
         Department, on_delete=models.SET_NULL, null=True, related_name='employees')
 
+    class Meta:
+        # For the exact `name=`/`email=` filters, the search has its own
+        # trigram indexes (migration 0009, PostgreSQL only)
+        indexes = [
+            models.Index(fields=['name']),
+            models.Index(fields=['email']),
+        ]
+
     def __str__(self):
         return self.name
 
 
+# The longest an appointment (or each occurrence of a series) may last. Window
+# queries look only this far back before the window for the ones still going
+# on, which keeps them a short range scan of the `(start, end)` index.
+MAX_DURATION = timedelta(days=31)
+
+
 class Appointment(models.Model):
     start = models.DateTimeField()
     end = models.DateTimeField()
@@ -45,6 +64,91 @@ class Appointment(models.Model):
         Employee, on_delete=models.SET_NULL, related_name="appointed_to", null=True)
     # The mockup hints at the fact that multiple employees can participate in an appointment, hence the separate 'participation' assoc. table
     participation = models.ManyToManyField(Employee)
+    # For incremental sync, `updated_at` is also touched when the participants change
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # A series when set, see api.recurrence. `recurrence_until` is when its
+    # last occurrence ends, null when it goes on forever, kept up by `save()`.
+    recurrence = models.CharField(max_length=200, blank=True, default='')
+    recurrence_exceptions = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    recurrence_until = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        # The calendar only ever asks for a time window, these keep that a range scan
+        indexes = [
+            models.Index(fields=['start', 'end']),
+            models.Index(fields=['employee', 'start']),
+            # Keyset pagination order
+            models.Index(fields=['start', 'id']),
+            # Order of the change feed
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
     def __str__(self):
         return self.title
+
+    def save(self, *args, **kwargs):
+        self.set_recurrence_until()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'recurrence_until' not in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'recurrence_until'}
+        super().save(*args, **kwargs)
+
+    def set_recurrence_until(self):
+        self.recurrence_until = (last_end(self.start, self.end, self.recurrence, self.recurrence_exceptions)
+                                 if self.recurrence else None)
+
+
+# Left behind by deleted appointments, so clients syncing incrementally learn
+# about the deletion. Not a foreign key, the appointment is gone by then.
+class AppointmentTombstone(models.Model):
+    appointment_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f'Deleted appointment {self.appointment_id}'
+
+
+# Per-day totals of the appointments for the month views and the heatmaps,
+# kept up by api.occupancy. Days without appointments have no row.
+class Occupancy(models.Model):
+    day = models.DateField()
+    # Time covered by appointments, overlapping ones counted once (for a
+    # department the sum of its employees')
+    booked_minutes = models.PositiveIntegerField()
+    appointments = models.PositiveIntegerField()
+    first_start = models.DateTimeField()
+    last_end = models.DateTimeField()
+
+    class Meta:
+        abstract = True
+
+
+class EmployeeOccupancy(Occupancy):
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='occupancy')
+
+    class Meta:
+        # Also the index of the range scans
+        constraints = [
+            models.UniqueConstraint(fields=['employee', 'day'], name='api_employee_occupancy_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.employee_id} on {self.day}'
+
+
+class DepartmentOccupancy(Occupancy):
+    department = models.ForeignKey(Department, on_delete=models.CASCADE, related_name='occupancy')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['department', 'day'], name='api_department_occupancy_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.department_id} on {self.day}'
@@ -0,0 +1,274 @@
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from itertools import takewhile
+
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from api.availability import merge
+from api.filters import during
+from api.models import Appointment, DepartmentOccupancy, Employee, EmployeeOccupancy
+from api.recurrence import expansions, occurrences, series_overlapping
+from api.versions import bump_version
+
+# Daily occupancy of employees and departments (`EmployeeOccupancy`,
+# `DepartmentOccupancy`): booked minutes, appointment count and first/last busy
+# time per day in the default time zone, so a month view or a year-long
+# heatmap reads one row per day instead of every appointment.
+#
+# The signals (api.signals) hand the (employee, day) cells an appointment
+# write touches, before and after it, to `changed()`. They're recomputed from
+# the appointments once the transaction commits, with the departments of the
+# employees on those days, so a bulk write is one refresh, not one per row.
+# Recomputing rather than adding and subtracting keeps the minimums and
+# maximums right and can't drift.
+#
+# Recurring appointments count up to `HORIZON` ahead of the time they're
+# written or rebuilt, their days are refreshed up to there too. For endless
+# series to keep being counted that far ahead, `manage.py rebuild_occupancy
+# --horizon` has to run daily, it recomputes the days that came into the
+# horizon (`extend()`). The endpoint doesn't go further than the horizon.
+# `manage.py rebuild_occupancy` recomputes everything, or a range of days, e.g.
+# after writes that skip the signals.
+#
+# The cells change after the appointments' own version markers were bumped,
+# the `VERSION` marker is bumped once they're committed, responses reading them
+# are validated on that.
+
+HORIZON = timedelta(days=366)
+# Version marker (api.versions) of the cells
+VERSION = 'occupancy'
+# Days further apart than this are refreshed with separate queries
+MAX_GAP = 31
+# Days per query of a rebuild
+REBUILD_DAYS = 31
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_default_timezone())
+
+
+def days_of(start, end):
+    '''The days `[start, end)` falls on'''
+    tz = timezone.get_default_timezone()
+    day = timezone.localtime(start, tz).date()
+    last = timezone.localtime(max(start, end - timedelta(microseconds=1)), tz).date()
+    while day <= last:
+        yield day
+        day += timedelta(days=1)
+
+
+def involvement(rows, start=None, end=None):
+    '''`{id: (times, employees)}` of `(id, start, end, recurrence,
+    recurrence_exceptions, employee_id, participation)` rows, the times of a
+    series being its occurrences within `[start, end)`, or up to the horizon'''
+    appointments = {}
+    for pk, row_start, row_end, recurrence, exceptions, organizer, participant in rows:
+        if pk not in appointments:
+            if not recurrence:
+                times = [(row_start, row_end)]
+            elif start is not None:
+                times = expansions.get(row_start, row_end, recurrence, exceptions, start, end)
+            else:
+                horizon = timezone.now() + HORIZON
+                times = list(takewhile(lambda occurrence: occurrence[0] < horizon,
+                                       occurrences(row_start, row_end, recurrence, exceptions)))
+            appointments[pk] = (times, set())
+        appointments[pk][1].update(e for e in (organizer, participant) if e is not None)
+    return appointments
+
+
+COLUMNS = ('id', 'start', 'end', 'recurrence', 'recurrence_exceptions', 'employee_id', 'participation')
+
+
+def appointment_days(pks):
+    '''`{id: (days, employees)}` of the appointments, as they are now'''
+    rows = Appointment.objects.filter(pk__in=pks).values_list(*COLUMNS)
+    return {pk: ({day for s, e in times for day in days_of(s, e)}, employees)
+            for pk, (times, employees) in involvement(rows).items()}
+
+
+def cells(pks):
+    '''The (employee, day) cells the appointments count in'''
+    return {(employee, day) for days, employees in appointment_days(pks).values()
+            for employee in employees for day in days}
+
+
+def runs(days):
+    '''Sorted `days` as `(first, last)` ranges, splitting where they're far apart'''
+    ranges = []
+    for day in sorted(days):
+        if ranges and (day - ranges[-1][1]).days <= MAX_GAP:
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return ranges
+
+
+_pending = threading.local()
+
+
+def changed(touched, departments=()):
+    '''Refresh the (employee, day) cells `touched`, and `departments` on those
+    days, once the transaction commits'''
+    if not touched:
+        return
+    if not hasattr(_pending, 'cells'):
+        _pending.cells, _pending.departments = set(), set()
+    _pending.cells.update(touched)
+    _pending.departments.update(departments)
+    # Also after a rolled back savepoint dropped an earlier callback,
+    # refreshing twice costs nothing
+    transaction.on_commit(flush)
+
+
+def flush():
+    touched = getattr(_pending, 'cells', None)
+    if not touched:
+        return
+    departments = _pending.departments
+    _pending.cells, _pending.departments = set(), set()
+    refresh(touched, departments)
+
+
+def refresh(touched, departments=()):
+    '''Recompute the (employee, day) cells `touched`, and those of the
+    employees' departments and of `departments` on the same days'''
+    employees = {employee for employee, _ in touched}
+    departments = set(departments) | set(Employee.objects.filter(
+        pk__in=employees, department__isnull=False).values_list('department_id', flat=True))
+    # Everyone of the departments, for their totals
+    members = dict(Employee.objects.filter(Q(pk__in=employees) | Q(department__in=departments))
+                   .values_list('id', 'department_id'))
+
+    with transaction.atomic():
+        # Concurrent refreshes of the same employees or departments take
+        # turns, the later one reading what the earlier one read and more
+        list(Employee.objects.filter(pk__in=members).order_by('pk').select_for_update().values_list('pk'))
+        for first, last in runs({day for _, day in touched}):
+            recompute(first, last, members, departments)
+        transaction.on_commit(lambda: bump_version(VERSION))
+
+
+def rebuild(first=None, last=None):
+    '''Recompute every cell from `first` to `last`, by default of all the
+    days with appointments. Returns how many were written.'''
+    tz = timezone.get_default_timezone()
+    bounds = Appointment.objects.aggregate(
+        start=Min('start'), end=Max('end'), until=Max('recurrence_until'))
+    everything = first is None and last is None
+    if first is None and bounds['start'] is not None:
+        first = timezone.localtime(bounds['start'], tz).date()
+    if last is None and bounds['end'] is not None:
+        ends = [bounds['end'], bounds['until'] or bounds['end']]
+        if Appointment.objects.exclude(recurrence='').filter(recurrence_until__isnull=True).exists():
+            ends.append(timezone.now() + HORIZON)
+        last = timezone.localtime(max(ends), tz).date()
+
+    members = dict(Employee.objects.values_list('id', 'department_id'))
+    written = 0
+    with transaction.atomic():
+        if everything:
+            for model in (EmployeeOccupancy, DepartmentOccupancy):
+                model.objects.all()._raw_delete(model.objects.db)
+        day = first
+        while day is not None and day <= last:
+            until = min(last, day + timedelta(days=REBUILD_DAYS - 1))
+            written += recompute(day, until, members, None)
+            day = until + timedelta(days=1)
+        transaction.on_commit(lambda: bump_version(VERSION))
+    return written
+
+
+def horizon():
+    '''The last day that's counted'''
+    return timezone.localtime(timezone.now() + HORIZON, timezone.get_default_timezone()).date()
+
+
+def extend():
+    '''Recompute the last `REBUILD_DAYS` of the horizon, running it daily
+    keeps up with the days coming into it, and tolerates missing a few days.
+    Returns how many cells were written.'''
+    last = horizon()
+    return rebuild(last - timedelta(days=REBUILD_DAYS - 1), last)
+
+
+def recompute(first, last, members, departments):
+    '''Replace the cells of the `members` (`{employee: department}`) and of
+    `departments` (all of them if `None`) from `first` to `last`. Returns how
+    many were written.'''
+    start, end = day_start(first), day_start(last + timedelta(days=1))
+    rows = Appointment.objects.filter(
+        Q(recurrence='') & during(start, end) | series_overlapping(start, end))
+    if departments is not None:
+        rows = rows.filter(Q(employee_id__in=members) | Q(participation__in=members))
+    appointments = involvement(rows.values_list(*COLUMNS).iterator(), start, end)
+
+    busy = defaultdict(list)
+    booked = defaultdict(set)
+    for pk, (times, employees) in appointments.items():
+        employees = [employee for employee in employees if employee in members]
+        for occurrence_start, occurrence_end in times:
+            for day in days_of(max(occurrence_start, start), min(occurrence_end, end)):
+                interval = (max(occurrence_start, day_start(day)),
+                            min(occurrence_end, day_start(day + timedelta(days=1))))
+                for employee in employees:
+                    busy[employee, day].append(interval)
+                    booked[employee, day].add(pk)
+
+    employee_rows = []
+    # (department, day) -> [seconds, appointment ids, first start, last end]
+    totals = {}
+    for (employee, day), intervals in busy.items():
+        merged = merge(sorted(intervals))
+        seconds = sum((e - s).total_seconds() for s, e in merged)
+        first_start, last_end = merged[0][0], merged[-1][1]
+        employee_rows.append(EmployeeOccupancy(
+            employee_id=employee, day=day, booked_minutes=int(seconds // 60),
+            appointments=len(booked[employee, day]), first_start=first_start, last_end=last_end))
+
+        department = members[employee]
+        if department is None or (departments is not None and department not in departments):
+            continue
+        total = totals.get((department, day))
+        if total is None:
+            totals[department, day] = [seconds, set(booked[employee, day]), first_start, last_end]
+        else:
+            total[0] += seconds
+            total[1].update(booked[employee, day])
+            total[2] = min(total[2], first_start)
+            total[3] = max(total[3], last_end)
+
+    department_rows = [DepartmentOccupancy(
+        department_id=department, day=day, booked_minutes=int(seconds // 60),
+        appointments=len(pks), first_start=first_start, last_end=last_end)
+        for (department, day), (seconds, pks, first_start, last_end) in totals.items()]
+
+    employee_cells = EmployeeOccupancy.objects.filter(day__gte=first, day__lte=last)
+    department_cells = DepartmentOccupancy.objects.filter(day__gte=first, day__lte=last)
+    if departments is not None:
+        employee_cells = employee_cells.filter(employee__in=members)
+        department_cells = department_cells.filter(department__in=departments)
+    replace(employee_cells, 'employee', employee_rows)
+    replace(department_cells, 'department', department_rows)
+
+    return len(employee_rows) + len(department_rows)
+
+
+FIELDS = ('booked_minutes', 'appointments', 'first_start', 'last_end')
+
+
+def replace(cells, key, rows):
+    '''Write `rows` over `cells`, the `(key, day)` cells among them without a
+    row are deleted. Upserted, so a cell another refresh wrote in the meantime
+    is overwritten rather than failing on the unique constraint.'''
+    model = cells.model
+    fresh = {(getattr(row, f'{key}_id'), row.day) for row in rows}
+    stale = [pk for pk, owner, day in cells.values_list('pk', key, 'day') if (owner, day) not in fresh]
+    for i in range(0, len(stale), 1000):
+        batch = model.objects.filter(pk__in=stale[i:i + 1000])
+        batch._raw_delete(batch.db)
+    model.objects.bulk_create(rows, batch_size=1000, update_conflicts=True,
+                              unique_fields=(key, 'day'), update_fields=FIELDS)
@@ -0,0 +1,247 @@
+import heapq
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from collections import deque
+from functools import reduce
+from itertools import dropwhile, islice, takewhile
+from operator import or_
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    '''`DjangoJSONEncoder` cuts datetimes to milliseconds, positions need
+    every digit, or rows get sent twice'''
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def seek(ordering, position, reverse=False):
+    '''Build the "comes after `position` in `ordering`" condition.
+
+    Row value comparisons are not portable, so `(a, b) > (x, y)` is spelled
+    out as `a >= x AND (a > x OR (a = x AND b > y))`; the leading range on
+    the first field is what lets the database use the index.'''
+    lookup = 'lt' if reverse else 'gt'
+    first = ordering[0]
+
+    alternatives = []
+    for i, field in enumerate(ordering):
+        equal = {f: position[f] for f in ordering[:i]}
+        alternatives.append(Q(**equal, **{f'{field}__{lookup}': position[field]}))
+
+    return Q(**{f'{first}__{lookup}e': position[first]}) & reduce(or_, alternatives)
+
+
+class KeysetPagination(BasePagination):
+    '''Cursor pagination that seeks on the full ordering key.
+
+    DRF's own `CursorPagination` only seeks on the first ordering field and
+    falls back to an OFFSET for rows sharing that value. Here the cursor holds
+    the complete key of the last row sent, e.g. `(start, id)` for appointments,
+    and the next page is "everything after that key", so any page costs one
+    index range scan of `page_size` rows, however deep it is.
+
+    Views pick the key with an `ordering` attribute, which has to end with a
+    unique field.'''
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    ordering = ('id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        '''`paginate_queryset()` for async views, the page is read with
+        `aiterator()` (prefetches included) without blocking the event loop'''
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(
+            [row async for row in queryset.aiterator(chunk_size=self.page_size + 1)])
+
+    def paginate_merged(self, queryset, streams, request, view=None):
+        '''`paginate_queryset()` over the rows of `queryset` merged with
+        other rows, e.g. generated ones, from `streams` of them sorted on the
+        ordering too'''
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(self.merge_page(list(queryset), streams))
+
+    async def apaginate_merged(self, queryset, streams, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        rows = [row async for row in queryset.aiterator(chunk_size=self.page_size + 1)]
+        return self.set_page(self.merge_page(rows, streams))
+
+    def merge_page(self, rows, streams):
+        # `rows` is already the page of the queryset, plus one, in the
+        # direction asked for. The streams go forward, going back takes the
+        # last rows before the position.
+        key = self.sort_key
+        position = None if self.position is None else tuple(self.position[f] for f in self.ordering)
+        if self.reverse:
+            before = []
+            for stream in streams:
+                tail = deque(takewhile(lambda row: position is None or key(row) < position, stream),
+                             maxlen=self.page_size + 1)
+                before.append(reversed(tail))
+            merged = heapq.merge(rows, *before, key=key, reverse=True)
+        else:
+            merged = heapq.merge(rows, *(
+                dropwhile(lambda row: key(row) <= position, stream) if position is not None else stream
+                for stream in streams), key=key)
+        return list(islice(merged, self.page_size + 1))
+
+    def sort_key(self, row):
+        key = self.key(row)
+        return tuple(key[f] for f in self.ordering)
+
+    def page_queryset(self, queryset, request, view=None):
+        '''The queryset of the requested page, plus one row, or `None` when
+        pagination is off'''
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.ordering = tuple(getattr(view, 'ordering', None) or self.ordering)
+        self.base_url = request.build_absolute_uri()
+        self.reverse, self.position = self.decode_cursor(request, queryset.model)
+
+        if self.reverse:
+            queryset = queryset.order_by(*(f'-{f}' for f in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.seek(self.position, self.reverse))
+
+        # One row more than needed tells us whether there's anything further
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        reverse, position = self.reverse, self.position
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.first_key = self.key(results[0]) if results else position
+        self.last_key = self.key(results[-1]) if results else position
+
+        return results
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+
+        return self.page_size
+
+    def seek(self, position, reverse):
+        return seek(self.ordering, position, reverse)
+
+    def key(self, instance):
+        if isinstance(instance, dict):
+            # `values()` rows
+            return {field: instance[field] for field in self.ordering}
+        return {field: getattr(instance, field) for field in self.ordering}
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(False, self.last_key)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(True, self.first_key)
+
+    def encode_cursor(self, reverse, position):
+        payload = json.dumps({'r': reverse, 'p': [position[f] for f in self.ordering]},
+                             cls=CursorEncoder)
+        cursor = urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        raw = request.query_params.get(self.cursor_query_param)
+        if not raw:
+            return False, None
+
+        try:
+            payload = json.loads(urlsafe_b64decode(raw.encode()))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = {
+                field: model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.ordering, values)
+            }
+            return bool(payload['r']), position
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
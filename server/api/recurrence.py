@@ -0,0 +1,383 @@
+import copy
+import heapq
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from itertools import islice, takewhile
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Recurring appointments: an appointment with a `recurrence` rule stands for a
+# series, its `start`/`end` being the first occurrence. The rule is a subset
+# of iCalendar's RRULE (RFC 5545), e.g. `FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10`:
+#
+#   FREQ      DAILY, WEEKLY or MONTHLY
+#   INTERVAL  every how many days/weeks/months, 1 by default
+#   BYDAY     the weekdays of a WEEKLY rule, the start's weekday by default
+#   COUNT     how many occurrences there are, up to `MAX_COUNT`, or
+#   UNTIL     the last day (20250630) or instant (20250630T170000Z) one can start
+#
+# A series with COUNT or UNTIL can span at most `MAX_SPAN`, an endless one
+# can't have occurrences further apart.
+#
+# Occurrences skipped in `recurrence_exceptions` (their start times) still
+# count towards COUNT. They keep the wall clock time of the first one in the
+# default time zone, a 9:00 meeting stays at 9:00 across DST changes. There
+# are none after year 9999.
+#
+# Only the series is stored, its occurrences are generated when a window
+# (`from` and `to`) is asked for and only for that window, skipping ahead to
+# it for daily and weekly rules. Generated occurrences are memoized per series
+# content and window in `expansions`, lazily, so the first page of a long
+# window doesn't pay for the rest of it. Lists, exports, the timeline, the
+# layout and availability merge the occurrences in among the single
+# appointments, each one rendered like the series with its own `start`/`end`.
+# Without a full window series are listed as stored. Conflict checks compare
+# the occurrences (api.conflicts).
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+PARTS = ('FREQ', 'INTERVAL', 'BYDAY', 'COUNT', 'UNTIL')
+UNTIL = re.compile(r'(\d{4})(\d{2})(\d{2})(?:T(\d{2})(\d{2})(\d{2})(Z?))?$')
+# Windows kept in `expansions`
+MAX_EXPANSIONS = 1024
+# Bounds of a series, saving one finds when it ends
+MAX_COUNT = 10000
+MAX_SPAN = timedelta(days=100 * 366)
+
+Rule = namedtuple('Rule', 'freq interval byday count until')
+
+
+def parse_rule(value):
+    '''Parse a recurrence rule into a `Rule`, raising `ValueError` with what's
+    wrong for anything outside the supported subset'''
+    text = value.strip().upper()
+    if text.startswith('RRULE:'):
+        text = text[len('RRULE:'):]
+
+    parts = {}
+    for part in text.split(';'):
+        name, _, part_value = part.partition('=')
+        if name not in PARTS:
+            raise ValueError(f'Unsupported rule part `{name}`, only {", ".join(PARTS)} are')
+        if not part_value or name in parts:
+            raise ValueError(f'Invalid rule part `{part}`')
+        parts[name] = part_value
+
+    freq = parts.get('FREQ')
+    if freq not in FREQUENCIES:
+        raise ValueError(f'FREQ has to be one of {", ".join(FREQUENCIES)}')
+
+    interval = _positive(parts, 'INTERVAL', 1)
+    count = _positive(parts, 'COUNT', None)
+    if count is not None and count > MAX_COUNT:
+        raise ValueError(f'COUNT can be at most {MAX_COUNT}')
+    if count is not None and 'UNTIL' in parts:
+        raise ValueError('Only one of COUNT and UNTIL can be given')
+
+    byday = None
+    if 'BYDAY' in parts:
+        if freq != 'WEEKLY':
+            raise ValueError('BYDAY is only supported with FREQ=WEEKLY')
+        days = parts['BYDAY'].split(',')
+        if not set(days) <= set(WEEKDAYS):
+            raise ValueError(f'BYDAY takes weekdays, {",".join(WEEKDAYS)}')
+        byday = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+
+    until = None
+    if 'UNTIL' in parts:
+        match = UNTIL.match(parts['UNTIL'])
+        try:
+            if match is None:
+                raise ValueError
+            year, month, day, hour, minute, second, utc = match.groups()
+            if hour is None:
+                # The whole day counts
+                until = timezone.make_aware(datetime.combine(
+                    date(int(year), int(month), int(day)), time.max), timezone.get_default_timezone())
+            else:
+                until = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+                until = (until.replace(tzinfo=dt_timezone.utc) if utc
+                         else timezone.make_aware(until, timezone.get_default_timezone()))
+        except ValueError:
+            raise ValueError('UNTIL has to be a date (YYYYMMDD) or a time (YYYYMMDDTHHMMSSZ)')
+
+    return Rule(freq, interval, byday, count, until)
+
+
+def _positive(parts, name, default):
+    if name not in parts:
+        return default
+    try:
+        value = int(parts[name])
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise ValueError(f'{name} has to be a positive number')
+    return value
+
+
+def as_datetime(value):
+    '''A `recurrence_exceptions` item, stored as an ISO string'''
+    return parse_datetime(value) if isinstance(value, str) else value
+
+
+def _days(first, rule, since):
+    '''`(n, day)` of the days the rule gives from `first` on, n being how many
+    came before. Daily and weekly rules start right before `since`.'''
+    step = rule.interval
+    if rule.freq == 'DAILY':
+        k = max(0, (since - first).days // step)
+        while True:
+            try:
+                day = first + timedelta(days=k * step)
+            except OverflowError:
+                # Past year 9999
+                return
+            yield k, day
+            k += 1
+
+    elif rule.freq == 'WEEKLY':
+        weekdays = rule.byday or (first.weekday(),)
+        monday = first - timedelta(days=first.weekday())
+        # The first week only has the days from `first` on
+        first_week = [weekday for weekday in weekdays if weekday >= first.weekday()]
+        k = max(0, (since - monday).days // (7 * step))
+        n = 0 if k == 0 else len(first_week) + (k - 1) * len(weekdays)
+        while True:
+            for weekday in (first_week if k == 0 else weekdays):
+                try:
+                    day = monday + timedelta(weeks=k * step, days=weekday)
+                except OverflowError:
+                    return
+                yield n, day
+                n += 1
+            k += 1
+
+    else:
+        # Months without the day (the 31st, February 30th) are skipped, as in
+        # RFC 5545
+        n = k = 0
+        while True:
+            years, month = divmod(first.month - 1 + k * step, 12)
+            if first.year + years > date.max.year:
+                return
+            try:
+                day = first.replace(year=first.year + years, month=month + 1)
+            except ValueError:
+                pass
+            else:
+                yield n, day
+                n += 1
+            k += 1
+
+
+def occurrences(start, end, rule, exceptions=(), after=None):
+    '''`(start, end)` of the occurrences of a series, in order, from the first
+    one ending after `after`. Endless without COUNT or UNTIL.'''
+    if isinstance(rule, str):
+        rule = parse_rule(rule)
+    tz = timezone.get_default_timezone()
+    first = timezone.localtime(start, tz)
+    duration = end - start
+    excluded = {as_datetime(value) for value in exceptions}
+
+    # A day early, DST moves the local date of `after` around
+    since = first.date()
+    if after is not None:
+        since = max(since, timezone.localtime(after - duration, tz).date() - timedelta(days=1))
+
+    for n, day in _days(first.date(), rule, since):
+        if rule.count is not None and n >= rule.count:
+            return
+        occurrence_start = timezone.make_aware(datetime.combine(day, first.time()), tz)
+        if rule.until is not None and occurrence_start > rule.until:
+            return
+        if occurrence_start < start or occurrence_start in excluded:
+            continue
+        try:
+            occurrence_end = occurrence_start + duration
+        except OverflowError:
+            return
+        if after is None or occurrence_end > after:
+            yield occurrence_start, occurrence_end
+
+
+def check_span(start, rule):
+    '''Raise `ValueError` if the series starting at `start` goes on for longer
+    than `MAX_SPAN`, or an endless one has that long between occurrences'''
+    if isinstance(rule, str):
+        rule = parse_rule(rule)
+    years = MAX_SPAN.days // 366
+    if rule.until is not None:
+        if rule.until - start > MAX_SPAN:
+            raise ValueError(f'UNTIL can be at most {years} years after the start')
+    elif rule.count is not None:
+        # None after year 9999 either
+        if (rule.count > 1 and len(list(islice(occurrences(start, start, rule), 2))) < 2
+                or last_end(start, start, rule) - start > MAX_SPAN):
+            raise ValueError(f'The occurrences can span at most {years} years, lower COUNT or INTERVAL')
+    else:
+        times = list(islice(occurrences(start, start, rule), 2))
+        if len(times) < 2 or times[1][0] - start > MAX_SPAN:
+            raise ValueError(f'INTERVAL can be at most {years} years')
+
+
+def last_end(start, end, recurrence, exceptions=()):
+    '''When the last occurrence of a series ends, `None` if it never does'''
+    rule = parse_rule(recurrence) if isinstance(recurrence, str) else recurrence
+    if rule.count is None and rule.until is None:
+        return None
+    last = end
+    for _, last in occurrences(start, end, rule, exceptions, after=_near_end(start, rule, len(exceptions))):
+        pass
+    return last
+
+
+def _near_end(start, rule, skipped):
+    '''A time before the last occurrences of a daily or weekly series with
+    COUNT or UNTIL, and before `skipped` more of them, so only those are
+    walked through. `None` for monthly ones, when it's close to `start`, or
+    past year 9999 where the occurrences stop.'''
+    tz = timezone.get_default_timezone()
+    first = timezone.localtime(start, tz).date()
+    try:
+        if rule.freq == 'DAILY':
+            period = rule.interval
+            if rule.count is not None:
+                last = first + timedelta(days=(rule.count - 1) * period)
+        elif rule.freq == 'WEEKLY':
+            period = 7 * rule.interval
+            if rule.count is not None:
+                # Week k has the occurrences from about k * len(weekdays) on
+                weeks = max(0, (rule.count - 1) // len(rule.byday or (None,)) - 1)
+                last = first - timedelta(days=first.weekday()) + timedelta(days=weeks * period)
+        else:
+            return None
+        if rule.count is None:
+            last = timezone.localtime(rule.until, tz).date()
+        # Every period has at least one occurrence
+        anchor = last - timedelta(days=(skipped + 2) * period)
+    except OverflowError:
+        return None
+    if anchor <= first:
+        return None
+    return start + (anchor - first)
+
+
+class Memoized:
+    '''Iterable over what `source` yields, which can be iterated any number
+    of times, by any number of threads, while `source` only runs once and
+    only as far as the furthest of them got'''
+
+    def __init__(self, source):
+        self.source = source
+        self.items = []
+        self.done = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i < len(self.items):
+                yield self.items[i]
+                i += 1
+                continue
+            with self.lock:
+                if i < len(self.items):
+                    continue
+                if self.done:
+                    return
+                try:
+                    self.items.append(next(self.source))
+                except StopIteration:
+                    self.done = True
+                    return
+
+
+class Expansions:
+    '''The occurrences of series within windows, the last `max_entries` of
+    them. Keyed by what defines the occurrences, so editing a series never
+    finds the old ones.'''
+
+    def __init__(self, max_entries=MAX_EXPANSIONS):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, start, end, recurrence, exceptions, window_start, window_end):
+        key = (start, end, recurrence, tuple(map(str, exceptions)), window_start, window_end)
+        with self.lock:
+            memo = self.entries.get(key)
+            if memo is not None:
+                self.entries.move_to_end(key)
+                return memo
+            memo = self.entries[key] = Memoized(takewhile(
+                lambda occurrence: occurrence[0] < window_end,
+                occurrences(start, end, recurrence, exceptions, after=window_start)))
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return memo
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+expansions = Expansions()
+
+
+def series_overlapping(start, end, prefix=''):
+    '''Condition on the series (reached through `prefix`) that may occur
+    within `[start, end)`'''
+    condition = ~Q(**{f'{prefix}recurrence': ''})
+    if end is not None:
+        condition &= Q(**{f'{prefix}start__lt': end})
+    if start is not None:
+        condition &= (Q(**{f'{prefix}recurrence_until__isnull': True})
+                      | Q(**{f'{prefix}recurrence_until__gt': start}))
+    return condition
+
+
+def _get(item, field):
+    return item[field] if isinstance(item, dict) else getattr(item, field)
+
+
+def occurrence(item, start, end):
+    '''A copy of the series `item` (`values()` row or instance) for one occurrence'''
+    if isinstance(item, dict):
+        return {**item, 'start': start, 'end': end}
+    item = copy.copy(item)
+    item.start, item.end = start, end
+    return item
+
+
+def window_occurrences(item, start, end):
+    '''`(start, end)` of the occurrences of the series `item` within `[start, end)`'''
+    return expansions.get(_get(item, 'start'), _get(item, 'end'), _get(item, 'recurrence'),
+                          _get(item, 'recurrence_exceptions') or (), start, end)
+
+
+def split_series(queryset):
+    '''The single appointments of `queryset` and the series'''
+    return queryset.filter(recurrence=''), queryset.exclude(recurrence='')
+
+
+def occurrence_streams(series, start, end):
+    '''For each series, its occurrences within `[start, end)` as copies of it,
+    in order'''
+    return [(occurrence(item, *times) for times in window_occurrences(item, start, end))
+            for item in series]
+
+
+def ordering_key(ordering):
+    '''Key function sorting rows (dicts or instances) on `ordering`'''
+    return lambda item: tuple(_get(item, field) for field in ordering)
+
+
+def merged(rows, streams, ordering):
+    '''`rows` and the occurrence `streams`, each sorted on `ordering`, merged'''
+    return heapq.merge(rows, *streams, key=ordering_key(ordering))
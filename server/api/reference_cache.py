@@ -0,0 +1,187 @@
+import threading
+from collections import OrderedDict
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from api.expand import tables_read
+from api.replicas import reads_after
+from api.versions import get_versions
+
+# In-process cache of serialized reference data (departments, positions and
+# department memberships), read on most request paths and rarely written.
+#
+# Entries record the tables they were built from and are keyed on those
+# tables' version markers, so a write anywhere (any worker) makes them
+# unreachable. The signal handlers also drop them from the local LRU right
+# away, which keeps dead entries from taking up its slots. Entries are
+# computed from the primary, not a replica that may be behind their versions.
+#
+# Configured with `API_REFERENCE_CACHE`:
+#   'BACKEND': 'local' (default), a bounded LRU in process memory, or 'django'
+#              to keep the entries in the Django cache named by 'ALIAS'
+#   'MAX_ENTRIES': size of the local LRU (default 512)
+#   'TIMEOUT': timeout of the entries on the Django cache (default 1 hour)
+
+MISSING = object()
+
+
+class LocalBackend:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+            except KeyError:
+                return MISSING
+
+    def set(self, key, tables, value):
+        with self.lock:
+            self.entries[key] = (tables, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, table):
+        with self.lock:
+            for key in [k for k, (tables, _) in self.entries.items() if table in tables]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DjangoCacheBackend:
+    '''Entries in a Django cache, shared by the workers. Stale entries are
+    never read again and expire on their own.'''
+
+    def __init__(self, alias, timeout):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.evictions = 0
+
+    def _key(self, key):
+        return f'api:reference:{sha1(repr(key).encode()).hexdigest()}'
+
+    def get(self, key):
+        return self.cache.get(self._key(key), MISSING)
+
+    def set(self, key, tables, value):
+        self.cache.set(self._key(key), value, self.timeout)
+
+    def discard(self, table):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class ReferenceCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, tables, key, compute):
+        '''Return the value cached for `key`, or compute and cache it.
+        `compute` may return `MISSING` for results that aren't to be cached.'''
+        full_key, value = self.lookup(tables, key)
+        if value is MISSING:
+            with reads_after(dict(full_key[1])):
+                value = self.store(full_key, tables, compute())
+        return value
+
+    async def aget_or_compute(self, tables, key, compute):
+        '''`get_or_compute()` for async views, `compute` is a coroutine function'''
+        full_key, value = self.lookup(tables, key)
+        if value is MISSING:
+            with reads_after(dict(full_key[1])):
+                value = self.store(full_key, tables, await compute())
+        return value
+
+    def lookup(self, tables, key):
+        versions = get_versions(tables)
+        full_key = (key, tuple(sorted(versions.items())))
+
+        value = self.backend.get(full_key)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return full_key, value
+
+    def store(self, full_key, tables, value):
+        if value is not MISSING:
+            self.backend.set(full_key, frozenset(tables), value)
+        return value
+
+    def invalidate(self, table):
+        self.backend.discard(table)
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'entries': len(self.backend),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'evictions': self.backend.evictions,
+        }
+
+
+def create_reference_cache():
+    config = getattr(settings, 'API_REFERENCE_CACHE', {})
+    if config.get('BACKEND', 'local') == 'django':
+        backend = DjangoCacheBackend(config.get('ALIAS', 'default'), config.get('TIMEOUT', 60 * 60))
+    else:
+        backend = LocalBackend(config.get('MAX_ENTRIES', 512))
+
+    return ReferenceCache(backend)
+
+
+reference_cache = create_reference_cache()
+
+
+class ReferenceCacheMixin:
+    '''Serves `list` from the reference cache, keyed on the full URL (the
+    pagination links in the data are absolute). Other actions can use
+    `cached_response()` with their own tables.'''
+    reference_tables = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().list, self.reference_tables, request, *args, **kwargs)
+
+    def cached_response(self, handler, tables, request, *args, **kwargs):
+        response = None
+
+        def compute():
+            nonlocal response
+            response = handler(request, *args, **kwargs)
+            return response.data if response.status_code == 200 else MISSING
+
+        data = reference_cache.get_or_compute(
+            tables_read(self, tables), (self.basename, self.action, request.build_absolute_uri()), compute)
+
+        return response if response is not None else Response(data)
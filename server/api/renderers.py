@@ -0,0 +1,34 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    '''`JSONRenderer` encoding with orjson when it's installed, several times
+    faster than the stdlib encoder on large lists.
+
+    The bytes are the same as `JSONRenderer`'s: compact, UTF-8, `\\u2028` and
+    `\\u2029` escaped, and everything orjson would render its own way (e.g.
+    datetimes) goes through DRF's encoder. Only floats written in exponent
+    notation differ, `1e-05` becomes `0.00001`. Indented output (the browsable
+    API, `; indent=`), ASCII-only or non-compact settings, and installs
+    without orjson use `JSONRenderer` as is.'''
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=(
+                orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS))
+        except TypeError:
+            # e.g. integers over 64 bits
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
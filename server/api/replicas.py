@@ -0,0 +1,223 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+# Sends the reads of safe requests (GET, HEAD, OPTIONS) to read replicas.
+#
+# `ReplicaMiddleware` flags the requests allowed to read from a replica,
+# `ReplicaRouter` picks one for each of their queries. Everything else uses
+# the primary (`default`): writes, reads of unsafe requests, reads inside
+# transactions, management commands. A client that just wrote is pinned to
+# the primary for `STICKY_SECONDS` by a cookie, so it reads its own writes
+# while the replicas catch up.
+#
+# What gets kept under the current version markers (api.versions) has to be
+# read from a replica that has the writes those versions stand for, otherwise
+# old rows would be stored under the new version, for good. That's the
+# responses given an ETag, and the reference and layout caches: they read
+# within `reads_after(versions)`, which only lets through replicas known to be
+# past the newest of the versions. With 'least_lag' the router knows from the
+# lags it measured. Round robin doesn't, there the replicas are assumed to be
+# at most `STICKY_SECONDS` behind, as for the sticky cookie, so only the
+# reads of tables written within that long go to the primary. The change
+# feed's positions always come from the primary, within `primary_reads()`,
+# and so does the search index. A 304 still takes no query at all.
+#
+# The sticky cookie is only sent back by clients that include credentials:
+# the calendar is served from another origin, so it would need `fetch(url,
+# {credentials: 'include'})` and `CORS_ALLOW_CREDENTIALS = True`. Without
+# that, it may not see its own writes in the replica reads for a moment.
+#
+# Configured with `API_REPLICAS` (see settings.py):
+#   'ALIASES': the replica database aliases, none turns this off
+#   'SELECTION': 'round_robin' (default), or 'least_lag' to pick the replica
+#                furthest along, skipping those more than 'MAX_LAG' seconds
+#                behind; the lags are measured every 'LAG_CHECK_INTERVAL'
+#   'STICKY_SECONDS': how long a client reads from the primary after a write
+#   'COOKIE': name of the cookie pinning the client
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+replica_reads = ContextVar('replica_reads', default=False)
+# The newest write the reads have to see, a `time.time()`
+written_at = ContextVar('written_at', default=None)
+
+
+@contextmanager
+def primary_reads():
+    '''Read from the primary within the block'''
+    token = replica_reads.set(False)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+@contextmanager
+def reads_after(versions):
+    '''Within the block, read from a replica only if it has the writes of the
+    version markers `versions` (`{name: version}`), from the primary
+    otherwise'''
+    moment = max(versions.values(), default=0) / 10 ** 9
+    token = written_at.set(max(moment, written_at.get() or 0))
+    try:
+        yield
+    finally:
+        written_at.reset(token)
+
+
+def replica_settings():
+    return {
+        'ALIASES': [],
+        'SELECTION': 'round_robin',
+        'STICKY_SECONDS': 5,
+        'MAX_LAG': 30,
+        'LAG_CHECK_INTERVAL': 5,
+        'COOKIE': 'api_primary_until',
+        **getattr(settings, 'API_REPLICAS', {}),
+    }
+
+
+LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+
+def replica_lag(alias):
+    '''Seconds the replica is behind the primary, `None` when it can't be
+    reached. A replica that replayed everything it received counts as current,
+    whatever the age of the last transaction.'''
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_QUERY)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        return None
+    return float(lag or 0)
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.configure()
+
+    def configure(self):
+        config = replica_settings()
+        self.replicas = list(config['ALIASES'])
+        self.selection = config['SELECTION']
+        self.max_lag = config['MAX_LAG']
+        self.sticky_seconds = config['STICKY_SECONDS']
+        self.lag_check_interval = config['LAG_CHECK_INTERVAL']
+        self.rotation = itertools.cycle(self.replicas)
+        self.lags = {}
+        self.lags_checked = None
+        # When the lags were measured, a `time.time()`
+        self.lags_measured = 0
+
+    def db_for_read(self, model, **hints):
+        # Related objects come from where the instance was read
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if not self.replicas or not replica_reads.get():
+            return 'default'
+        # Reads within a write transaction have to see its writes
+        if connections['default'].in_atomic_block:
+            return 'default'
+
+        moment = written_at.get()
+        if self.selection == 'least_lag':
+            return self.least_lagging(moment)
+        if moment is not None and time.time() - moment < self.sticky_seconds:
+            return 'default'
+        with self.lock:
+            return next(self.rotation)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in self.replicas
+
+    def least_lagging(self, moment=None):
+        '''The replica furthest along, of those having the writes up to
+        `moment`'''
+        now = time.monotonic()
+        with self.lock:
+            stale = self.lags_checked is None or now - self.lags_checked > self.lag_check_interval
+            if stale:
+                # Other threads keep using the old numbers meanwhile
+                self.lags_checked = now
+        if stale:
+            measured = time.time()
+            self.lags = {alias: replica_lag(alias) for alias in self.replicas}
+            self.lags_measured = measured
+
+        # A replica only gets further from when its lag was measured
+        current = [(lag, alias) for alias, lag in self.lags.items()
+                   if lag is not None and lag <= self.max_lag
+                   and (moment is None or self.lags_measured - lag >= moment)]
+        return min(current)[1] if current else 'default'
+
+
+class ReplicaMiddleware:
+    '''Lets safe requests read from the replicas, unless the client wrote less
+    than `STICKY_SECONDS` ago, and pins clients sending unsafe requests to the
+    primary for that long'''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = replica_reads.set(self.may_use_replica(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = replica_reads.set(self.may_use_replica(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+        return self.process_response(request, response)
+
+    def may_use_replica(self, request):
+        if request.method not in SAFE_METHODS:
+            return False
+        cookie = replica_settings()['COOKIE']
+        try:
+            return float(request.COOKIES.get(cookie, 0)) < time.time()
+        except ValueError:
+            return True
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS:
+            config = replica_settings()
+            sticky = config['STICKY_SECONDS']
+            response.set_cookie(config['COOKIE'], str(time.time() + sticky),
+                                max_age=sticky, httponly=True, samesite='Lax')
+        return response
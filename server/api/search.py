@@ -0,0 +1,255 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Case, F, Func, Q, Value, When
+from django.db.models.functions import Greatest, Lower, Upper
+from django.db.models.lookups import Regex, StartsWith
+
+from api.models import Employee
+from api.versions import get_version
+
+# Employee search for the participant pickers: `q` is matched against name and
+# email, prefixes first (of the whole name/email, then of any word of it),
+# then near misses ("manger" finds "Manager", transposed letters near the
+# start of short words are too much for trigrams though).
+#
+# On PostgreSQL it's a query on the pg_trgm GIN indexes of migration 0009,
+# whole prefixes with `LIKE 'Q%'`, word prefixes with a regex and near misses
+# with word similarity (`%>`), ranked in the same three tiers.
+#
+# Other backends can't index either, so the matching runs on `EmployeeIndex`,
+# kept in process memory: sorted arrays, prefixes being a `bisect()` away, and
+# a trigram -> words map for the near misses, scored like pg_trgm's word
+# similarity. 100k employees take a couple of seconds to index and well under
+# a millisecond to search. It's built from the table on first use. When the
+# employee version marker moves, which every save, delete and bulk write does
+# (api.signals), in any worker, the employees are read again and only those
+# that changed are taken out of the index and put back in.
+
+WORD = re.compile(r'[^\W_]+')
+# Share of the query's trigrams a word has to contain to count as a match,
+# pg_trgm's default `word_similarity_threshold`
+SIMILARITY_THRESHOLD = 0.6
+
+
+def normalize(value):
+    return ' '.join(WORD.findall(value.casefold()))
+
+
+def trigrams(word):
+    # Padded like pg_trgm's, so the start of a word weighs more than its end
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def keys(pk, name, email):
+    '''`(whole, words)` an employee is found by: `(key, order)` of the whole
+    name and email, and the words of the name and of the email before the @.
+    `order` is `(name, pk)`, what matches of the same key are ranked by.'''
+    order = (name.casefold(), pk)
+    name, local = normalize(name), normalize(email.partition('@')[0])
+    return [(name, order), (normalize(email), order)], set(name.split() + local.split()), order
+
+
+class EmployeeIndex:
+    '''Two sorted arrays: whole names and emails (`whole`), ranked first, and
+    their words (`words`), each with its employees. Both are walked from the
+    `bisect()` of the query, so the matches come out ranked, by what matched
+    then by name, and the walk stops once there are enough.
+
+    Not thread safe, `SharedIndex` serializes the searches and updates.'''
+
+    def __init__(self, version=None):
+        self.version = version
+        # (key, order) sorted
+        self.whole = []
+        self.words = []
+        # word -> orders of its employees, sorted
+        self.word_pks = {}
+        # trigram -> words
+        self.postings = {}
+        # pk -> (name, email, department) the entries were made from
+        self.rows = {}
+
+    @classmethod
+    def build(cls, using):
+        # The version is read first, a write while the rows load makes the
+        # next search read them again
+        index = cls(get_version('employee'))
+        words = {}
+        for name, pk, email, department in index.read(using):
+            index.rows[pk] = (name, email, department)
+            whole, employee_words, order = keys(pk, name, email)
+            index.whole += whole
+            for word in employee_words:
+                words.setdefault(word, []).append(order)
+
+        index.whole.sort()
+        index.words = sorted(words)
+        index.word_pks = {word: sorted(orders) for word, orders in words.items()}
+        for word in index.words:
+            for trigram in trigrams(word):
+                index.postings.setdefault(trigram, set()).add(word)
+        return index
+
+    @staticmethod
+    def read(using):
+        return Employee.objects.using(using).values_list('name', 'pk', 'email', 'department').order_by()
+
+    def sync(self, using):
+        '''Bring the index up to date with the table, changing the entries of
+        the employees added, changed or deleted since it was built'''
+        self.version = get_version('employee')
+        current = {pk: (name, email, department) for name, pk, email, department in self.read(using)}
+        for pk in self.rows.keys() - current.keys():
+            self.remove(pk)
+        for pk, row in current.items():
+            if self.rows.get(pk) != row:
+                if pk in self.rows:
+                    self.remove(pk)
+                self.add(pk, *row)
+
+    def add(self, pk, name, email, department):
+        self.rows[pk] = (name, email, department)
+        whole, words, order = keys(pk, name, email)
+        for entry in whole:
+            insort(self.whole, entry)
+        for word in words:
+            if word not in self.word_pks:
+                insort(self.words, word)
+                self.word_pks[word] = []
+                for trigram in trigrams(word):
+                    self.postings.setdefault(trigram, set()).add(word)
+            insort(self.word_pks[word], order)
+
+    def remove(self, pk):
+        name, email, _ = self.rows.pop(pk)
+        whole, words, order = keys(pk, name, email)
+        for entry in whole:
+            del self.whole[bisect_left(self.whole, entry)]
+        for word in words:
+            orders = self.word_pks[word]
+            del orders[bisect_left(orders, order)]
+            if not orders:
+                del self.word_pks[word]
+                del self.words[bisect_left(self.words, word)]
+                for trigram in trigrams(word):
+                    self.postings[trigram].discard(word)
+                    if not self.postings[trigram]:
+                        del self.postings[trigram]
+
+    def search(self, q, department=None, limit=20):
+        '''Ids of the best `limit` matches for `q`, best first'''
+        q = normalize(q)
+        found = {}
+
+        def add(orders):
+            for _, pk in orders:
+                if pk not in found and (department is None or self.rows[pk][2] == department):
+                    found[pk] = None
+                    if len(found) == limit:
+                        return True
+            return False
+
+        if not q:
+            return []
+        for i in range(bisect_left(self.whole, (q,)), len(self.whole)):
+            key, order = self.whole[i]
+            if not key.startswith(q):
+                break
+            if add((order,)):
+                return list(found)
+        for i in range(bisect_left(self.words, q), len(self.words)):
+            if not self.words[i].startswith(q):
+                break
+            if add(self.word_pks[self.words[i]]):
+                return list(found)
+
+        # Near misses: words sharing most of the query's trigrams (pg_trgm's
+        # word similarity), the closest first
+        wanted = set().union(*(trigrams(word) for word in q.split()))
+        if len(q) >= 3:
+            counts = Counter()
+            for trigram in wanted:
+                counts.update(self.postings.get(trigram, ()))
+            close = sorted((-count, word) for word, count in counts.items()
+                           if count / len(wanted) >= SIMILARITY_THRESHOLD)
+            for _, word in close:
+                if add(self.word_pks[word]):
+                    break
+
+        return list(found)
+
+
+class SharedIndex:
+    '''The process' `EmployeeIndex`, synced when the employee table moves on.
+    Built from the primary, a replica may not have the version's rows yet.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.index = None
+
+    def search(self, q, department=None, limit=20):
+        with self.lock:
+            current = self.index is not None and self.index.version == get_version('employee')
+            if not current and connections[DEFAULT_DB_ALIAS].in_atomic_block:
+                # Built from what this transaction sees, which may never commit
+                return EmployeeIndex.build(DEFAULT_DB_ALIAS).search(q, department, limit)
+            if self.index is None:
+                self.index = EmployeeIndex.build(DEFAULT_DB_ALIAS)
+            elif not current:
+                self.index.sync(DEFAULT_DB_ALIAS)
+            return self.index.search(q, department, limit)
+
+
+employee_index = SharedIndex()
+
+
+def search_employees(queryset, q, department=None, limit=20):
+    '''The employees of `queryset` best matching `q`, best first'''
+    if department is not None:
+        queryset = queryset.filter(department=department)
+
+    if connections[queryset.db].vendor == 'postgresql':
+        return search_postgresql(queryset, q, limit)
+
+    ids = employee_index.search(q, department, limit)
+    found = queryset.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def search_postgresql(queryset, q, limit):
+    '''The tiers of `EmployeeIndex.search()` in one query: prefixes of the
+    whole name or email, of a word of them, then near misses'''
+    from django.contrib.postgres.lookups import TrigramWordSimilar
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    # Upper-cased like Django's `istartswith`, which the indexes are on.
+    # `words` only has letters, digits and spaces, nothing to escape.
+    term, words = q.strip().upper(), normalize(q).upper()
+    name, email = Upper('name'), Upper('email')
+    whole = Q(StartsWith(name, term)) | Q(StartsWith(email, term))
+    prefixes = whole
+    tiers = [When(whole, then=Value(2))]
+    if words and ' ' not in words:
+        # After anything but a letter or digit, in the email before the @
+        word = (Q(Regex(name, f'(^|[^[:alnum:]]){words}'))
+                | Q(Regex(email, f'^[^@]*[^[:alnum:]@]{words}')))
+        prefixes |= word
+        tiers.append(When(word, then=Value(1)))
+    matches, similarity = prefixes, Value(0.0)
+    if len(words) >= 3:
+        # Not the email's domain, the whole email's index narrows it down
+        local = Upper(Func(F('email'), Value('@'), Value(1), function='SPLIT_PART'))
+        matches |= Q(TrigramWordSimilar(name, words)) | (
+            Q(TrigramWordSimilar(email, words)) & Q(TrigramWordSimilar(local, words)))
+        # Only ranks the near misses, prefixes go by name like the index's
+        similarity = Case(When(prefixes, then=Value(0.0)), default=Greatest(
+            TrigramWordSimilarity(words, name), TrigramWordSimilarity(words, local)))
+
+    return list(queryset.filter(matches).annotate(
+        tier=Case(*tiers, default=Value(0)), similarity=similarity,
+    ).order_by('-tier', '-similarity', Lower('name'), 'pk')[:limit])
@@ -1,39 +1,172 @@
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
 from rest_framework import serializers
 
-from api.models import Appointment, Department, Employee, Position
+from api.expand import ExpandableListSerializer, ExpandableSerializerMixin, expanded_serializers
+from api.models import MAX_DURATION, Appointment, Department, Employee, Position
+from api.recurrence import check_span, parse_rule
+from api.rows import RowSerializer
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    '''A `PrimaryKeyRelatedField` that resolves its PKs from the `preloaded`
+    map in the serializer context (`{model: {pk: instance}}`) when there is one.
+
+    Bulk endpoints fill the map with one `IN` query per related model up front,
+    instead of the default one query per value.'''
+
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        preloaded = self.context.get('preloaded', {}).get(model)
+        if preloaded is None:
+            return super().to_internal_value(data)
+
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = model._meta.pk.to_python(data)
+        except (DjangoValidationError, TypeError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        try:
+            return preloaded[pk]
+        except (KeyError, TypeError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class EmployeeSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
 
-class EmployeeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Employee
         fields = '__all__'
+        list_serializer_class = ExpandableListSerializer
+
 
+class DepartmentSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
 
-class DepartmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Department
         fields = '__all__'
+        list_serializer_class = ExpandableListSerializer
 
 
-class DepartmentEmployeesSerializer(serializers.ModelSerializer):
+class DepartmentEmployeesSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
     employees = EmployeeSerializer(many=True, read_only=True)
 
     class Meta:
         model = Department
         fields = ['employees']
+        list_serializer_class = ExpandableListSerializer
 
 
-class PositionSerializer(serializers.ModelSerializer):
+class PositionSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Position
         fields = '__all__'
+        list_serializer_class = ExpandableListSerializer
 
 
-class AppointmentSerializer(serializers.ModelSerializer):
-    participation = serializers.PrimaryKeyRelatedField(
+class AppointmentSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
+    participation = PreloadedPrimaryKeyRelatedField(
         many=True, queryset=Employee.objects.all())
-    employee = serializers.PrimaryKeyRelatedField(
+    employee = PreloadedPrimaryKeyRelatedField(
         queryset=Employee.objects.all())
 
     class Meta:
         model = Appointment
         fields = '__all__'
+        list_serializer_class = ExpandableListSerializer
+
+    def validate_recurrence(self, value):
+        if not value:
+            return ''
+        try:
+            parse_rule(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value.strip().upper()
+
+    def validate_recurrence_exceptions(self, value):
+        if not isinstance(value, list):
+            raise serializers.ValidationError('A list of occurrence start times is required')
+        # Stored as the ISO strings they're rendered as
+        moment = serializers.DateTimeField()
+        return [moment.run_validation(item).astimezone(dt_timezone.utc).isoformat() for item in value]
+
+    def validate(self, attrs):
+        start = attrs.get('start', getattr(self.instance, 'start', None))
+        end = attrs.get('end', getattr(self.instance, 'end', None))
+        if start is not None and end is not None and start >= end:
+            raise serializers.ValidationError({'end': 'The end has to be later than the start'})
+        if start is not None and end is not None and end - start > MAX_DURATION:
+            raise serializers.ValidationError(
+                {'end': f'An appointment can last at most {MAX_DURATION.days} days'})
+
+        recurrence = attrs.get('recurrence', getattr(self.instance, 'recurrence', ''))
+        if recurrence and start is not None:
+            try:
+                check_span(start, recurrence)
+            except ValueError as e:
+                raise serializers.ValidationError({'recurrence': str(e)})
+
+        return attrs
+
+
+# What `expand=` embeds related objects with
+expanded_serializers.update({
+    Employee: EmployeeSerializer,
+    Department: DepartmentSerializer,
+    Position: PositionSerializer,
+    Appointment: AppointmentSerializer,
+})
+
+
+class EmployeeRowSerializer(RowSerializer):
+    '''`EmployeeSerializer` for lists'''
+    columns = ('id', 'name', 'email', 'position', 'department')
+
+
+class AppointmentRowSerializer(RowSerializer):
+    '''`AppointmentSerializer` for lists. On PostgreSQL the participant ids
+    come aggregated into each row, elsewhere from one extra query per page.'''
+    columns = ('id', 'participation', 'employee', 'start', 'end', 'title', 'description',
+               'created_at', 'updated_at', 'recurrence', 'recurrence_exceptions', 'recurrence_until')
+    datetime_columns = ('start', 'end', 'created_at', 'updated_at', 'recurrence_until')
+
+    @classmethod
+    def rows(cls, queryset):
+        queryset = queryset.prefetch_related(None).values(
+            *(c for c in cls.columns if c != 'participation'))
+        if connections[queryset.db].vendor == 'postgresql':
+            from django.contrib.postgres.aggregates import ArrayAgg
+
+            queryset = queryset.annotate(participants=ArrayAgg(
+                'participation', filter=Q(participation__isnull=False),
+                order_by='participation', default=[]))
+        return queryset
+
+    def prepare(self, rows):
+        super().prepare(rows)
+        missing = [row['id'] for row in rows if 'participants' not in row]
+        if not missing:
+            return
+
+        participants = defaultdict(list)
+        links = (Appointment.participation.through.objects
+                 .filter(appointment_id__in=missing)
+                 .order_by('appointment_id', 'employee_id')
+                 .values_list('appointment_id', 'employee_id'))
+        for appointment, employee in links:
+            participants[appointment].append(employee)
+        for row in rows:
+            row.setdefault('participants', participants[row['id']])
+
+    def to_representation(self, row):
+        row['participation'] = row['participants']
+        return super().to_representation(row)
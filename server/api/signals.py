@@ -0,0 +1,164 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api import occupancy
+from api.models import Appointment, AppointmentTombstone, Department, Employee, EmployeeOccupancy, Position
+from api.reference_cache import reference_cache
+from api.versions import bump_version
+
+# Which version markers a write to a model invalidates. Deletes reach further,
+# `SET_NULL` and M2M cleanup update the referencing tables without signals.
+ON_SAVE = {
+    Appointment: ('appointment',),
+    Department: ('department',),
+    Employee: ('employee',),
+    Position: ('position',),
+}
+ON_DELETE = {
+    Appointment: ('appointment',),
+    Department: ('department', 'employee'),
+    Employee: ('employee', 'department', 'appointment'),
+    Position: ('position', 'employee'),
+}
+
+
+def invalidate(name):
+    # Bumped right away so the writer's own transaction reads fresh data, and
+    # again on commit, otherwise a concurrent reader could cache the
+    # pre-commit state under the new version
+    bump_version(name)
+    reference_cache.invalidate(name)
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def model_saved(sender, **kwargs):
+    for name in ON_SAVE[sender]:
+        invalidate(name)
+
+
+def model_deleted(sender, **kwargs):
+    for name in ON_DELETE[sender]:
+        invalidate(name)
+
+
+# Connected per model, a listener without a sender would disable Django's fast
+# deletes everywhere
+for model in ON_SAVE:
+    post_save.connect(model_saved, sender=model)
+for model in ON_DELETE:
+    post_delete.connect(model_deleted, sender=model)
+
+
+@receiver(m2m_changed, sender=Appointment.participation.through)
+def participation_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Participant changes count as changes of the appointment for the change
+    # feed. A reverse clear (from the employee's side) doesn't say which
+    # appointments it touches, so those are looked up before it happens.
+    if action == 'pre_clear' and reverse:
+        instance._cleared_appointments = list(
+            instance.appointment_set.values_list('pk', flat=True))
+    if not action.startswith('post_'):
+        return
+
+    if not reverse:
+        appointments = [instance.pk]
+    elif action == 'post_clear':
+        appointments = getattr(instance, '_cleared_appointments', [])
+    else:
+        appointments = pk_set or []
+    Appointment.objects.filter(pk__in=appointments).update(updated_at=timezone.now())
+
+    invalidate('appointment')
+    participation_occupancy(instance, action, reverse, pk_set, appointments)
+
+
+def participation_occupancy(instance, action, reverse, pk_set, appointments):
+    # The participants added or removed, on the days of the appointments
+    if reverse:
+        employees = [instance.pk]
+    elif action == 'post_clear':
+        employees = getattr(instance, '_cleared_participants', [])
+    else:
+        employees = pk_set or []
+    days = {day for appointment_days, _ in occupancy.appointment_days(appointments).values()
+            for day in appointment_days}
+    occupancy.changed({(employee, day) for employee in employees for day in days})
+
+
+@receiver(m2m_changed, sender=Appointment.participation.through)
+def participation_clearing(sender, instance, action, reverse, **kwargs):
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_participants = list(
+            instance.participation.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Employee)
+def employee_deleting(sender, instance, **kwargs):
+    # Deleting an employee drops their participation rows and nulls the
+    # organizer field without any signal, so the appointments are touched here
+    Appointment.objects.filter(
+        Q(employee=instance) | Q(participation=instance)).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    AppointmentTombstone.objects.create(appointment_id=instance.pk)
+
+
+# Daily occupancy (api.occupancy), the cells an appointment counted in before
+# the write are refreshed along with those it counts in after
+
+@receiver(pre_save, sender=Appointment)
+def appointment_saving(sender, instance, raw=False, **kwargs):
+    instance._occupancy_before = (
+        occupancy.cells([instance.pk]) if instance.pk is not None and not raw else set())
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        occupancy.changed(getattr(instance, '_occupancy_before', set()) | occupancy.cells([instance.pk]))
+
+
+@receiver(pre_delete, sender=Appointment)
+def appointment_deleting(sender, instance, **kwargs):
+    instance._occupancy_before = occupancy.cells([instance.pk])
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_occupancy_deleted(sender, instance, **kwargs):
+    occupancy.changed(getattr(instance, '_occupancy_before', set()))
+
+
+@receiver(pre_save, sender=Employee)
+def employee_saving(sender, instance, raw=False, **kwargs):
+    # Moving to another department moves the employee's days with them
+    instance._previous_department = None
+    if instance.pk is not None and not raw:
+        instance._previous_department = (Employee.objects.filter(pk=instance.pk)
+                                         .values_list('department_id', flat=True).first())
+
+
+@receiver(post_save, sender=Employee)
+def employee_occupancy_saved(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_department', None)
+    if created or raw or previous == instance.department_id:
+        return
+    days = EmployeeOccupancy.objects.filter(employee=instance).values_list('day', flat=True)
+    occupancy.changed({(instance.pk, day) for day in days}, [previous] if previous else [])
+
+
+@receiver(pre_delete, sender=Employee)
+def employee_occupancy_deleting(sender, instance, **kwargs):
+    # Their department's totals lose them, their own rows go with the cascade
+    instance._occupancy_days = list(
+        EmployeeOccupancy.objects.filter(employee=instance).values_list('day', flat=True))
+
+
+@receiver(post_delete, sender=Employee)
+def employee_occupancy_deleted(sender, instance, **kwargs):
+    occupancy.changed({(instance.pk, day) for day in getattr(instance, '_occupancy_days', [])},
+                      [instance.department_id] if instance.department_id else [])
@@ -1,10 +1,38 @@
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta, timezone
+from io import StringIO
+from itertools import islice
+import asyncio
 import json
-from django.test import TestCase
+import os
+import tempfile
+from asgiref.sync import sync_to_async
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 
-from api.models import Appointment, Department, Employee, Position
+from api import occupancy
+from api.benchmark import data, runner
+from api.conditional import ConditionalMixin
+from api.events import Broadcaster, broadcaster
+from api.filters import overlapping
+from api.health import pool_stats
+from api.instrumentation import InstrumentationMiddleware, metrics
+from api.models import MAX_DURATION, Appointment, AppointmentTombstone, Department, DepartmentOccupancy, Employee, EmployeeOccupancy, Position
+from api.recurrence import expansions, last_end, occurrences, parse_rule
+from api.renderers import FastJSONRenderer
+from api.reference_cache import MISSING, LocalBackend, reference_cache
+from api.replicas import ReplicaMiddleware, ReplicaRouter, primary_reads, reads_after, replica_reads
+from api.search import EmployeeIndex, search_postgresql
+from api.serializers import AppointmentRowSerializer, AppointmentSerializer, EmployeeRowSerializer, EmployeeSerializer
+from api.versions import bump_version
+from api.views import appointment_queryset
 
 
 def setup_db(cls):
@@ -78,6 +106,35 @@ def setup_db(cls):
     pass
 
 
+def add_rows(cls, count=5):
+    '''Add `count` more of everything, appointments with a couple of participants'''
+    for i in range(count):
+        position = Position.objects.create(name=f'Extra Position {i}')
+        department = Department.objects.create(
+            name=f'Extra Department {i}', manager=cls.third_man)
+        employee = Employee.objects.create(
+            name=f'Extra Employee {i}', email=f'extra{i}@inc.com',
+            position=position, department=cls.first_dep)
+        appointment = Appointment.objects.create(
+            **cls.appointments_data[i % len(cls.appointments_data)], employee=employee)
+        appointment.participation.set([employee, cls.first_emp])
+
+
+class QueryCountMixin:
+    def assertListQueries(self, url, num, grow):
+        '''Assert that `url` takes exactly `num` queries, both before and after
+        `grow` adds more rows, so N+1 patterns show up as failures'''
+        with self.assertNumQueries(num):
+            before = self.client.get(url)
+        grow()
+        with self.assertNumQueries(num):
+            after = self.client.get(url)
+
+        self.assertEqual(before.status_code, 200)
+        self.assertEqual(after.status_code, 200)
+        return after
+
+
 class EmployeeTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -124,12 +181,12 @@ class EmployeeTests(TestCase):
         resp1 = self.client.get(f'/employees/?email={email}')
         self.assertEqual(resp1.status_code, 200)
         self.assertEqual(
-            resp1.json()[0]['name'], Employee.objects.filter(email=email).first().name)
+            resp1.json()['results'][0]['name'], Employee.objects.filter(email=email).first().name)
 
         name = 'Second Employee'
         resp2 = self.client.get(f'/employees/?name={name}')
         self.assertEqual(resp2.status_code, 200)
-        self.assertEqual(resp2.json()[0]['name'], Employee.objects.filter(
+        self.assertEqual(resp2.json()['results'][0]['name'], Employee.objects.filter(
             name=name).first().name)
 
         email = 'third@inc.com'
@@ -138,12 +195,12 @@ class EmployeeTests(TestCase):
             f'/employees/?email={email}&name={name}')
 
         self.assertEqual(resp3.status_code, 200)
-        self.assertEqual(resp3.json()[0]['name'], Employee.objects.filter(
+        self.assertEqual(resp3.json()['results'][0]['name'], Employee.objects.filter(
             name=name).filter(email=email).first().name)
 
         resp4 = self.client.get('/employees/?name=No Such')
         self.assertEqual(resp3.status_code, 200)
-        self.assertEqual(resp4.json(), [])
+        self.assertEqual(resp4.json()['results'], [])
 
         pass
 
@@ -169,6 +226,34 @@ class EmployeeTests(TestCase):
 
         pass
 
+    def test_bulk(self):
+        resp = self.client.post('/employees/bulk/', [
+            {'name': f'Bulk Employee {i}', 'email': f'bulk{i}@inc.com',
+             'position': self.employee_position.id, 'department': self.second_dep.id}
+            for i in range(10)
+        ], format='json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(len(resp.json()['created']), 10)
+        self.assertEqual(self.second_dep.employees.count(), 11)
+
+        resp2 = self.client.patch('/employees/bulk/', [
+            {'id': pk, 'department': self.first_dep.id} for pk in resp.json()['created']
+        ], format='json')
+        self.assertEqual(resp2.status_code, 200)
+        self.assertEqual(self.second_dep.employees.count(), 1)
+
+        resp3 = self.client.post('/employees/bulk/', [
+            {'name': 'Fine', 'email': 'fine@inc.com'},
+            {'name': 'Broken', 'email': 'not an email', 'position': 12345},
+        ], format='json')
+        self.assertEqual(resp3.status_code, 400)
+        errors = resp3.json()['errors']
+        self.assertEqual([e['index'] for e in errors], [1])
+        self.assertCountEqual(errors[0]['errors'], ['email', 'position'])
+        self.assertFalse(Employee.objects.filter(name='Fine').exists())
+
+        pass
+
     def test_destroy(self):
         id = self.first_emp.id
         resp = self.client.delete(f'/employees/{id}/')
@@ -193,6 +278,264 @@ class AppointmentTests(TestCase):
         self.assertEqual(resp.status_code, 200)
         pass
 
+    def test_retrieve_window(self):
+        today = date.today().isoformat()
+        resp = self.client.get(f'/appointments/?from={today}&to={today}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['results']), 3)
+
+        # Overlap semantics: the 8:00-8:30 one ends before, the 9:00-10:00 one straddles the window
+        resp2 = self.client.get(
+            f'/appointments/?from={today}T08:30:00&to={today}T09:30:00')
+        self.assertEqual(resp2.status_code, 200)
+        self.assertEqual([a['title'] for a in resp2.json()['results']],
+                         ['Second Appointment'])
+
+        resp3 = self.client.get(f'/appointments/?from={today}T15:00:00')
+        self.assertEqual([a['title'] for a in resp3.json()['results']],
+                         ['Third Appointment'])
+
+        resp4 = self.client.get('/appointments/?from=yesterday')
+        self.assertEqual(resp4.status_code, 400)
+
+        pass
+
+    def test_max_duration(self):
+        start = datetime.combine(date.today(), time(9), tzinfo=timezone.utc) - timedelta(days=30)
+        resp = self.client.post('/appointments/', {
+            'start': start.isoformat(), 'end': (start + MAX_DURATION).isoformat(),
+            'title': 'Offsite', 'description': 'All month',
+            'employee': self.third_man.id, 'participation': [],
+        }, format='json')
+        self.assertEqual(resp.status_code, 201)
+        app_id = resp.json()['id']
+
+        # Still going on, for all it started before the window
+        window = start + MAX_DURATION - timedelta(hours=1)
+        resp = self.client.get(f'/appointments/?from={window.isoformat()}'.replace('+', '%2B'))
+        self.assertIn(app_id, [a['id'] for a in resp.json()['results']])
+
+        resp = self.client.patch(f'/appointments/{app_id}/', {
+            'end': (start + MAX_DURATION + timedelta(minutes=1)).isoformat(),
+        }, format='json')
+        self.assertEqual(resp.status_code, 400)
+
+        # Scanned from `MAX_DURATION` before the window, not from the beginning
+        sql = str(overlapping(Appointment.objects.all(), window, None).query)
+        self.assertIn('"start" >', sql)
+
+    def test_layout(self):
+        cache.clear()
+        today = date.today().isoformat()
+
+        resp = self.client.get(f'/appointments/layout/?date={today}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([g['columns'] for g in resp.json()], [1, 1, 1])
+
+        # Bridges the first two, which can still share a column as they don't overlap
+        Appointment.objects.create(
+            start=datetime.combine(date.today(), time(8, 15)),
+            end=datetime.combine(date.today(), time(9, 15)),
+            title='Bridging Appointment',
+            description='Bridging Appointment Description')
+
+        resp2 = self.client.get(f'/appointments/layout/?date={today}')
+        groups = resp2.json()
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(groups[0]['columns'], 2)
+        self.assertEqual(
+            [(a['title'], a['column']) for a in groups[0]['appointments']],
+            [('First Appointment', 0), ('Bridging Appointment', 1), ('Second Appointment', 0)])
+
+        resp3 = self.client.get('/appointments/layout/')
+        self.assertEqual(resp3.status_code, 400)
+
+        pass
+
+    def test_layout_window(self):
+        cache.clear()
+        late = Appointment.objects.create(
+            start=datetime(2025, 6, 9, 22, 30, tzinfo=timezone.utc),
+            end=datetime(2025, 6, 9, 23, 30, tzinfo=timezone.utc),
+            title='Late', description='Late', employee=self.first_emp)
+
+        def titles(query):
+            resp = self.client.get(f'/appointments/layout/?{query}')
+            self.assertEqual(resp.status_code, 200)
+            return [a['title'] for group in resp.json() for a in group['appointments']]
+
+        # Already the 10th two hours east of UTC, the day the server has it on
+        # is the 9th
+        self.assertEqual(titles('from=2025-06-10T00:00:00%2B02:00&to=2025-06-11T00:00:00%2B02:00'),
+                         [late.title])
+        self.assertEqual(titles('from=2025-06-09T00:00:00%2B02:00&to=2025-06-10T00:00:00%2B02:00'), [])
+        self.assertEqual(titles('date=2025-06-09'), [late.title])
+
+        for query in ('from=2025-06-09T00:00:00Z', 'from=2025-06-09T00:00:00Z&to=2025-06-11T00:00:00Z'):
+            self.assertEqual(self.client.get(f'/appointments/layout/?{query}').status_code, 400)
+
+    def test_pagination(self):
+        # Extra rows share start times with the originals, so the pages have to
+        # break ties on `id`
+        add_rows(self)
+        expected = list(Appointment.objects.order_by(
+            'start', 'id').values_list('id', flat=True))
+
+        seen = []
+        pages = []
+        url = '/appointments/?page_size=3'
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page)
+            seen += [a['id'] for a in page['results']]
+            url = page['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        back = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual(back['results'], pages[1]['results'])
+        self.assertIsNotNone(back['next'])
+
+        resp = self.client.get('/appointments/?cursor=garbage')
+        self.assertEqual(resp.status_code, 404)
+
+        pass
+
+    def test_pagination_microseconds(self):
+        # Starts within the same millisecond, a cursor cut down to
+        # milliseconds would seek back to the first of them over and over
+        start = self.appointments_data[0]['start'] + timedelta(days=1)
+        for i in range(1, 4):
+            Appointment.objects.create(
+                start=start + timedelta(microseconds=i * 100), end=start + timedelta(hours=1),
+                title=f'Microsecond Appointment {i}', description='')
+        expected = list(Appointment.objects.order_by(
+            'start', 'id').values_list('id', flat=True))
+
+        seen = []
+        url = '/appointments/?page_size=1'
+        while url and len(seen) <= len(expected):
+            page = self.client.get(url).json()
+            seen += [a['id'] for a in page['results']]
+            url = page['next']
+        self.assertEqual(seen, expected)
+
+        pass
+
+    def test_bulk(self):
+        def items(count):
+            return [{
+                **{k: v.isoformat() for k, v in self.appointments_data[0].items()
+                   if k in ('start', 'end')},
+                'title': f'Bulk Appointment {i}',
+                'description': 'Imported',
+                'employee': self.third_man.id,
+                'participation': [self.first_emp.id, self.second_emp.id],
+            } for i in range(count)]
+
+        # Validation and writes don't depend on the number of items
+        with CaptureQueriesContext(connection) as few:
+            resp = self.client.post('/appointments/bulk/', items(2), format='json')
+        with CaptureQueriesContext(connection) as many:
+            resp2 = self.client.post('/appointments/bulk/', items(50), format='json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp2.status_code, 201)
+        self.assertEqual(len(few), len(many))
+
+        created = Appointment.objects.filter(pk__in=resp2.json()['created'])
+        self.assertEqual(created.count(), 50)
+        self.assertEqual(
+            Appointment.participation.through.objects.filter(appointment__in=created).count(), 100)
+
+        ids = resp.json()['created']
+        resp3 = self.client.patch('/appointments/bulk/', [
+            {'id': ids[0], 'participation': [self.third_man.id]},
+            {'id': ids[1], 'title': 'Renamed'},
+        ], format='json')
+        self.assertEqual(resp3.status_code, 200)
+        self.assertEqual(
+            list(Appointment.objects.get(pk=ids[0]).participation.all()), [self.third_man])
+        self.assertEqual(Appointment.objects.get(pk=ids[1]).title, 'Renamed')
+        self.assertEqual(Appointment.objects.get(pk=ids[1]).participation.count(), 2)
+
+        resp4 = self.client.patch('/appointments/bulk/', [
+            {'id': ids[0], 'participation': [self.third_man.id, 12345]},
+            {'title': 'No id'},
+        ], format='json')
+        self.assertEqual(resp4.status_code, 400)
+
+        resp5 = self.client.delete('/appointments/bulk/', ids + [12345], format='json')
+        self.assertEqual(resp5.status_code, 200)
+        self.assertEqual(resp5.json(), {'deleted': ids, 'missing': [12345]})
+        self.assertFalse(Appointment.objects.filter(pk__in=ids).exists())
+
+        pass
+
+    def test_export(self):
+        add_rows(self)
+
+        resp = self.client.get('/appointments/export/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        rows = [json.loads(line)
+                for line in b''.join(resp.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 8)
+        # Same shape as the list endpoint
+        listed = self.client.get('/appointments/').json()['results']
+        self.assertEqual(rows, listed)
+
+        today = date.today().isoformat()
+        resp2 = self.client.get(
+            f'/appointments/export/?type=csv&from={today}T13:00:00&to={today}')
+        self.assertEqual(resp2['Content-Type'], 'text/csv')
+        lines = b''.join(resp2.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'id,participation,employee,start,end,title,description,created_at,updated_at,'
+                         'recurrence,recurrence_exceptions,recurrence_until')
+        self.assertEqual(len(lines), 1 + 2)
+
+        resp3 = self.client.get('/appointments/export/?type=xml')
+        self.assertEqual(resp3.status_code, 400)
+
+        pass
+
+    def test_conflicts(self):
+        today = date.today().isoformat()
+        booked = Appointment.objects.create(**self.appointments_data[1])
+        booked.participation.set([self.first_emp])
+
+        def create(start, end, check=True):
+            return self.client.post(
+                f'/appointments/?check_conflicts={"true" if check else "false"}', {
+                    'start': f'{today}T{start}', 'end': f'{today}T{end}',
+                    'title': 'New', 'description': 'New Description',
+                    'employee': self.third_man.id,
+                    'participation': [self.first_emp.id, self.second_emp.id],
+                }, format='json')
+
+        resp = create('09:30', '10:30')
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['conflicts'],
+                         [{'employee': self.first_emp.id, 'appointments': [booked.id]}])
+
+        # Touching ends don't overlap
+        self.assertEqual(create('10:00', '11:00').status_code, 201)
+        self.assertEqual(create('09:30', '10:30', check=False).status_code, 201)
+
+        # Moving the booked one onto the 10:00 one conflicts for everyone in both
+        resp2 = self.client.patch(f'/appointments/{booked.id}/?check_conflicts=1', {
+            'start': f'{today}T10:15', 'end': f'{today}T10:45',
+        }, format='json')
+        self.assertEqual(resp2.status_code, 409)
+        self.assertEqual([c['employee'] for c in resp2.json()['conflicts']],
+                         [self.first_emp.id])
+
+        resp3 = create('11:00', '10:00', check=False)
+        self.assertEqual(resp3.status_code, 400)
+        self.assertIn('end', resp3.json())
+
+        pass
+
     def test_retrieve_one(self):
         pass
 
@@ -215,6 +558,1318 @@ class AppointmentTests(TestCase):
     pass
 
 
+class QueryCountTests(QueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    def setUp(self):
+        # The counts are of uncached requests
+        reference_cache.clear()
+
+    def test_employees(self):
+        self.assertListQueries('/employees/', 1, lambda: add_rows(self))
+
+    def test_departments(self):
+        self.assertListQueries('/departments/', 1, lambda: add_rows(self))
+        self.assertListQueries(
+            f'/departments/{self.first_dep.id}/employees/', 2, lambda: add_rows(self))
+
+    def test_positions(self):
+        self.assertListQueries('/positions/', 1, lambda: add_rows(self))
+
+    def test_appointments(self):
+        resp = self.assertListQueries(
+            '/appointments/', 2, lambda: add_rows(self))
+        self.assertEqual(len(resp.json()['results']), 3 + 5)
+        extra = Employee.objects.get(name='Extra Employee 4')
+        appointment = next(a for a in resp.json()['results']
+                           if a['employee'] == extra.id)
+        self.assertCountEqual(appointment['participation'],
+                              [extra.id, self.first_emp.id])
+
+    pass
+
+
+@override_settings(APPOINTMENT_CHANGES_SETTLE_SECONDS=0)
+class ChangesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    def sync(self, token=None, page_size=100):
+        url = f'/appointments/changes/?page_size={page_size}'
+        if token:
+            url += f'&since={token}'
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_sync(self):
+        # Initial load, in pages
+        first = self.sync(page_size=2)
+        self.assertTrue(first['has_more'])
+        second = self.sync(first['token'], page_size=2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['changed']) + len(second['changed']), 3)
+
+        self.assertEqual(self.sync(second['token'])['changed'], [])
+
+        first_app = Appointment.objects.get(title='First Appointment')
+        second_app = Appointment.objects.get(title='Second Appointment')
+        first_app.title = 'Renamed'
+        first_app.save()
+        second_app.participation.add(self.first_emp)
+        self.client.delete(f'/appointments/{self.first_app.id}/')
+
+        changes = self.sync(second['token'])
+        self.assertEqual([a['title'] for a in changes['changed']],
+                         ['Renamed', 'Second Appointment'])
+        self.assertEqual(changes['deleted'], [self.first_app.id])
+
+        # Deleting a participant changes the appointment too
+        self.first_emp.delete()
+        changes2 = self.sync(changes['token'])
+        self.assertEqual([a['participation'] for a in changes2['changed']], [[]])
+        self.assertEqual(self.sync(changes2['token'])['changed'], [])
+
+        resp = self.client.get('/appointments/changes/?since=nonsense')
+        self.assertEqual(resp.status_code, 400)
+
+        pass
+
+    def test_bulk_update(self):
+        token = self.sync()['token']
+        resp = self.client.patch('/appointments/bulk/', [
+            {'id': self.first_app.id, 'participation': [self.second_emp.id]},
+        ], format='json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([a['id'] for a in self.sync(token)['changed']], [self.first_app.id])
+
+        pass
+
+    def test_retention(self):
+        token = self.sync()['token']
+        self.assertFalse(self.sync(token)['resync'])
+        self.client.delete(f'/appointments/{self.first_app.id}/')
+        AppointmentTombstone.objects.update(deleted_at=datetime.now(timezone.utc) - timedelta(days=40))
+
+        out = StringIO()
+        call_command('prune_tombstones', stdout=out)
+        self.assertIn('Pruned 1 tombstones', out.getvalue())
+        self.assertFalse(AppointmentTombstone.objects.exists())
+
+        # The deletion is gone with its tombstone, the client has to start over
+        later = datetime.now(timezone.utc) + timedelta(days=31)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            changes = self.sync(token)
+        self.assertTrue(changes['resync'])
+        self.assertEqual(len(changes['changed']), 2)
+        self.assertFalse(self.sync(changes['token'])['resync'])
+
+        pass
+
+
+class EventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    async def test_stream(self):
+        start = datetime(2025, 6, 9, 9, tzinfo=timezone.utc)
+        end = datetime(2025, 6, 9, 10, tzinfo=timezone.utc)
+
+        first, second = self.first_emp.pk, self.second_emp.pk
+        resp = await self.async_client.get(
+            f'/appointments/events/?employee={first}&from=2025-06-09&to=2025-06-09')
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        stream = aiter(resp.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+
+        broadcaster.publish('created', {'id': 1}, start, end, {second})
+        broadcaster.publish('created', {'id': 2}, start + timedelta(days=1),
+                            end + timedelta(days=1), {first})
+        broadcaster.publish('updated', {'id': 3}, start, end, {first, second})
+        event = await asyncio.wait_for(anext(stream), 1)
+        self.assertIn(b'event: updated\n', event)
+        self.assertIn(b'data: {"id": 3}', event)
+        await stream.aclose()
+
+        resp2 = await self.async_client.get('/appointments/events/?employee=someone')
+        self.assertEqual(resp2.status_code, 400)
+
+    def test_wsgi(self):
+        # The stream would never end, tying up a WSGI worker
+        resp = self.client.get('/appointments/events/')
+        self.assertEqual(resp.status_code, 501)
+
+    async def test_overflow(self):
+        local = Broadcaster(max_queue=2)
+        subscriber = local.subscribe()
+        for i in range(5):
+            local.publish('resync', {'id': i})
+        await asyncio.sleep(0)
+
+        self.assertTrue(subscriber.overflowed)
+        self.assertEqual(subscriber.queue.qsize(), 1)
+        self.assertIsNone(subscriber.queue.get_nowait())
+
+    def test_publish(self):
+        with mock.patch.object(broadcaster, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(f'/appointments/{self.first_app.id}/', {
+                    'participation': [self.first_emp.id],
+                    'employee': self.third_man.id,
+                }, format='json')
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.delete(f'/appointments/{self.first_app.id}/')
+
+        (updated, deleted) = publish.call_args_list
+        self.assertEqual(updated.args[0], 'updated')
+        self.assertEqual(updated.args[1]['participation'], [self.first_emp.id])
+        self.assertEqual(updated.args[4], {self.first_emp.id, self.third_man.id})
+        self.assertEqual(deleted.args[:2], ('deleted', {'id': self.first_app.id}))
+        self.assertEqual(deleted.args[4], {self.first_emp.id, self.third_man.id})
+
+
+class RowSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        setup_db(cls)
+        add_rows(cls)
+        cls.first_app.participation.set([cls.second_emp, cls.first_emp])
+
+    def test_same_output(self):
+        for model_serializer, row_serializer, queryset in [
+                (AppointmentSerializer, AppointmentRowSerializer, appointment_queryset()),
+                (EmployeeSerializer, EmployeeRowSerializer, Employee.objects.all())]:
+            rows = row_serializer.rows(queryset.order_by('id'))
+            expected = model_serializer(queryset.order_by('id'), many=True).data
+            self.assertEqual(row_serializer(rows, many=True).data, expected)
+
+    def test_renderer(self):
+        data = {'results': AppointmentSerializer(appointment_queryset(), many=True).data,
+                'text': 'line\u2028separator ünïcode', 'at': datetime(2025, 6, 9, 9, 30, 0, 123456,
+                                                                 tzinfo=timezone.utc),
+                1: None}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+
+
+class ExpandTests(QueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+        cls.first_app.employee = cls.first_emp
+        cls.first_app.save()
+        cls.first_app.participation.set([cls.second_emp])
+
+    def test_fields(self):
+        resp = self.client.get('/appointments/?fields=id,title')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(set(resp.json()['results'][0]), {'id', 'title'})
+
+        resp = self.client.get('/appointments/?fields=id,nothing')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_expand(self):
+        url = (f'/appointments/{self.first_app.id}/?expand=employee.department,participation'
+               '&fields=id,employee,participation.name')
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url).json()
+        # The appointment with its organizer and department, then the participants
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(data['employee']['id'], self.first_emp.id)
+        self.assertEqual(data['employee']['department']['name'], 'First Department')
+        self.assertEqual(data['participation'], [{'name': self.second_emp.name}])
+
+        resp = self.client.get('/appointments/?expand=title')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_list_queries(self):
+        self.assertListQueries('/employees/?expand=department,position', 1, lambda: add_rows(self))
+        self.assertListQueries(
+            '/appointments/?expand=employee,participation', 2, lambda: add_rows(self))
+
+
+class BatchRetrieveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    def test_ids(self):
+        ids = [self.third_man.id, self.first_emp.id, 12345, self.third_man.id]
+        with self.assertNumQueries(1):
+            resp = self.client.get(f'/employees/?ids={",".join(map(str, ids))}')
+        self.assertEqual([e['id'] for e in resp.json()['results']],
+                         [self.third_man.id, self.first_emp.id])
+        self.assertEqual(resp.json()['missing'], [12345])
+
+        resp = self.client.get(f'/appointments/?ids={self.first_app.id}&fields=id,title')
+        self.assertEqual(resp.json()['results'], [{'id': self.first_app.id, 'title': self.first_app.title}])
+        resp = self.client.get(f'/positions/?ids={self.manager_position.id}')
+        self.assertEqual(resp.json()['results'][0]['name'], 'manager')
+
+    def test_invalid(self):
+        self.assertEqual(self.client.get('/departments/?ids=1,x').status_code, 400)
+        ids = ','.join(map(str, range(1, 1002)))
+        self.assertEqual(self.client.get(f'/employees/?ids={ids}').status_code, 400)
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+        day = datetime(2025, 6, 9, 9, tzinfo=timezone.utc)
+        cls.organized = Appointment.objects.create(
+            start=day + timedelta(days=1), end=day + timedelta(days=1, hours=1),
+            title='Organized', description='Organized', employee=cls.second_emp)
+        cls.joined = Appointment.objects.create(
+            start=day, end=day + timedelta(hours=1), title='Joined', description='Joined',
+            employee=cls.first_emp)
+        cls.joined.participation.set([cls.second_emp, cls.third_man])
+        cls.both = Appointment.objects.create(
+            start=day + timedelta(days=2), end=day + timedelta(days=2, hours=1),
+            title='Both', description='Both', employee=cls.second_emp)
+        cls.both.participation.set([cls.second_emp])
+        cls.later = Appointment.objects.create(
+            start=day + timedelta(days=30), end=day + timedelta(days=30, hours=1),
+            title='Later', description='Later', employee=cls.second_emp)
+
+    def test_timeline(self):
+        url = f'/employees/{self.second_emp.id}/appointments/?from=2025-06-09&to=2025-06-15'
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()['results']
+        self.assertEqual([a['id'] for a in results],
+                         [self.joined.id, self.organized.id, self.both.id])
+        self.assertEqual(results[0]['participation'], [self.second_emp.id, self.third_man.id])
+
+        page = self.client.get(url + '&page_size=2').json()
+        rest = self.client.get(page['next']).json()
+        self.assertEqual([a['id'] for a in page['results'] + rest['results']],
+                         [a['id'] for a in results])
+
+        self.assertEqual(self.client.get('/employees/12345/appointments/').status_code, 404)
+
+
+class RecurrenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+        # Monday 2025-06-09
+        cls.monday = datetime(2025, 6, 9, 9, tzinfo=timezone.utc)
+        cls.standup = Appointment.objects.create(
+            start=cls.monday, end=cls.monday + timedelta(minutes=15), title='Standup',
+            description='Standup', employee=cls.first_emp, recurrence='FREQ=WEEKLY;BYDAY=MO,WE,FR',
+            recurrence_exceptions=['2025-06-11T09:00:00+00:00'])
+        cls.standup.participation.set([cls.second_emp])
+        cls.single = Appointment.objects.create(
+            start=cls.monday + timedelta(days=2, hours=1), end=cls.monday + timedelta(days=2, hours=2),
+            title='Single', description='Single', employee=cls.second_emp)
+
+    def test_rules(self):
+        for rule in ('FREQ=YEARLY', 'FREQ=DAILY;COUNT=0', 'FREQ=DAILY;BYDAY=MO',
+                     'FREQ=WEEKLY;BYDAY=XX', 'FREQ=DAILY;COUNT=2;UNTIL=20250701', 'FREQ=DAILY;BYHOUR=1',
+                     'FREQ=DAILY;UNTIL=2025'):
+            with self.assertRaises(ValueError, msg=rule):
+                parse_rule(rule)
+
+        start = datetime(2025, 1, 31, 10, tzinfo=timezone.utc)
+
+        def starts(rule, exceptions=(), after=None):
+            return [s.date().isoformat() for s, _ in islice(
+                occurrences(start, start + timedelta(hours=1), rule, exceptions, after), 6)]
+
+        # Months without a 31st are skipped
+        self.assertEqual(starts('FREQ=MONTHLY;COUNT=4'),
+                         ['2025-01-31', '2025-03-31', '2025-05-31', '2025-07-31'])
+        # Excluded occurrences still count
+        self.assertEqual(starts('FREQ=DAILY;INTERVAL=2;COUNT=3', ['2025-02-02T10:00:00Z']),
+                         ['2025-01-31', '2025-02-04'])
+        self.assertEqual(starts('RRULE:FREQ=DAILY;UNTIL=20250202'),
+                         ['2025-01-31', '2025-02-01', '2025-02-02'])
+        # Friday the 31st, then Tuesdays and Fridays every other week
+        self.assertEqual(starts('FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,FR'),
+                         ['2025-01-31', '2025-02-11', '2025-02-14', '2025-02-25', '2025-02-28', '2025-03-11'])
+
+        # Skipping ahead lands where going through every occurrence does
+        for rule in ('FREQ=DAILY;INTERVAL=3', 'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TU,FR',
+                     'FREQ=WEEKLY;BYDAY=SA;COUNT=30', 'FREQ=MONTHLY;INTERVAL=5'):
+            after = start + timedelta(days=100)
+            everything = [o for o in islice(occurrences(start, start + timedelta(hours=1), rule), 400)
+                          if o[1] > after][:6]
+            self.assertEqual(list(islice(occurrences(
+                start, start + timedelta(hours=1), rule, after=after), 6)), everything, rule)
+
+        self.assertEqual(last_end(start, start + timedelta(hours=1), 'FREQ=WEEKLY;COUNT=3'),
+                         start + timedelta(weeks=2, hours=1))
+        self.assertIsNone(last_end(start, start + timedelta(hours=1), 'FREQ=WEEKLY'))
+
+    def test_last_end(self):
+        start = datetime(2025, 1, 31, 10, tzinfo=timezone.utc)
+        end = start + timedelta(hours=1)
+        # Only the last occurrences are walked through, landing where going
+        # through every one of them does, also with the last ones excluded
+        for rule in ('FREQ=DAILY;INTERVAL=3;COUNT=500', 'FREQ=DAILY;UNTIL=20270315',
+                     'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TU,FR;COUNT=301', 'FREQ=WEEKLY;BYDAY=SU;COUNT=5',
+                     'FREQ=WEEKLY;BYDAY=TU,FR;UNTIL=20261231T120000Z', 'FREQ=MONTHLY;COUNT=40'):
+            everything = list(occurrences(start, end, rule))
+            excluded = [s.isoformat() for s, _ in everything[-3:]]
+            self.assertEqual(last_end(start, end, rule), everything[-1][1], rule)
+            self.assertEqual(last_end(start, end, rule, excluded), everything[-4][1], rule)
+
+        self.assertEqual(last_end(start, end, 'FREQ=DAILY;COUNT=10000'), end + timedelta(days=9999))
+
+        with self.assertRaisesMessage(ValueError, 'COUNT can be at most 10000'):
+            parse_rule('FREQ=DAILY;COUNT=1000000')
+        data = {'start': '2025-06-02T08:00:00Z', 'end': '2025-06-02T09:00:00Z', 'title': 'Review',
+                'description': 'Review', 'employee': self.first_emp.id, 'participation': [],
+                'recurrence': 'FREQ=DAILY;UNTIL=99991230'}
+        resp = self.client.post('/appointments/', data, format='json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('UNTIL can be at most 100 years', resp.json()['recurrence'][0])
+        resp = self.client.post('/appointments/', {**data, 'recurrence': 'FREQ=DAILY;UNTIL=21250101'},
+                                format='json')
+        self.assertEqual(resp.status_code, 201)
+
+    def test_conflicts(self):
+        def create(start, recurrence=''):
+            return self.client.post('/appointments/?check_conflicts=true', {
+                'start': start.isoformat(), 'end': (start + timedelta(minutes=30)).isoformat(),
+                'title': 'New', 'description': 'New', 'employee': self.third_man.id,
+                'participation': [self.second_emp.id], 'recurrence': recurrence}, format='json')
+
+        # A later occurrence of the standup
+        resp = create(self.monday + timedelta(days=4, minutes=5))
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['conflicts'],
+                         [{'employee': self.second_emp.id, 'appointments': [self.standup.id]}])
+        # Not the one skipped
+        self.assertEqual(create(self.monday + timedelta(days=2, minutes=5)).status_code, 201)
+
+        # Every occurrence of a new series, Tuesdays don't but Fridays do
+        resp = create(self.monday + timedelta(days=8), 'FREQ=WEEKLY;BYDAY=TU,FR')
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['conflicts'][0]['appointments'], [self.standup.id])
+        self.assertEqual(create(self.monday + timedelta(days=8), 'FREQ=WEEKLY;COUNT=10').status_code, 201)
+
+    def test_long_intervals(self):
+        start = datetime(2025, 6, 2, 8, tzinfo=timezone.utc)
+        end = start + timedelta(hours=1)
+        rules = ('FREQ=DAILY;INTERVAL=10000000;COUNT=2', 'FREQ=WEEKLY;INTERVAL=10000000;COUNT=2',
+                 'FREQ=MONTHLY;INTERVAL=1000;COUNT=200', 'FREQ=WEEKLY;INTERVAL=1000000')
+        data = {'start': start.isoformat(), 'end': end.isoformat(), 'title': 'Review',
+                'description': 'Review', 'employee': self.first_emp.id, 'participation': []}
+        for rule in rules:
+            resp = self.client.post('/appointments/', {**data, 'recurrence': rule}, format='json')
+            self.assertEqual(resp.status_code, 400, rule)
+            self.assertIn('recurrence', resp.json(), rule)
+
+            # The occurrences stop at year 9999, also of series written around
+            # the validation
+            times = list(occurrences(start, end, rule))
+            self.assertEqual(times[0], (start, end), rule)
+            self.assertLess(len(times), 200, rule)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(start=start, end=end, title='Endless', description='Endless',
+                                       employee=self.first_emp, recurrence=rules[-1])
+        self.assertTrue(EmployeeOccupancy.objects.filter(employee=self.first_emp, day=date(2025, 6, 2)).exists())
+        resp = self.client.get('/appointments/?from=2025-06-02&to=2025-06-03')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([a['title'] for a in resp.json()['results']], ['Endless'])
+
+    def test_list(self):
+        url = '/appointments/?from=2025-06-09&to=2025-06-15'
+        results = self.client.get(url).json()['results']
+        self.assertEqual([(a['title'], a['start']) for a in results], [
+            ('Standup', '2025-06-09T09:00:00Z'),
+            ('Single', '2025-06-11T10:00:00Z'),
+            ('Standup', '2025-06-13T09:00:00Z'),
+        ])
+        self.assertEqual(results[2]['end'], '2025-06-13T09:15:00Z')
+        self.assertEqual(results[2]['id'], self.standup.id)
+        self.assertEqual(results[2]['participation'], [self.second_emp.id])
+
+        # The model serializer renders the same occurrences
+        self.assertEqual(self.client.get(url + '&expand=employee').json()['results'][2]['start'],
+                         '2025-06-13T09:00:00Z')
+        self.assertEqual(self.client.get(url + '&fields=id,start').json()['results'],
+                         [{'id': a['id'], 'start': a['start']} for a in results])
+
+        # Paging forward and back over a longer window
+        url = '/appointments/?from=2025-06-01&to=2025-07-31'
+        everything = [(a['id'], a['start']) for a in
+                      self.client.get(url + '&page_size=1000').json()['results']]
+        self.assertEqual(len(everything), 1 + 23 - 1)
+        pages, page = [], self.client.get(url + '&page_size=5').json()
+        while True:
+            pages.append([(a['id'], a['start']) for a in page['results']])
+            if not page['next']:
+                break
+            page = self.client.get(page['next']).json()
+        self.assertEqual(sum(pages, []), everything)
+        back = self.client.get(page['previous']).json()
+        self.assertEqual([(a['id'], a['start']) for a in back['results']], pages[-2])
+
+        # Without a full window the series is listed as stored
+        results = self.client.get('/appointments/?from=2025-06-20').json()['results']
+        self.assertEqual([a['start'] for a in results if a['title'] == 'Standup'], ['2025-06-09T09:00:00Z'])
+
+    def test_endpoints(self):
+        timeline = self.client.get(
+            f'/employees/{self.second_emp.id}/appointments/?from=2025-06-09&to=2025-06-11').json()
+        self.assertEqual([a['start'] for a in timeline['results']],
+                         ['2025-06-09T09:00:00Z', '2025-06-11T10:00:00Z'])
+
+        lines = self.client.get('/appointments/export/?from=2025-06-09&to=2025-06-15').getvalue()
+        self.assertEqual([json.loads(line)['start'] for line in lines.decode().splitlines()],
+                         ['2025-06-09T09:00:00Z', '2025-06-11T10:00:00Z', '2025-06-13T09:00:00Z'])
+
+        layout = self.client.get('/appointments/layout/?date=2025-06-13').json()
+        self.assertEqual([a['title'] for group in layout for a in group['appointments']], ['Standup'])
+
+        availability = self.client.get(
+            f'/availability/?employees={self.second_emp.id}&from=2025-06-09&to=2025-06-12').json()
+        self.assertEqual([i['start'] for i in availability['busy'][0]['intervals']],
+                         ['2025-06-09T09:00:00Z', '2025-06-11T10:00:00Z'])
+
+        async_list = self.client.get('/async/appointments/?from=2025-06-09&to=2025-06-15').json()
+        self.assertEqual([a['start'] for a in async_list['results']],
+                         ['2025-06-09T09:00:00Z', '2025-06-11T10:00:00Z', '2025-06-13T09:00:00Z'])
+
+    def test_write(self):
+        data = {'start': '2025-06-02T08:00:00Z', 'end': '2025-06-02T09:00:00Z', 'title': 'Review',
+                'description': 'Review', 'employee': self.first_emp.id, 'participation': [],
+                'recurrence': 'freq=daily;count=3', 'recurrence_exceptions': ['2025-06-03T10:00:00+02:00']}
+        resp = self.client.post('/appointments/', data, format='json')
+        self.assertEqual(resp.status_code, 201)
+        created = resp.json()
+        self.assertEqual(created['recurrence'], 'FREQ=DAILY;COUNT=3')
+        self.assertEqual(created['recurrence_exceptions'], ['2025-06-03T08:00:00+00:00'])
+        self.assertEqual(created['recurrence_until'], '2025-06-04T09:00:00Z')
+
+        results = self.client.get('/appointments/?from=2025-06-02&to=2025-06-06').json()['results']
+        self.assertEqual([a['start'] for a in results if a['id'] == created['id']],
+                         ['2025-06-02T08:00:00Z', '2025-06-04T08:00:00Z'])
+
+        resp = self.client.patch(f'/appointments/{created["id"]}/', {'recurrence': 'FREQ=HOURLY'}, format='json')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('recurrence', resp.json())
+
+        resp = self.client.patch('/appointments/bulk/', [{'id': created['id'], 'recurrence': 'FREQ=WEEKLY'}],
+                                 format='json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(Appointment.objects.get(pk=created['id']).recurrence_until)
+
+    def test_memoized(self):
+        expansions.clear()
+        args = (self.monday, self.monday + timedelta(minutes=15), 'FREQ=DAILY', (),
+                self.monday, self.monday + timedelta(days=30))
+        memo = expansions.get(*args)
+        self.assertEqual(len(list(islice(memo, 3))), 3)
+        # Only generated as far as it was read
+        self.assertEqual(len(memo.items), 3)
+        self.assertIs(expansions.get(*args), memo)
+        self.assertEqual(len(list(memo)), 30)
+        self.assertEqual(len(list(memo)), 30)
+
+
+class OccupancyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+        cls.day = datetime(2025, 6, 9, tzinfo=timezone.utc)
+
+    def at(self, hours, days=0):
+        return self.day + timedelta(days=days, hours=hours)
+
+    def snapshot(self):
+        def rows(model, key):
+            return sorted(model.objects.values_list(
+                key, 'day', 'booked_minutes', 'appointments', 'first_start', 'last_end'))
+        return rows(EmployeeOccupancy, 'employee'), rows(DepartmentOccupancy, 'department')
+
+    def test_signals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            meeting = Appointment.objects.create(
+                start=self.at(9), end=self.at(10), title='Meeting', description='Meeting',
+                employee=self.first_emp)
+            meeting.participation.set([self.second_emp, self.third_man])
+            workshop = Appointment.objects.create(
+                start=self.at(9.5), end=self.at(11), title='Workshop', description='Workshop',
+                employee=self.first_emp)
+
+        first = EmployeeOccupancy.objects.get(employee=self.first_emp)
+        self.assertEqual((first.day, first.booked_minutes, first.appointments), (date(2025, 6, 9), 120, 2))
+        self.assertEqual((first.first_start, first.last_end), (self.at(9), self.at(11)))
+        department = DepartmentOccupancy.objects.get(department=self.first_dep)
+        self.assertEqual((department.booked_minutes, department.appointments), (180, 2))
+        self.assertEqual(DepartmentOccupancy.objects.get(department=self.second_dep).booked_minutes, 60)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            workshop.start, workshop.end = self.at(23, days=1), self.at(25, days=1)
+            workshop.save()
+            meeting.participation.remove(self.third_man)
+        self.assertEqual(
+            sorted(EmployeeOccupancy.objects.filter(employee=self.first_emp).values_list('day', 'booked_minutes')),
+            [(date(2025, 6, 9), 60), (date(2025, 6, 10), 60), (date(2025, 6, 11), 60)])
+        self.assertFalse(EmployeeOccupancy.objects.filter(employee=self.third_man).exists())
+
+        # Moving departments moves the totals
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second_emp.department = self.first_dep
+            self.second_emp.save()
+        self.assertFalse(DepartmentOccupancy.objects.filter(department=self.second_dep).exists())
+        self.assertEqual(DepartmentOccupancy.objects.get(
+            department=self.first_dep, day=date(2025, 6, 9)).booked_minutes, 120)
+
+        # The same as recomputing everything
+        incremental = self.snapshot()
+        call_command('rebuild_occupancy', stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            meeting.delete()
+            workshop.delete()
+        self.assertEqual(self.snapshot(), ([], []))
+
+    def test_bulk_and_rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post('/appointments/bulk/', [{
+                'start': self.at(8).isoformat(), 'end': self.at(9).isoformat(), 'title': 'Daily',
+                'description': 'Daily', 'employee': self.second_emp.id, 'participation': [],
+                'recurrence': 'FREQ=DAILY;COUNT=3'}], format='json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(
+            list(DepartmentOccupancy.objects.filter(department=self.second_dep)
+                 .order_by('day').values_list('day', flat=True)),
+            [date(2025, 6, 9), date(2025, 6, 10), date(2025, 6, 11)])
+
+        # Written around the signals
+        Appointment.objects.bulk_create([Appointment(
+            start=self.at(12, days=40), end=self.at(13, days=40), title='Raw', description='Raw',
+            employee=self.third_man)])
+        self.assertFalse(EmployeeOccupancy.objects.filter(employee=self.third_man).exists())
+        out = StringIO()
+        call_command('rebuild_occupancy', '--from', '2025-07-01', '--to', '2025-07-31', stdout=out)
+        self.assertIn('Wrote 2 occupancy rows', out.getvalue())
+        self.assertEqual(EmployeeOccupancy.objects.get(employee=self.third_man).day, date(2025, 7, 19))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_occupancy', '--from', 'June')
+
+    def test_endpoint(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for days in (0, 1, 40):
+                Appointment.objects.create(
+                    start=self.at(9, days), end=self.at(10, days), title='Meeting',
+                    description='Meeting', employee=self.first_emp)
+
+        with self.assertNumQueries(1):
+            resp = self.client.get(f'/stats/occupancy/?from=2025-06-01&to=2025-06-30&department={self.first_dep.id}')
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual((data['from'], data['to']), ('2025-06-01', '2025-06-30'))
+        self.assertEqual(data['days'], [
+            {'department': self.first_dep.id, 'day': '2025-06-09', 'booked_minutes': 60, 'appointments': 1,
+             'first_start': '2025-06-09T09:00:00Z', 'last_end': '2025-06-09T10:00:00Z'},
+            {'department': self.first_dep.id, 'day': '2025-06-10', 'booked_minutes': 60, 'appointments': 1,
+             'first_start': '2025-06-10T09:00:00Z', 'last_end': '2025-06-10T10:00:00Z'},
+        ])
+
+        days = self.client.get(f'/stats/occupancy/?from=2025-06-01&to=2025-12-31&employee={self.first_emp.id}').json()
+        self.assertEqual([d['day'] for d in days['days']], ['2025-06-09', '2025-06-10', '2025-07-19'])
+        self.assertEqual(len(self.client.get('/stats/occupancy/?from=2025-06-01&to=2025-06-30').json()['days']), 2)
+
+        self.assertEqual(self.client.get('/stats/occupancy/?from=2025-06-01').status_code, 400)
+        self.assertEqual(self.client.get('/stats/occupancy/?from=2025-01-01&to=2026-12-31').status_code, 400)
+
+    def test_bulk_department_move(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(start=self.at(9), end=self.at(10), title='Meeting',
+                                       description='Meeting', employee=self.second_emp)
+        self.assertEqual(DepartmentOccupancy.objects.get(department=self.second_dep).booked_minutes, 60)
+
+        # `bulk_update` sends no signals
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.patch('/employees/bulk/', [
+                {'id': self.second_emp.id, 'department': self.first_dep.id},
+                {'id': self.first_emp.id, 'name': 'Renamed'}], format='json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(DepartmentOccupancy.objects.filter(department=self.second_dep).exists())
+        self.assertEqual(DepartmentOccupancy.objects.get(department=self.first_dep).booked_minutes, 60)
+
+    def test_concurrent_refresh(self):
+        replace = occupancy.replace
+
+        def racing(cells, key, rows):
+            # Another refresh wrote the same cells in the meantime
+            cells.model.objects.bulk_create([cells.model(**{
+                f'{key}_id': getattr(row, f'{key}_id'), 'day': row.day, 'booked_minutes': 1,
+                'appointments': 1, 'first_start': row.first_start, 'last_end': row.last_end})
+                for row in rows])
+            replace(cells, key, rows)
+
+        with mock.patch('api.occupancy.replace', racing), self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(start=self.at(9), end=self.at(10), title='Meeting',
+                                       description='Meeting', employee=self.first_emp)
+        self.assertEqual(EmployeeOccupancy.objects.get(employee=self.first_emp).booked_minutes, 60)
+        self.assertEqual(DepartmentOccupancy.objects.get(department=self.first_dep).booked_minutes, 60)
+
+    def test_horizon(self):
+        url = f'/stats/occupancy/?from=2026-07-01&to=2026-07-31&employee={self.first_emp.id}'
+        now = datetime(2025, 6, 1, tzinfo=timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            with self.captureOnCommitCallbacks(execute=True):
+                Appointment.objects.create(start=self.at(9), end=self.at(10), title='Weekly',
+                                           description='Weekly', employee=self.first_emp,
+                                           recurrence='FREQ=WEEKLY')
+            # Not counted that far ahead
+            self.assertEqual(self.client.get(url).status_code, 400)
+
+        with mock.patch('django.utils.timezone.now', return_value=now + timedelta(days=60)):
+            self.assertEqual(self.client.get(url).json()['days'], [])
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('rebuild_occupancy', '--horizon', stdout=StringIO())
+            self.assertEqual(len(self.client.get(url).json()['days']), 4)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_occupancy', '--horizon', '--from', '2025-06-01')
+
+    def test_etag(self):
+        url = f'/stats/occupancy/?from=2025-06-01&to=2025-06-30&employee={self.first_emp.id}'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+
+        # Validated on when the cells were refreshed, not when the appointment was written
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(start=self.at(9), end=self.at(10), title='Meeting',
+                                       description='Meeting', employee=self.first_emp)
+        resp = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['days']), 1)
+
+        # And when rebuilt
+        etag = resp['ETag']
+        Appointment.objects.bulk_create([Appointment(
+            start=self.at(9, days=1), end=self.at(10, days=1), title='Raw', description='Raw',
+            employee=self.first_emp)])
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_occupancy', stdout=StringIO())
+        resp = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['days']), 2)
+        self.assertEqual(self.client.get('/stats/occupancy/?from=2025-06-01&to=2025-06-30&employee=x').status_code, 400)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    def search(self, params):
+        resp = self.client.get('/employees/search/', params)
+        self.assertEqual(resp.status_code, 200)
+        return [e['name'] for e in resp.json()['results']]
+
+    def test_search(self):
+        # A prefix of the whole name ranks above one of a word
+        self.assertEqual(self.search({'q': 'emp'}), ['First Employee', 'Second Employee'])
+        self.assertEqual(self.search({'q': 'FIRST e'}), ['First Employee'])
+        self.assertEqual(self.search({'q': 'third@'}), ['Third Manager'])
+        self.assertEqual(self.search({'q': 'manger'}), ['Third Manager'])
+        self.assertEqual(self.search({'q': 'emp', 'department': self.second_dep.id}),
+                         ['Second Employee'])
+        self.assertEqual(self.search({'q': 'emp', 'limit': 1}), ['First Employee'])
+        self.assertEqual(self.search({'q': 'nobody'}), [])
+
+        for params in ({}, {'q': ' '}, {'q': 'emp', 'limit': 0}, {'q': 'emp', 'department': 'x'}):
+            self.assertEqual(self.client.get('/employees/search/', params).status_code, 400)
+
+    def test_refresh(self):
+        self.search({'q': 'emp'})
+        self.client.patch(f'/employees/{self.first_emp.id}/', {'name': 'Emily Stone'})
+        Employee.objects.create(name='Empty Desk', email='desk@inc.com')
+        self.assertEqual(self.search({'q': 'emp'}), ['Empty Desk', 'Second Employee'])
+        self.assertEqual(self.search({'q': 'ston'}), ['Emily Stone'])
+
+    def test_sync(self):
+        index = EmployeeIndex.build('default')
+        self.second_emp.name = 'Sam Second'
+        self.second_emp.save()
+        self.third_man.delete()
+        Employee.objects.create(name='Manny Third', email='manny.third@inc.com')
+        index.sync('default')
+
+        # Only the changed employees were touched, and it's the same as a new one
+        fresh = EmployeeIndex.build('default')
+        for name in ('whole', 'words', 'word_pks', 'postings', 'rows'):
+            self.assertEqual(getattr(index, name), getattr(fresh, name), name)
+        for q in ('s', 'sec', 'third', 'man', 'manger', 'emp'):
+            self.assertEqual(index.search(q), fresh.search(q), q)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Trigram search needs PostgreSQL')
+    def test_postgresql(self):
+        # Same tiers as the in-process index: whole prefixes, word prefixes
+        # (single letters too), near misses
+        Employee.objects.create(name='Zed Evans', email='z.evans@inc.com')
+        index = EmployeeIndex.build('default')
+        for q in ('e', 'ev', 'z', 'm', 'man', 'emp', 'first e', 'third@', 'manger', 'inc'):
+            self.assertEqual([e.pk for e in search_postgresql(Employee.objects.all(), q, 20)],
+                             index.search(q), q)
+
+
+class AsyncReadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+        add_rows(cls)
+
+    async def assertSameAsSync(self, url):
+        resp = await self.async_client.get(f'/async{url}')
+        self.assertEqual(resp.status_code, 200)
+        expected = await sync_to_async(self.client.get)(url)
+        self.assertEqual(resp.json(), expected.json())
+
+    async def test_appointments(self):
+        await self.assertSameAsSync(f'/appointments/{self.first_app.id}/')
+
+        # Links point back at the async path, the pages are the sync ones
+        url = '/async/appointments/?page_size=3&from=2000-01-01'
+        sync_url = '/appointments/?page_size=3&from=2000-01-01'
+        while url:
+            page = (await self.async_client.get(url)).json()
+            expected = (await sync_to_async(self.client.get)(sync_url)).json()
+            self.assertEqual(page['results'], expected['results'])
+            url, sync_url = page['next'], expected['next']
+        self.assertIsNone(sync_url)
+
+        resp = await self.async_client.get('/async/appointments/12345/')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json()['status_code'], 404)
+        resp = await self.async_client.get('/async/appointments/?from=someday')
+        self.assertEqual(resp.status_code, 400)
+        resp = await self.async_client.delete(f'/async/appointments/{self.first_app.id}/')
+        self.assertEqual(resp.status_code, 405)
+
+    async def test_department_employees(self):
+        await self.assertSameAsSync(f'/departments/{self.first_dep.id}/employees/')
+
+    async def test_conditional(self):
+        url = f'/async/appointments/{self.first_app.id}/'
+        resp = await self.async_client.get(url)
+        self.assertIn('Last-Modified', resp)
+        cached = await self.async_client.get(url, headers={'if-none-match': resp['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], resp['ETag'])
+
+        await sync_to_async(self.client.patch)(
+            f'/appointments/{self.first_app.id}/', {'title': 'Changed'}, format='json')
+        changed = await self.async_client.get(url, headers={'if-none-match': resp['ETag']})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['title'], 'Changed')
+
+
+class ConditionalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    def test_list(self):
+        resp = self.client.get('/departments/')
+        etag = resp['ETag']
+        self.assertEqual(resp.status_code, 200)
+
+        with self.assertNumQueries(0):
+            resp2 = self.client.get('/departments/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp2.status_code, 304)
+        self.assertEqual(resp2['ETag'], etag)
+
+        # Other parameters are other representations
+        resp3 = self.client.get('/departments/?page_size=1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp3.status_code, 200)
+
+        self.client.post('/departments/', {'name': 'New', 'description': 'New'})
+        resp4 = self.client.get('/departments/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp4.status_code, 200)
+        self.assertNotEqual(resp4['ETag'], etag)
+
+        pass
+
+    def test_department_employees(self):
+        url = f'/departments/{self.first_dep.id}/employees/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.patch(f'/employees/{self.second_emp.id}/',
+                          {'department': self.first_dep.id}, format='json')
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()['results']), 3)
+
+        pass
+
+    def test_expanded(self):
+        # The embedded managers are employees, a rename has to show through
+        # the ETag and the reference cache
+        url = '/departments/?expand=manager'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.patch(f'/employees/{self.third_man.id}/', {'name': 'Renamed'}, format='json')
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        managers = {d['manager']['name'] for d in resp.json()['results'] if d['manager']}
+        self.assertEqual(managers, {'Renamed'})
+
+        pass
+
+    def test_retrieve_modified_since(self):
+        url = f'/positions/{self.employee_position.id}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(resp.status_code, 304)
+
+        pass
+
+
+class ReferenceCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    def setUp(self):
+        reference_cache.clear()
+
+    def test_positions(self):
+        first = self.client.get('/positions/').json()
+        with self.assertNumQueries(0):
+            second = self.client.get('/positions/').json()
+        self.assertEqual(first, second)
+        self.assertEqual(reference_cache.stats()['hits'], 1)
+
+        self.client.post('/positions/', {'name': 'intern'})
+        names = [p['name'] for p in self.client.get('/positions/').json()['results']]
+        self.assertIn('intern', names)
+
+        stats = self.client.get('/reference-cache/').json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+        pass
+
+    def test_department_employees(self):
+        url = f'/departments/{self.first_dep.id}/employees/'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(url).json()['results']), 2)
+
+        # Membership changes go through the employee table
+        self.second_emp.department = self.first_dep
+        self.second_emp.save()
+        self.assertEqual(len(self.client.get(url).json()['results']), 3)
+
+        pass
+
+    def test_lru(self):
+        backend = LocalBackend(max_entries=2)
+        backend.set('a', {'department'}, 1)
+        backend.set('b', {'position'}, 2)
+        backend.get('a')
+        backend.set('c', {'position'}, 3)
+        self.assertIs(backend.get('b'), MISSING)
+        self.assertEqual((backend.get('a'), backend.evictions), (1, 1))
+
+        backend.discard('position')
+        self.assertEqual(list(backend.entries), ['a'])
+
+        pass
+
+
+class AvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+        def today_at(hour, minute=0):
+            return datetime.combine(date.today(), time(hour, minute))
+
+        participating = Appointment.objects.create(**cls.appointments_data[1])
+        participating.participation.set([cls.first_emp, cls.third_man])
+        Appointment.objects.create(
+            **cls.appointments_data[0], employee=cls.second_emp)
+        Appointment.objects.create(
+            start=today_at(9, 30), end=today_at(11), title='Organized',
+            description='Organized', employee=cls.second_emp)
+
+    def test_employees(self):
+        today = date.today().isoformat()
+        with self.assertNumQueries(1) as queries:
+            resp = self.client.get(
+                f'/availability/?employees={self.first_emp.id},{self.second_emp.id}'
+                f'&from={today}T08:00:00Z&to={today}T12:00:00Z&duration=30')
+        self.assertEqual(resp.status_code, 200)
+        # Organizers and participants each on their own index, not an OR over a join
+        self.assertIn('UNION ALL', queries[0]['sql'])
+        self.assertNotIn('LEFT OUTER JOIN', queries[0]['sql'])
+        data = resp.json()
+
+        def times(intervals):
+            return [(i['start'][11:16], i['end'][11:16]) for i in intervals]
+
+        busy = {b['employee']: times(b['intervals']) for b in data['busy']}
+        self.assertEqual(busy[self.first_emp.id], [('09:00', '10:00')])
+        self.assertEqual(busy[self.second_emp.id], [('08:00', '08:30'), ('09:30', '11:00')])
+        self.assertEqual(times(data['free']), [('08:30', '09:00'), ('11:00', '12:00')])
+
+        resp2 = self.client.get(
+            f'/availability/?employees={self.first_emp.id},{self.second_emp.id}'
+            f'&from={today}T08:00:00Z&to={today}T12:00:00Z&duration=45')
+        self.assertEqual(times(resp2.json()['free']), [('11:00', '12:00')])
+
+    def test_department(self):
+        today = date.today().isoformat()
+        resp = self.client.get(
+            f'/availability/?department={self.first_dep.id}&from={today}&to={today}')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([b['employee'] for b in resp.json()['busy']],
+                         [self.first_emp.id, self.third_man.id])
+        self.assertEqual(len(resp.json()['free']), 2)
+
+        self.assertEqual(self.client.get(
+            f'/availability/?from={today}&to={today}').status_code, 400)
+        self.assertEqual(self.client.get(
+            f'/availability/?department={self.first_dep.id}').status_code, 400)
+
+
+class ImportAppointmentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        setup_db(cls)
+
+    def run_import(self, content, suffix):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix) as f:
+            f.write(content)
+            f.flush()
+            out = StringIO()
+            call_command('import_appointments', f.name, batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_ndjson(self):
+        lines = [json.dumps({
+            'start': f'2025-06-0{i + 1}T09:00:00Z',
+            'end': f'2025-06-0{i + 1}T10:00:00Z',
+            'title': f'Imported {i}',
+            'description': '',
+            'employee': 'third@inc.com',
+            'participation': ['first@inc.com', self.second_emp.id],
+        }) for i in range(5)]
+        out = self.run_import('\n'.join(lines), '.ndjson')
+
+        self.assertIn('Imported 5 appointments with 10 participants', out)
+        imported = Appointment.objects.filter(title__startswith='Imported')
+        self.assertEqual(imported.count(), 5)
+        self.assertEqual(imported.filter(employee=self.third_man).count(), 5)
+        self.assertCountEqual(imported.first().participation.all(),
+                              [self.first_emp, self.second_emp])
+
+    def test_csv(self):
+        content = ('start,end,title,description,employee,participation\n'
+                   '2025-06-01T09:00:00,2025-06-01T10:00:00,Imported,,,first@inc.com\n')
+        out = self.run_import(content, '.csv')
+        self.assertIn('Imported 1 appointments', out)
+
+        broken = content + '2025-06-01T09:00:00,never,Broken,,,\n'
+        with self.assertRaises(CommandError):
+            self.run_import(broken, '.csv')
+        # Nothing of a failed import is kept
+        self.assertEqual(Appointment.objects.filter(title='Imported').count(), 1)
+
+    def test_invalid_records(self):
+        def record(**values):
+            return json.dumps({'start': '2025-06-01T09:00:00Z', 'end': '2025-06-01T10:00:00Z',
+                               'title': 'Checked', **values})
+
+        for broken, message in [
+                (record(end='2025-06-01T09:00:00Z'), 'later than the start'),
+                (record(title='x' * 51), '`title` is longer than 50'),
+                (record(description='x' * 201), '`description` is longer than 200')]:
+            with self.assertRaisesMessage(CommandError, 'line 3') as raised:
+                self.run_import('\n'.join([record(), record(), broken]), '.ndjson')
+            self.assertIn(message, str(raised.exception))
+        self.assertFalse(Appointment.objects.filter(title='Checked').exists())
+
+
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_class = APIClient
+        setup_db(cls)
+
+    def setUp(self):
+        metrics.clear()
+
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+
+    def test_metrics(self):
+        with tempfile.TemporaryDirectory() as profiles:
+            with override_settings(API_INSTRUMENTATION={
+                    'ENABLED': True, 'PROFILE_SAMPLE_RATE': 1, 'PROFILE_THRESHOLD': 0,
+                    'PROFILE_DIR': profiles}):
+                self.assertEqual(self.client.get('/employees/').status_code, 200)
+                self.client.get('/employees/')
+                # The model serializer instead of the rows one
+                self.client.get(f'/employees/{self.first_emp.id}/')
+                resp = self.client.get('/metrics/')
+            # The /metrics/ request too
+            self.assertEqual(len(os.listdir(profiles)), 4)
+
+        self.assertEqual(resp.status_code, 200)
+        text = resp.content.decode()
+        labels = 'view="employee-list",method="GET"'
+        self.assertIn(f'api_request_duration_seconds_count{{{labels}}} 2', text)
+        self.assertIn(f'api_queries{{{labels},quantile="0.5"}} 1', text)
+        self.assertRegex(text, rf'api_render_duration_seconds_sum{{{labels}}} 0\.0*[1-9]')
+        self.assertRegex(text, rf'api_serialize_duration_seconds_sum{{{labels}}} 0\.0*[1-9]')
+        self.assertRegex(text, r'api_serialize_duration_seconds_sum{view="employee-detail",method="GET"} 0\.0*[1-9]')
+        self.assertRegex(text, rf'api_response_size_bytes{{{labels},quantile="0.99"}} [1-9]')
+        self.assertIn(f'api_profiles_total{{{labels}}} 2', text)
+
+    @override_settings(API_INSTRUMENTATION={'ENABLED': True, 'DUPLICATE_QUERIES': 3})
+    def test_duplicate_queries(self):
+        def view(request):
+            for employee in Employee.objects.all():
+                Department.objects.filter(pk=employee.department_id).first()
+            return HttpResponse()
+
+        middleware = InstrumentationMiddleware(view)
+        with self.assertLogs('api.instrumentation', 'WARNING') as logs:
+            middleware(RequestFactory().get('/n-plus-one/'))
+        self.assertIn('ran the same query 3 times', logs.output[0])
+        self.assertEqual(metrics.duplicates[('unmatched', 'GET')], 1)
+
+        # One query for all of them is fine
+        def fine(request):
+            list(Employee.objects.select_related('department'))
+            return HttpResponse()
+
+        InstrumentationMiddleware(fine)(RequestFactory().get('/fine/'))
+        self.assertEqual(metrics.duplicates[('unmatched', 'GET')], 1)
+
+    @override_settings(API_INSTRUMENTATION={'ENABLED': True})
+    async def test_async(self):
+        # Under ASGI the sync views run in another thread, with its own connections
+        resp = await self.async_client.get('/employees/')
+        self.assertEqual(resp.status_code, 200)
+        text = metrics.render((0.5,))
+        self.assertIn('api_queries{view="employee-list",method="GET",quantile="0.5"} 1', text)
+
+
+class BenchmarkTests(TestCase):
+    def test_generate(self):
+        counts = data.generate(departments=2, employees=20, days=3, appointments_per_day=10, seed=1)
+        self.assertEqual(counts['appointments'], 30)
+        self.assertEqual(Employee.objects.count(), 20)
+        self.assertEqual(Appointment.participation.through.objects.count(), counts['participants'])
+        first = list(Appointment.objects.order_by('pk').values_list('title', 'start', 'employee__name'))
+
+        data.clear()
+        self.assertFalse(Appointment.objects.exists() or Employee.objects.exists())
+        data.generate(departments=2, employees=20, days=3, appointments_per_day=10, seed=1)
+        self.assertEqual(
+            list(Appointment.objects.order_by('pk').values_list('title', 'start', 'employee__name')), first)
+
+    def test_benchmark(self):
+        data.generate(departments=2, employees=20, days=2, appointments_per_day=10)
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark', '--requests=2', '--warmup=0', '--writes',
+                         f'--output={output.name}', stdout=StringIO())
+            results = json.load(output)
+
+        self.assertEqual(results['meta']['data']['appointments'], 20)
+        endpoints = results['endpoints']
+        self.assertIn('employee-search', endpoints)
+        self.assertIn('appointment-destroy', endpoints)
+        for name, result in endpoints.items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertIsNotNone(result['queries']['max'], name)
+        # Created and deleted again
+        self.assertEqual(Appointment.objects.count(), 20)
+
+    def test_compare(self):
+        def results(p95, throughput, queries, errors=0):
+            return {'endpoints': {'employee-list': {
+                'latency_ms': {'p95': p95}, 'throughput': throughput,
+                'queries': {'max': queries}, 'errors': errors}}}
+
+        before = results(10, 100, 1)
+        self.assertEqual(runner.compare(before, results(11, 90, 1)), [])
+        # Small absolute differences are noise
+        self.assertEqual(runner.compare(results(0.2, 100, 1), results(0.5, 100, 1)), [])
+        self.assertEqual(len(runner.compare(before, results(20, 50, 2, errors=1))), 4)
+
+    def test_http_target(self):
+        target = runner.HTTPTarget('https://api.example.com/v1/')
+        self.assertEqual((target.host, target.port, target.prefix), ('api.example.com', 443, '/v1'))
+        self.assertIs(target.connection_class, runner.http.client.HTTPSConnection)
+        self.assertEqual(runner.HTTPTarget('http://localhost:8000').port, 8000)
+
+        # The queries come from what the server's /metrics/ renders
+        self.addCleanup(metrics.clear)
+        metrics.clear()
+        endpoint = runner.Endpoint('employee-list', '/employees/?page_size=5')
+        scrape = lambda self, endpoint: (200, metrics.render((0.5,)).encode(), None)
+        with mock.patch.object(runner.HTTPTarget, 'request', scrape):
+            metrics.record(('employee-list', 'GET'), {'queries': 3}, 10)
+            before = target.snapshot()
+            self.assertEqual(before[('count', 'view="employee-list",method="GET"')], 1)
+            metrics.record(('employee-list', 'GET'), {'queries': 2}, 10)
+            metrics.record(('employee-list', 'GET'), {'queries': 4}, 10)
+            self.assertEqual(target.mean_queries(endpoint, before), 3)
+
+
+class HealthTests(TestCase):
+    def test_health(self):
+        resp = self.client.get('/health/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['status'], 'ok')
+        self.assertIsNone(resp.json()['databases']['default']['pool'])
+
+    def test_pool_stats(self):
+        pool = mock.Mock(min_size=2, max_size=10)
+        pool.get_stats.return_value = {'pool_size': 4, 'pool_available': 1,
+                                       'requests_waiting': 0}
+        stats = pool_stats(pool)
+        self.assertEqual(stats['in_use'], 3)
+        self.assertEqual(stats['utilization'], 0.3)
+
+
+class ReplicaTests(SimpleTestCase):
+    @override_settings(API_REPLICAS={'ALIASES': ['replica1', 'replica2']})
+    def test_round_robin(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Appointment), 'default')
+
+        token = replica_reads.set(True)
+        try:
+            self.assertEqual([router.db_for_read(Appointment) for _ in range(3)],
+                             ['replica1', 'replica2', 'replica1'])
+        finally:
+            replica_reads.reset(token)
+        self.assertEqual(router.db_for_write(Appointment), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'api'))
+
+    @override_settings(API_REPLICAS={'ALIASES': ['replica1', 'replica2'],
+                                     'SELECTION': 'least_lag', 'MAX_LAG': 10})
+    def test_least_lag(self):
+        router = ReplicaRouter()
+        token = replica_reads.set(True)
+        try:
+            with mock.patch('api.replicas.replica_lag', {'replica1': 3.0, 'replica2': 1.0}.get):
+                self.assertEqual(router.db_for_read(Appointment), 'replica2')
+
+            router.lags_checked = None
+            with mock.patch('api.replicas.replica_lag', {'replica1': 30.0, 'replica2': None}.get):
+                self.assertEqual(router.db_for_read(Appointment), 'default')
+        finally:
+            replica_reads.reset(token)
+
+    def test_middleware(self):
+        seen = []
+        middleware = ReplicaMiddleware(lambda request: seen.append(replica_reads.get()) or HttpResponse())
+        factory = RequestFactory()
+
+        middleware(factory.get('/appointments/'))
+        response = middleware(factory.post('/appointments/'))
+        cookie = response.cookies['api_primary_until'].value
+        request = factory.get('/appointments/')
+        request.COOKIES['api_primary_until'] = cookie
+        middleware(request)
+
+        self.assertEqual(seen, [True, False, False])
+        self.assertFalse(replica_reads.get())
+
+    @override_settings(API_REPLICAS={'ALIASES': ['replica1', 'replica2']})
+    def test_primary_reads(self):
+        router = ReplicaRouter()
+        token = replica_reads.set(True)
+        try:
+            with primary_reads():
+                self.assertEqual(router.db_for_read(Appointment), 'default')
+            self.assertEqual(router.db_for_read(Appointment), 'replica1')
+
+            # Related rows come from where the instance was read
+            instance = Appointment()
+            instance._state.db = 'replica2'
+            self.assertEqual(router.db_for_read(Employee, instance=instance), 'replica2')
+        finally:
+            replica_reads.reset(token)
+
+    @override_settings(API_REPLICAS={'ALIASES': ['replica1', 'replica2'], 'STICKY_SECONDS': 5})
+    def test_reads_after(self):
+        router = ReplicaRouter()
+        now = datetime.now(timezone.utc).timestamp()
+        token = replica_reads.set(True)
+        try:
+            # Round robin takes the replicas to be at most STICKY_SECONDS behind
+            with reads_after({'appointment': int((now - 1) * 10 ** 9), 'employee': 0}):
+                self.assertEqual(router.db_for_read(Appointment), 'default')
+            with reads_after({'appointment': int((now - 60) * 10 ** 9)}):
+                self.assertEqual(router.db_for_read(Appointment), 'replica1')
+
+            # Responses given an ETag, and what's cached, only read from
+            # replicas having the writes of the versions
+            seen = []
+            view = ConditionalMixin()
+            request = mock.Mock(accepted_renderer=mock.Mock(format='json'), META={},
+                                method='GET', get_full_path=lambda: '/appointments/')
+            bump_version('appointment')
+            bump_version('position')
+            view.conditional(lambda request: seen.append(router.db_for_read(Appointment)) or HttpResponse(),
+                             ('appointment',), request)
+            reference_cache.get_or_compute(('position',), ('replica-test',),
+                                           lambda: seen.append(router.db_for_read(Position)) or MISSING)
+            self.assertEqual(seen, ['default', 'default'])
+        finally:
+            replica_reads.reset(token)
+
+    @override_settings(API_REPLICAS={'ALIASES': ['replica1', 'replica2'],
+                                     'SELECTION': 'least_lag', 'MAX_LAG': 10})
+    def test_reads_after_lag(self):
+        router = ReplicaRouter()
+        written = datetime.now(timezone.utc).timestamp() - 2
+        token = replica_reads.set(True)
+        try:
+            # replica2 is closer but hasn't replayed the write yet, replica1 has
+            with mock.patch('api.replicas.replica_lag', {'replica1': 1.0, 'replica2': 0.5}.get):
+                self.assertEqual(router.db_for_read(Appointment), 'replica2')
+            router.lags_checked = None
+            with mock.patch('api.replicas.replica_lag', {'replica1': 1.0, 'replica2': 5.0}.get), \
+                    reads_after({'appointment': int(written * 10 ** 9)}):
+                self.assertEqual(router.db_for_read(Appointment), 'replica1')
+                router.lags_checked = None
+                with mock.patch('api.replicas.replica_lag', {'replica1': 3.0, 'replica2': 5.0}.get):
+                    self.assertEqual(router.db_for_read(Appointment), 'default')
+        finally:
+            replica_reads.reset(token)
+
+
 class DepartmentTests(TestCase):
     def create(self):
         pass
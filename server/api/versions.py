@@ -0,0 +1,36 @@
+import time
+
+from django.core.cache import cache
+
+# Cheap per-table version markers. Anything derived from a table (cached
+# layouts, ETags, ...) keys itself on the current version, and the signal
+# handlers in `api.signals` bump it on every write, which invalidates all of it
+# at once without having to track down individual keys.
+#
+# Versions are the time of the last write in nanoseconds, so they double as
+# Last-Modified dates. They live in the default cache, which has to be shared
+# by the workers for them to see each other's writes, `CACHE_URL` in the
+# settings points it at Redis or memcached.
+
+
+def _key(name):
+    return f'api:version:{name}'
+
+
+def get_version(name):
+    # A marker that isn't there (evicted, or never written) starts from now,
+    # which is newer than anything cached under an older value
+    return cache.get_or_set(_key(name), time.time_ns, timeout=None)
+
+
+def get_versions(names):
+    found = cache.get_many([_key(name) for name in names])
+    return {name: found.get(_key(name)) or get_version(name) for name in names}
+
+
+def bump_version(name):
+    # Concurrent bumps may overwrite each other, that's fine, as long as the
+    # result differs from what readers have seen
+    version = max(time.time_ns(), (cache.get(_key(name)) or 0) + 1)
+    cache.set(_key(name), version, timeout=None)
+    return version
@@ -1,15 +1,56 @@
+from datetime import timedelta
+from functools import partial
+
+from django.core.cache import cache
+from django.db.models import Prefetch
 from django.shortcuts import render
-from rest_framework import viewsets
+from django.utils import timezone
+from rest_framework import serializers, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from api.models import Appointment, Department, Employee, Position
-from api.serializers import AppointmentSerializer, EmployeeSerializer, DepartmentSerializer, DepartmentEmployeesSerializer, PositionSerializer
+from api import occupancy
+from api.availability import busy_intervals, gaps
+from api.batch import BatchRetrieveMixin
+from api.bulk import BulkMixin
+from api.changes import changes_since
+from api.conditional import ConditionalMixin
+from api.conflicts import AppointmentConflict, find_conflicts
+from api.events import broadcaster, publish_appointment
+from api.expand import ExpandMixin
+from api.export import ExportMixin
+from api.filters import involving, occurring, parse_day, parse_window
+from api.health import health
+from api.layout import overlap_groups
+from api.models import Appointment, Department, DepartmentOccupancy, Employee, EmployeeOccupancy, Position
+from api.recurrence import merged, occurrence_streams, split_series
+from api.reference_cache import ReferenceCacheMixin, reference_cache
+from api.replicas import primary_reads, reads_after
+from api.rows import RowListMixin, timestamp
+from api.search import search_employees
+from api.serializers import AppointmentRowSerializer, AppointmentSerializer, EmployeeRowSerializer, EmployeeSerializer, DepartmentSerializer, DepartmentEmployeesSerializer, PositionSerializer
+from api.versions import get_version
+
+# Layouts are invalidated by the appointment version marker, the timeout only
+# keeps days nobody looks at anymore from piling up. Any write drops every
+# day's layout: the writes that don't go through one appointment's signals
+# (bulk updates, employees deleted out of their appointments, participants
+# cleared) can't tell which days they touch, and a missed day would show a
+# wrong calendar for the whole timeout. Recomputing one only reads its window.
+LAYOUT_CACHE_TIMEOUT = 60 * 60 * 24
+# The longest a day gets, across a DST change
+LAYOUT_MAX_WINDOW = timedelta(hours=25)
 
 
-class EmployeeViewSet(viewsets.ModelViewSet):
+class EmployeeViewSet(ConditionalMixin, BulkMixin, ExportMixin, ExpandMixin, BatchRetrieveMixin,
+                      RowListMixin, viewsets.ModelViewSet):
     queryset = Employee.objects.all()
     serializer_class = EmployeeSerializer
+    row_serializer_class = EmployeeRowSerializer
+    conditional_tables = ('employee',)
+    bulk_invalidates = ('employee',)
+    search_max_limit = 100
 
     def get_queryset(self):
         '''Allow filtering on `name` and `email` fields'''
@@ -23,23 +64,436 @@ class EmployeeViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def bulk_update(self, items):
+        # Moving to another department moves the employee's days with them,
+        # as the signals do for single saves
+        pks = []
+        for item in items:
+            try:
+                pks.append(int(item['id']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        before = dict(Employee.objects.filter(pk__in=pks).values_list('id', 'department_id'))
+        response = super().bulk_update(items)
+        moved = {pk for pk, department in Employee.objects.filter(
+            pk__in=response.data['updated']).values_list('id', 'department_id') if before[pk] != department}
+        if moved:
+            occupancy.changed(
+                set(EmployeeOccupancy.objects.filter(employee__in=moved).values_list('employee_id', 'day')),
+                {before[pk] for pk in moved if before[pk] is not None})
+        return response
+
+    @action(detail=True)
+    def appointments(self, request, pk=None):
+        '''The employee's calendar: the appointments they organize or take
+        part in, overlapping a `from`/`to` window, by start time'''
+        tables = ('employee', 'appointment')
+        return self.conditional(self.list_appointments, tables, request, pk=pk)
+
+    def list_appointments(self, request, pk=None):
+        employee = self.get_object()
+        start, end = parse_window(request.query_params)
+        rows = AppointmentRowSerializer.rows(
+            involving(Appointment.objects.all(), employee.pk, start, end))
+
+        if start is not None and end is not None:
+            rows, series = split_series(rows)
+            page = self.paginator.paginate_merged(
+                rows, occurrence_streams(series, start, end), request, view=AppointmentViewSet)
+        else:
+            page = self.paginator.paginate_queryset(rows, request, view=AppointmentViewSet)
+        return self.get_paginated_response(AppointmentRowSerializer(page, many=True).data)
+
+    @action(detail=False)
+    def search(self, request):
+        '''Employees whose name or email starts with, or nearly matches, `q`,
+        best first, optionally of one `department`. At most `limit` (20) of
+        them, unpaginated.'''
+        return self.conditional(self.list_matches, ('employee',), request)
+
+    def list_matches(self, request):
+        params = request.query_params
+        q = params.get('q', '').strip()
+        if not q:
+            raise ValidationError({'q': 'A search term is required'})
+
+        try:
+            department = int(params['department']) if params.get('department') else None
+        except ValueError:
+            raise ValidationError({'department': 'A department id is required'})
+        try:
+            limit = int(params.get('limit', 20))
+        except ValueError:
+            raise ValidationError({'limit': 'A number is required'})
+        if not 0 < limit <= self.search_max_limit:
+            raise ValidationError({'limit': f'Between 1 and {self.search_max_limit} results can be asked for'})
 
-class DepartmentViewSet(viewsets.ModelViewSet):
+        employees = search_employees(self.get_queryset(), q, department, limit)
+        return Response({'results': self.get_serializer(employees, many=True).data})
+
+
+class DepartmentViewSet(ConditionalMixin, ReferenceCacheMixin, ExpandMixin, BatchRetrieveMixin,
+                        viewsets.ModelViewSet):
     queryset = Department.objects.all()
     serializer_class = DepartmentSerializer
+    conditional_tables = ('department',)
+    reference_tables = ('department',)
 
     @action(detail=True)
     def employees(self, request, pk=None):
+        tables = ('department', 'employee')
+        return self.conditional(
+            partial(self.cached_response, self.list_employees, tables), tables, request, pk=pk)
+
+    def list_employees(self, request, pk=None):
         department = self.get_object()
 
+        page = self.paginate_queryset(department.employees.all())
+        if page is not None:
+            return self.get_paginated_response(EmployeeSerializer(page, many=True).data)
+
         return Response(DepartmentEmployeesSerializer(department).data.get('employees'))
 
 
-class PositionViewSet(viewsets.ModelViewSet):
+class PositionViewSet(ConditionalMixin, ReferenceCacheMixin, ExpandMixin, BatchRetrieveMixin,
+                      viewsets.ModelViewSet):
     queryset = Position.objects.all()
     serializer_class = PositionSerializer
+    conditional_tables = ('position',)
+    reference_tables = ('position',)
 
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+def appointment_queryset():
+    '''Appointments with everything `AppointmentSerializer` touches loaded up
+    front. `employee` is rendered from `employee_id`, so it needs no join, but
+    `participation` would cost a query per appointment without the prefetch,
+    which only pulls the ids the serializer renders, in the order
+    `AppointmentRowSerializer` renders them.'''
+    return Appointment.objects.prefetch_related(
+        Prefetch('participation', queryset=Employee.objects.only('id').order_by('id')))
+
+
+class AppointmentViewSet(ConditionalMixin, BulkMixin, ExportMixin, ExpandMixin, BatchRetrieveMixin,
+                         RowListMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
+    row_serializer_class = AppointmentRowSerializer
+    conditional_tables = ('appointment',)
+    bulk_invalidates = ('appointment',)
+    # Pagination key, `id` breaks the ties between appointments starting together
+    ordering = ('start', 'id')
+    # What occurrences of a series are generated from, whatever `fields` asks for
+    expand_always_load = ('end', 'recurrence', 'recurrence_exceptions')
+
+    def get_queryset(self):
+        '''Allow narrowing the list to the appointments overlapping a `from`/`to` window'''
+        queryset = appointment_queryset()
+        if self.action in ('list', 'export'):
+            start, end = parse_window(self.request.query_params)
+            queryset = occurring(queryset, start, end)
+
+        return queryset
+
+    def series_window(self):
+        '''The window to list the occurrences of recurring appointments in,
+        both `from` and `to` have to be given'''
+        start, end = parse_window(self.request.query_params)
+        if start is None or end is None:
+            return None
+        return start, end
+
+    def paginate_queryset(self, queryset):
+        window = self.series_window() if self.action == 'list' else None
+        if window is None:
+            return super().paginate_queryset(queryset)
+        singles, series = split_series(queryset)
+        return self.paginator.paginate_merged(
+            singles, occurrence_streams(series, *window), self.request, view=self)
+
+    def export_instances(self, queryset):
+        window = self.series_window()
+        if window is None:
+            return super().export_instances(queryset)
+        singles, series = split_series(queryset)
+        return merged(super().export_instances(singles),
+                      occurrence_streams(series, *window), self.ordering)
+
+    def bulk_prepare(self, instance):
+        instance.set_recurrence_until()
+        return ('recurrence_until',)
+
+    # The bulk writes skip the signals keeping the daily occupancy, deletes
+    # go through them
+
+    def bulk_create(self, items):
+        response = super().bulk_create(items)
+        occupancy.changed(occupancy.cells(response.data['created']))
+        return response
+
+    def bulk_update(self, items):
+        pks = []
+        for item in items:
+            try:
+                pks.append(int(item['id']))
+            except (KeyError, TypeError, ValueError):
+                pass
+        before = occupancy.cells(pks)
+        response = super().bulk_update(items)
+        occupancy.changed(before | occupancy.cells(response.data['updated']))
+        return response
+
+    def perform_create(self, serializer):
+        self.check_conflicts(serializer)
+        super().perform_create(serializer)
+        self.publish('created', serializer.instance)
+
+    def perform_update(self, serializer):
+        self.check_conflicts(serializer)
+        super().perform_update(serializer)
+        # The prefetched participants are from before the update
+        serializer.instance._prefetched_objects_cache = {}
+        self.publish('updated', serializer.instance)
+
+    def perform_destroy(self, instance):
+        publish_appointment('deleted', instance, {'id': instance.pk})
+        super().perform_destroy(instance)
+
+    def bulk_done(self, response):
+        # Too many for one event each, subscribers pull them from `changes/`
+        broadcaster.publish('resync', {'detail': 'Appointments were changed in bulk'})
+
+    def publish(self, kind, instance):
+        publish_appointment(kind, instance, AppointmentSerializer(instance).data)
+
+    def check_conflicts(self, serializer):
+        '''With `?check_conflicts=true`, refuse the write with a 409 if the
+        organizer or any participant is already booked at that time, or at
+        any occurrence of a recurring one'''
+        if self.request.query_params.get('check_conflicts', '').lower() not in ('1', 'true', 'yes'):
+            return
+
+        instance = serializer.instance
+        data = serializer.validated_data
+        start = data.get('start', getattr(instance, 'start', None))
+        end = data.get('end', getattr(instance, 'end', None))
+
+        if 'participation' in data:
+            employees = {e.pk for e in data['participation']}
+        elif instance is not None:
+            employees = {e.pk for e in instance.participation.all()}
+        else:
+            employees = set()
+        employee = data['employee'] if 'employee' in data else getattr(instance, 'employee', None)
+        if employee is not None:
+            employees.add(employee.pk)
+
+        recurrence = data.get('recurrence', getattr(instance, 'recurrence', ''))
+        exceptions = data.get('recurrence_exceptions', getattr(instance, 'recurrence_exceptions', None))
+        conflicts = find_conflicts(
+            start, end, employees, exclude=getattr(instance, 'pk', None),
+            recurrence=recurrence, exceptions=exceptions or ())
+        if conflicts:
+            raise AppointmentConflict(conflicts)
+
+    @action(detail=False)
+    def changes(self, request):
+        '''Appointments changed and deleted since the `since` token of the
+        previous call, and the token to pass next time. Without a token it
+        starts with every appointment. Keep calling while `has_more` is set.
+        With `resync` set the token was too old to tell what was deleted, the
+        feed started over and the client has to drop what it had.'''
+        # A replica behind the primary could let the positions skip rows
+        with primary_reads():
+            changed, deleted, token, has_more, resync = changes_since(
+                appointment_queryset(), request.query_params.get('since'),
+                self.paginator.get_page_size(request))
+            changed = self.get_serializer(changed, many=True).data
+
+        return Response({
+            'changed': changed,
+            'deleted': deleted,
+            'token': token,
+            'has_more': has_more,
+            'resync': resync,
+        })
+
+    @action(detail=False)
+    def layout(self, request):
+        '''Appointments of a single day, grouped into overlapping clusters
+        with a column assigned to each, ready to be laid out by the calendar.
+        The day is `from`/`to`, the instants it starts and ends at where the
+        client is (e.g. `2025-06-09T00:00:00+02:00`), or a `date` in the
+        server's time zone.'''
+        params = request.query_params
+        if params.get('from') or params.get('to'):
+            start, end = parse_window(params)
+            if start is None or end is None:
+                raise ValidationError({'to': 'Both `from` and `to` are required'})
+            if end - start > LAYOUT_MAX_WINDOW:
+                raise ValidationError({'to': 'The window can be at most a day long'})
+        else:
+            _, start, end = parse_day(params)
+
+        version = get_version('appointment')
+        key = f'api:layout:{version}:{start.timestamp()}:{end.timestamp()}'
+        data = cache.get(key)
+        if data is None:
+            ordering = ('start', 'end', 'id')
+            with reads_after({'appointment': version}):
+                singles, series = split_series(occurring(appointment_queryset(), start, end))
+                appointments = merged(singles.order_by(*ordering),
+                                      occurrence_streams(series, start, end), ordering)
+                data = self._serialize_layout(overlap_groups(appointments))
+            cache.set(key, data, LAYOUT_CACHE_TIMEOUT)
+
+        return Response(data)
+
+    def _serialize_layout(self, groups):
+        appointments = [appointment for _, members in groups
+                        for appointment, _ in members]
+        serialized = iter(AppointmentSerializer(appointments, many=True).data)
+        timestamp = serializers.DateTimeField()
+
+        data = []
+        for columns, members in groups:
+            data.append({
+                'start': timestamp.to_representation(members[0][0].start),
+                'end': timestamp.to_representation(max(a.end for a, _ in members)),
+                'columns': columns,
+                'appointments': [{**next(serialized), 'column': column}
+                                 for _, column in members],
+            })
+
+        return data
+
+
+class OccupancyViewSet(ConditionalMixin, viewsets.ViewSet):
+    '''Daily occupancy for month views and heatmaps, from the aggregates
+    api.occupancy keeps: booked minutes, appointment count and first/last
+    busy time per day of a `from`/`to` window. For one `department`, one
+    `employee`, or every department. Days without appointments are left out.'''
+    max_days = 400
+
+    def list(self, request):
+        return self.conditional(self.list_days, (occupancy.VERSION,), request)
+
+    def list_days(self, request):
+        params = request.query_params
+        start, end = parse_window(params)
+        if start is None or end is None:
+            raise ValidationError({'to': 'Both `from` and `to` are required'})
+        # The days are those of the default time zone
+        tz = timezone.get_default_timezone()
+        first = timezone.localtime(start, tz).date()
+        last = timezone.localtime(end - timedelta(microseconds=1), tz).date()
+        if (last - first).days >= self.max_days:
+            raise ValidationError({'to': f'The window can be at most {self.max_days} days'})
+        if last > occupancy.horizon():
+            raise ValidationError({'to': f'Days are only counted up to {occupancy.horizon().isoformat()}'})
+
+        if params.get('employee'):
+            key, queryset = 'employee', EmployeeOccupancy.objects.filter(
+                employee_id=self.parse_id(params, 'employee'))
+        elif params.get('department'):
+            key, queryset = 'department', DepartmentOccupancy.objects.filter(
+                department_id=self.parse_id(params, 'department'))
+        else:
+            key, queryset = 'department', DepartmentOccupancy.objects.all()
+
+        rows = (queryset.filter(day__gte=first, day__lte=last).order_by(key, 'day')
+                .values(key, 'day', 'booked_minutes', 'appointments', 'first_start', 'last_end'))
+        tz = timezone.get_current_timezone()
+        return Response({
+            'from': first.isoformat(),
+            'to': last.isoformat(),
+            'days': [{**row, 'day': row['day'].isoformat(),
+                      'first_start': timestamp(row['first_start'], tz),
+                      'last_end': timestamp(row['last_end'], tz)} for row in rows],
+        })
+
+    def parse_id(self, params, name):
+        try:
+            return int(params[name])
+        except ValueError:
+            raise ValidationError({name: f'A {name} id is required'})
+
+
+class ReferenceCacheStatsViewSet(viewsets.ViewSet):
+    '''Hit/miss counters of this worker's reference data cache'''
+
+    def list(self, request):
+        return Response(reference_cache.stats())
+
+
+class HealthViewSet(viewsets.ViewSet):
+    '''Database liveness and connection pool utilization of this worker,
+    503 when a database can't be reached'''
+
+    def list(self, request):
+        data = health()
+        return Response(data, status=200 if data['status'] == 'ok' else 503)
+
+
+class AvailabilityViewSet(viewsets.ViewSet):
+    '''Free/busy lookup for a group of people.
+
+    Takes the people as a comma separated `employees` list or a `department`,
+    a `from`/`to` window and a `duration` in minutes. Returns everyone's busy
+    intervals, merged, and the free slots of at least `duration` they share.'''
+    max_employees = 1000
+    max_window = timedelta(days=93)
+
+    def list(self, request):
+        params = request.query_params
+        start, end = parse_window(params)
+        if start is None or end is None:
+            raise ValidationError({'to': 'Both `from` and `to` are required'})
+        if end - start > self.max_window:
+            raise ValidationError({'to': f'The window can be at most {self.max_window.days} days'})
+
+        try:
+            duration = timedelta(minutes=int(params.get('duration', 30)))
+        except ValueError:
+            raise ValidationError({'duration': 'A number of minutes is required'})
+        if duration <= timedelta(0):
+            raise ValidationError({'duration': 'A positive number of minutes is required'})
+
+        employees = self.get_employees(params)
+        per_employee, everyone = busy_intervals(employees, start, end)
+
+        timestamp = serializers.DateTimeField()
+
+        def intervals(items):
+            return [{'start': timestamp.to_representation(s),
+                     'end': timestamp.to_representation(e)} for s, e in items]
+
+        return Response({
+            'from': timestamp.to_representation(start),
+            'to': timestamp.to_representation(end),
+            'duration': int(duration.total_seconds() // 60),
+            'busy': [{'employee': employee, 'intervals': intervals(per_employee[employee])}
+                     for employee in employees],
+            'free': intervals(gaps(everyone, start, end, duration)),
+        })
+
+    def get_employees(self, params):
+        if params.get('department'):
+            try:
+                department = int(params['department'])
+            except ValueError:
+                raise ValidationError({'department': 'A department id is required'})
+            employees = list(Employee.objects.filter(
+                department_id=department).order_by('id').values_list('id', flat=True))
+        elif params.get('employees'):
+            try:
+                employees = list(dict.fromkeys(
+                    int(pk) for pk in params['employees'].split(',') if pk.strip()))
+            except ValueError:
+                raise ValidationError({'employees': 'A comma separated list of ids is required'})
+        else:
+            raise ValidationError({'employees': 'Either `employees` or `department` is required'})
+
+        if len(employees) > self.max_employees:
+            raise ValidationError({'employees': f'At most {self.max_employees} employees are accepted'})
+
+        return employees
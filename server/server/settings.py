@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from copy import deepcopy
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 import os
 
@@ -48,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, to time everything below it. Off unless API_INSTRUMENTATION is set
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -56,6 +60,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.replicas.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'server.urls'
@@ -84,14 +89,100 @@ WSGI_APPLICATION = 'server.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'postgres',
+        'NAME': os.getenv('POSTGRES_DB') or 'postgres',
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
-        'HOST': '127.0.0.1',
-        'PORT': '5432'
+        'HOST': os.getenv('POSTGRES_HOST') or '127.0.0.1',
+        'PORT': os.getenv('POSTGRES_PORT') or '5432',
+        # Test reused connections before handing them to a request
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Connection reuse. By default every worker keeps a psycopg pool of
+# POSTGRES_POOL_MIN_SIZE..POSTGRES_POOL_MAX_SIZE connections, requests wait up
+# to POSTGRES_POOL_TIMEOUT seconds for one. With POSTGRES_POOL=false there's a
+# single connection per thread instead, kept for POSTGRES_CONN_MAX_AGE seconds.
+# Django doesn't allow both. `/health/` shows how busy the pools are.
+if os.getenv('POSTGRES_POOL', 'true').lower() in ('1', 'true', 'yes'):
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('POSTGRES_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('POSTGRES_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('POSTGRES_POOL_TIMEOUT', 10)),
+            # Idle connections above `min_size` are closed after this long
+            'max_idle': float(os.getenv('POSTGRES_POOL_MAX_IDLE', 600)),
+            # Connections are replaced after this long, whatever their state
+            'max_lifetime': float(os.getenv('POSTGRES_POOL_MAX_LIFETIME', 3600)),
+            # Test connections before handing them out, unless turned off
+            'check': (ConnectionPool.check_connection
+                      if os.getenv('POSTGRES_POOL_CHECK', 'true').lower() in ('1', 'true', 'yes')
+                      else None),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('POSTGRES_CONN_MAX_AGE', 60))
+
+# Read replicas, a comma separated `host[:port]` list. They're `replica1`,
+# `replica2`... with the primary's other settings, and serve the reads of
+# GET requests (see api/replicas.py), picked round robin or by the least
+# replication lag (POSTGRES_REPLICA_SELECTION=least_lag).
+for i, replica in enumerate(filter(None, os.getenv('POSTGRES_REPLICAS', '').split(',')), start=1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{i}'] = {
+        **deepcopy(DATABASES['default']),
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+API_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'SELECTION': os.getenv('POSTGRES_REPLICA_SELECTION') or 'round_robin',
+    # A client reads from the primary for this long after writing something,
+    # if it sends cookies back (cross-origin that's `credentials: 'include'`)
+    'STICKY_SECONDS': float(os.getenv('POSTGRES_REPLICA_STICKY_SECONDS') or 5),
+    # `least_lag` skips replicas further behind than this
+    'MAX_LAG': float(os.getenv('POSTGRES_REPLICA_MAX_LAG') or 30),
+}
+
+
+# The version markers, the layout cache and the shared reference cache live in
+# the default cache (see api/versions.py), which every worker has to see for
+# one's writes to invalidate what the others cached. CACHE_URL is a Redis
+# (`redis://host:6379/0`) or memcached (`memcached://host:11211`, needs
+# pymemcache installed) server, it can only be left out with a single worker
+# process.
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': 'calendar',
+        },
+    }
+elif CACHE_URL.startswith('memcached://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': CACHE_URL[len('memcached://'):],
+            'KEY_PREFIX': 'calendar',
+        },
+    }
+elif CACHE_URL:
+    raise ImproperlyConfigured(f'CACHE_URL has to be a redis:// or memcached:// URL, not {CACHE_URL}')
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -141,6 +232,39 @@ CORS_ALLOWED_ORIGINS = [
     'http://127.0.0.1:5000',
 ]
 
+# In-process cache of department/position data, see api/reference_cache.py
+API_REFERENCE_CACHE = {
+    'BACKEND': os.getenv('API_REFERENCE_CACHE_BACKEND', 'local'),
+    'MAX_ENTRIES': int(os.getenv('API_REFERENCE_CACHE_MAX_ENTRIES', 512)),
+}
+
+# Per-view timings, query counts and N+1 detection, served at /metrics/ for
+# Prometheus, and profiles of slow requests, see api/instrumentation.py
+API_INSTRUMENTATION = {
+    'ENABLED': os.getenv('API_INSTRUMENTATION', 'false').lower() in ('1', 'true', 'yes'),
+    # The same statement this many times in one request is reported
+    'DUPLICATE_QUERIES': int(os.getenv('API_INSTRUMENTATION_DUPLICATE_QUERIES') or 5),
+    # Share of the requests profiled, and which of those profiles are kept
+    'PROFILE_SAMPLE_RATE': float(os.getenv('API_PROFILE_SAMPLE_RATE') or 0),
+    'PROFILE_THRESHOLD': float(os.getenv('API_PROFILE_THRESHOLD_MS') or 500) / 1000,
+    'PROFILE_DIR': os.getenv('API_PROFILE_DIR') or BASE_DIR / 'profiles',
+}
+
+# Appointment changes are only sent to syncing clients once they're this old,
+# so transactions still committing aren't skipped (see api/changes.py)
+APPOINTMENT_CHANGES_SETTLE_SECONDS = 2
+# Deleted appointments are reported for this long, `manage.py prune_tombstones`
+# (run it daily) drops older tombstones, clients with older tokens resync
+APPOINTMENT_TOMBSTONE_RETENTION_DAYS = int(os.getenv('APPOINTMENT_TOMBSTONE_RETENTION_DAYS') or 30)
+
 REST_FRAMEWORK = {
-    'EXCEPTION_HANDLER': 'api.handlers.custom_exception_handler'
+    'EXCEPTION_HANDLER': 'api.handlers.custom_exception_handler',
+    # orjson when it's installed, same output as DRF's JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Keyset pagination, clients can ask for up to 1000 rows with `page_size`
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
 }
@@ -18,15 +18,31 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 
-from api.views import AppointmentViewSet, DepartmentViewSet, EmployeeViewSet, PositionViewSet
+from api.async_views import appointment_detail, appointment_list, department_employees
+from api.events import appointment_events
+from api.instrumentation import metrics_view
+from api.views import AppointmentViewSet, AvailabilityViewSet, DepartmentViewSet, EmployeeViewSet, HealthViewSet, OccupancyViewSet, PositionViewSet, ReferenceCacheStatsViewSet
 
 router = routers.DefaultRouter()
 router.register(r'employees', EmployeeViewSet)
 router.register(r'departments', DepartmentViewSet)
 router.register(r'appointments', AppointmentViewSet)
 router.register(r'positions', PositionViewSet)
+router.register(r'availability', AvailabilityViewSet, basename='availability')
+router.register(r'stats/occupancy', OccupancyViewSet, basename='occupancy')
+router.register(r'reference-cache', ReferenceCacheStatsViewSet, basename='reference-cache')
+router.register(r'health', HealthViewSet, basename='health')
 
 urlpatterns = [
+    # Ahead of the router, which would take `events` for an appointment id
+    path('appointments/events/', appointment_events, name='appointment-events'),
+    # Async reads, see `api.async_views`
+    path('async/appointments/', appointment_list, name='async-appointment-list'),
+    path('async/appointments/<int:pk>/', appointment_detail, name='async-appointment-detail'),
+    path('async/departments/<int:pk>/employees/', department_employees,
+         name='async-department-employees'),
+    # Prometheus scrapes, when instrumentation is on
+    path('metrics/', metrics_view, name='metrics'),
     path('', include(router.urls)),
     path('admin/', admin.site.urls),
 ]